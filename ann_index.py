@@ -0,0 +1,293 @@
+"""
+Approximate nearest-neighbour tier for large user memory indexes.
+
+Once a user's index grows past MEMORY_ANN_THRESHOLD rows, an inverted-file
+(IVF) structure is trained over it: spherical k-means centroids partition the
+rows into lists, and a search only scores the rows in the ``nprobe`` lists
+whose centroids are closest to the query. The IVF holds row numbers, not
+vectors, so it shares the UserMemoryIndex matrix instead of copying it, and
+candidates are re-scored exactly from that matrix.
+
+Trained centroids and list assignments are saved under VECTOR_DB_PATH so a
+restart does not have to retrain.
+"""
+
+import os
+import re
+import logging
+import threading
+import numpy as np
+import config
+from embeddings import get_embedder, model_slug
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Rows scored per chunk when assigning rows to centroids
+ASSIGN_CHUNK = 8192
+
+# Largest number of rows sampled to train centroids
+TRAIN_SAMPLE = 50000
+
+
+class IVFIndex:
+    """
+    Inverted lists over the rows of a UserMemoryIndex.
+
+    ``row_list[row]`` is the list a row belongs to and ``row_pos[row]`` its slot
+    in that list, so removing a row or relabelling the row moved into its place
+    by UserMemoryIndex.remove() is O(1).
+    """
+
+    def __init__(self, centroids, built_size=0):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nlist = len(self.centroids)
+        self.built_size = built_size
+        self.mutations = 0
+        self._lists = [np.empty(16, dtype=np.int64) for _ in range(self.nlist)]
+        self._counts = np.zeros(self.nlist, dtype=np.int64)
+        self.row_list = np.full(0, -1, dtype=np.int32)
+        self.row_pos = np.zeros(0, dtype=np.int64)
+
+    def _ensure_rows(self, count):
+        if count <= len(self.row_list):
+            return
+        capacity = max(count, 2 * len(self.row_list), 64)
+        row_list = np.full(capacity, -1, dtype=np.int32)
+        row_list[:len(self.row_list)] = self.row_list
+        row_pos = np.zeros(capacity, dtype=np.int64)
+        row_pos[:len(self.row_pos)] = self.row_pos
+        self.row_list = row_list
+        self.row_pos = row_pos
+
+    def _append(self, list_id, row):
+        count = self._counts[list_id]
+        members = self._lists[list_id]
+        if count == len(members):
+            grown = np.empty(2 * len(members), dtype=np.int64)
+            grown[:count] = members
+            self._lists[list_id] = members = grown
+        members[count] = row
+        self._counts[list_id] = count + 1
+        self.row_list[row] = list_id
+        self.row_pos[row] = count
+
+    def _detach(self, row):
+        """Take a row out of its list, filling the slot with the list's last member."""
+        list_id = self.row_list[row]
+        if list_id < 0:
+            return
+        members = self._lists[list_id]
+        pos = self.row_pos[row]
+        last = self._counts[list_id] - 1
+        if pos != last:
+            moved = members[last]
+            members[pos] = moved
+            self.row_pos[moved] = pos
+        self._counts[list_id] = last
+        self.row_list[row] = -1
+
+    def assign(self, vectors):
+        """Nearest centroid for each vector."""
+        vectors = np.atleast_2d(vectors)
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGN_CHUNK):
+            chunk = vectors[start:start + ASSIGN_CHUNK]
+            assignments[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assignments
+
+    def add_rows(self, first_row, list_ids):
+        """Append consecutive rows starting at ``first_row`` to the given lists."""
+        self._ensure_rows(first_row + len(list_ids))
+        for offset, list_id in enumerate(list_ids):
+            self._append(int(list_id), first_row + offset)
+
+    def add(self, row, vector):
+        self._ensure_rows(row + 1)
+        self._append(int(self.assign(vector)[0]), row)
+        self.mutations += 1
+
+    def reassign(self, row, vector):
+        """Move a row whose vector changed to its new nearest list."""
+        self._detach(row)
+        self._append(int(self.assign(vector)[0]), row)
+        self.mutations += 1
+
+    def remove(self, row, last):
+        """
+        Mirror UserMemoryIndex.remove(): ``row`` is deleted and, if different,
+        ``last`` is renumbered to ``row``.
+        """
+        self._detach(row)
+        if row != last and self.row_list[last] >= 0:
+            list_id = self.row_list[last]
+            pos = self.row_pos[last]
+            self._lists[list_id][pos] = row
+            self.row_list[row] = list_id
+            self.row_pos[row] = pos
+            self.row_list[last] = -1
+        self.mutations += 1
+
+    def candidates(self, query, nprobe):
+        """Rows in the ``nprobe`` lists nearest to the query."""
+        nprobe = min(nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.nlist)
+        return np.concatenate([self._lists[list_id][:self._counts[list_id]] for list_id in probe])
+
+
+def train_centroids(vectors, nlist, iterations=8, seed=0):
+    """Spherical k-means over unit vectors; returns unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > TRAIN_SAMPLE:
+        vectors = vectors[rng.choice(len(vectors), TRAIN_SAMPLE, replace=False)]
+    nlist = min(nlist, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters from random rows
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+def default_nlist(size):
+    """Number of inverted lists for an index of ``size`` rows (about sqrt(n))."""
+    return max(16, int(np.sqrt(size)))
+
+
+def build_ivf(index, nlist=None):
+    """Train an IVF over a UserMemoryIndex's current rows and attach it."""
+    with index.lock:
+        size = index.size
+        snapshot = index.matrix[:size].copy()
+
+    # Training runs without the lock so searches carry on using exact scoring
+    centroids = train_centroids(snapshot, nlist or default_nlist(size))
+    ivf = IVFIndex(centroids, built_size=size)
+
+    with index.lock:
+        ivf.add_rows(0, ivf.assign(index.matrix[:index.size]))
+        index.ann = ivf
+    logger.info(f"Built ANN index for user {index.user_id}: {index.size} rows, {ivf.nlist} lists")
+    return ivf
+
+
+def ann_path(user_id):
+    """Saved per embedding model, like segments: centroids trained on one model do not fit another."""
+    safe_id = re.sub(r'[^\w.-]', '_', str(user_id))
+    return os.path.join(config.VECTOR_DB_PATH, "ann", model_slug(get_embedder().model_version),
+                        f"{safe_id}.npz")
+
+
+def save_ivf(index, path=None):
+    """Persist centroids and each memory's list assignment."""
+    path = path or ann_path(index.user_id)
+    with index.lock:
+        ivf = index.ann
+        if ivf is None:
+            return False
+        memory_ids = index.ids[:index.size].copy()
+        list_ids = ivf.row_list[:index.size].copy()
+        centroids = ivf.centroids
+        built_size = ivf.built_size
+        ivf.mutations = 0
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp.npz"
+    np.savez(temp_path, centroids=centroids, memory_ids=memory_ids, list_ids=list_ids,
+             built_size=np.int64(built_size))
+    os.replace(temp_path, path)
+    return True
+
+
+def load_ivf(index, path=None):
+    """Attach a saved IVF to an index if one exists and matches its dimension."""
+    path = path or ann_path(index.user_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as saved:
+            centroids = saved['centroids']
+            saved_lists = dict(zip(saved['memory_ids'].tolist(), saved['list_ids'].tolist()))
+            built_size = int(saved['built_size'])
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable ANN index {path}: {e}")
+        return None
+    if centroids.shape[1] != index.dim:
+        return None
+
+    ivf = IVFIndex(centroids, built_size=built_size)
+    with index.lock:
+        list_ids = np.fromiter(
+            (saved_lists.get(int(memory_id), -1) for memory_id in index.ids[:index.size]),
+            dtype=np.int32, count=index.size
+        )
+        unassigned = np.flatnonzero(list_ids < 0)
+        if len(unassigned):
+            list_ids[unassigned] = ivf.assign(index.matrix[unassigned])
+        ivf.add_rows(0, list_ids)
+        index.ann = ivf
+    return ivf
+
+
+_builds_in_progress = set()
+_builds_lock = threading.Lock()
+
+
+def maybe_update_ann(index, background=True):
+    """
+    Keep a user's ANN tier in step with its size: build it past the
+    threshold, retrain once the index has grown well beyond the size it was
+    trained on, drop it when the index shrinks, and save it after enough
+    changes.
+    """
+    threshold = config.MEMORY_ANN_THRESHOLD
+    ivf = index.ann
+
+    if ivf is None and index.size >= threshold and index.dim:
+        if load_ivf(index) is not None:
+            return
+        _start_build(index, background)
+    elif ivf is not None:
+        if index.size < threshold // 2:
+            index.ann = None
+        elif index.size > 4 * max(ivf.built_size, 1):
+            _start_build(index, background)
+        elif ivf.mutations >= config.MEMORY_ANN_SAVE_EVERY:
+            save_ivf(index)
+
+
+def _start_build(index, background):
+    with _builds_lock:
+        if index.user_id in _builds_in_progress:
+            return
+        _builds_in_progress.add(index.user_id)
+
+    def run():
+        try:
+            build_ivf(index)
+            save_ivf(index)
+        except Exception as e:
+            logger.error(f"Error building ANN index for user {index.user_id}: {e}")
+        finally:
+            with _builds_lock:
+                _builds_in_progress.discard(index.user_id)
+
+    if background:
+        threading.Thread(target=run, name=f"ann-build-{index.user_id}", daemon=True).start()
+    else:
+        run()
@@ -509,6 +509,27 @@ with app.app_context():
     # Create database tables
     db.create_all()
     
+    # Add columns introduced after tables were first created
+    from db_upgrade import upgrade_schema
+    upgrade_schema()
+    
+    # Full-text index over chat history, maintained by the database itself
+    from message_search import ensure_message_index
+    ensure_message_index()
+    
+    # Full-text index over extracted document text, likewise
+    from document_search import ensure_document_index
+    ensure_document_index()
+    
+    # Temporary PDFs left behind by extractions in processes that died
+    from pdf_extraction import remove_stale_files
+    remove_stale_files()
+    
+    # Embed passages of documents stored before passage retrieval (or by another embedder)
+    if config.DOCUMENT_CHUNK_BACKFILL_ON_START:
+        from document_chunks import backfill_document_chunks_in_background
+        backfill_document_chunks_in_background()
+    
     # Initialize services
     try:
         # Initialize Google services
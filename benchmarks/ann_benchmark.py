@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+ANN Recall/Latency Benchmark
+
+Compares the IVF tier of the memory index against exact brute-force search on
+synthetic clustered embeddings. For each nprobe setting it reports recall@k
+(the fraction of the exact top-k the ANN search also returned) and per-query
+latency, so the MEMORY_ANN_NPROBE default can be tuned.
+
+No database or external services are needed.
+
+Usage:
+    python benchmarks/ann_benchmark.py [--rows N] [--dim D] [--queries Q] [--k K] [--json PATH]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from memory_index import UserMemoryIndex
+from ann_index import build_ivf
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Benchmark ANN recall and latency against exact search.')
+    parser.add_argument('--rows', type=int, default=100000, help='Memories in the synthetic index')
+    parser.add_argument('--dim', type=int, default=256, help='Embedding dimension')
+    parser.add_argument('--clusters', type=int, default=2000, help='Topics the synthetic memories are drawn around')
+    parser.add_argument('--spread', type=float, default=1.0,
+                        help='Per-dimension noise around each topic centre (higher = less clustered)')
+    parser.add_argument('--queries', type=int, default=200, help='Queries to time')
+    parser.add_argument('--k', type=int, default=10, help='Results per query')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64],
+                        help='nprobe values to evaluate')
+    parser.add_argument('--json', help='Write results as JSON to this path')
+    return parser.parse_args()
+
+def synthetic_embeddings(centres, rows, spread, rng):
+    """Unit vectors scattered around the given topic centres."""
+    vectors = centres[rng.integers(0, len(centres), rows)]
+    vectors += spread * rng.standard_normal(vectors.shape).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def time_queries(index, queries, k, exact):
+    """Run every query; return (results, per-query latencies in ms)."""
+    results = []
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        results.append([memory_id for memory_id, _ in index.search(query, k, exact=exact)])
+        latencies.append((time.perf_counter() - started) * 1000)
+    return results, np.array(latencies)
+
+def run_benchmark(rows, dim, clusters, spread, queries, k, nprobes):
+    rng = np.random.default_rng(42)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = synthetic_embeddings(centres, rows, spread, rng)
+    query_vectors = synthetic_embeddings(centres, queries, spread, rng)
+
+    index = UserMemoryIndex("benchmark", dim=dim, capacity=rows)
+    for memory_id, vector in enumerate(vectors):
+        index.upsert(memory_id, vector)
+
+    exact_results, exact_latency = time_queries(index, query_vectors, k, exact=True)
+
+    started = time.perf_counter()
+    ivf = build_ivf(index)
+    build_seconds = time.perf_counter() - started
+
+    report = {
+        "rows": rows,
+        "dim": dim,
+        "k": k,
+        "nlist": ivf.nlist,
+        "build_seconds": round(build_seconds, 3),
+        "exact": {
+            "p50_ms": round(float(np.percentile(exact_latency, 50)), 3),
+            "p99_ms": round(float(np.percentile(exact_latency, 99)), 3)
+        },
+        "ann": []
+    }
+
+    for nprobe in nprobes:
+        config.MEMORY_ANN_NPROBE = nprobe
+        ann_results, ann_latency = time_queries(index, query_vectors, k, exact=False)
+        recall = np.mean([
+            len(set(ann) & set(exact)) / len(exact)
+            for ann, exact in zip(ann_results, exact_results) if exact
+        ])
+        report["ann"].append({
+            "nprobe": nprobe,
+            "recall_at_k": round(float(recall), 4),
+            "p50_ms": round(float(np.percentile(ann_latency, 50)), 3),
+            "p99_ms": round(float(np.percentile(ann_latency, 99)), 3)
+        })
+
+    return report
+
+def print_report(report):
+    print(f"Rows: {report['rows']}  dim: {report['dim']}  k: {report['k']}  "
+          f"lists: {report['nlist']}  build: {report['build_seconds']}s")
+    print(f"{'mode':>12} {'recall@k':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    print(f"{'exact':>12} {1.0:>10.4f} {report['exact']['p50_ms']:>10.3f} {report['exact']['p99_ms']:>10.3f}")
+    for row in report["ann"]:
+        print(f"{'nprobe=' + str(row['nprobe']):>12} {row['recall_at_k']:>10.4f} "
+              f"{row['p50_ms']:>10.3f} {row['p99_ms']:>10.3f}")
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    report = run_benchmark(args.rows, args.dim, args.clusters, args.spread, args.queries, args.k, args.nprobe)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Memory System Benchmark
+
+Measures memory_system end to end at several scales (1k, 100k and 1M
+memories by default), each in its own synthetic user:
+
+- add_memory throughput, over a sample of individual calls;
+- import_memories throughput, which fills the rest of each scale;
+- search_memory p50/p99 latency with the result cache disabled;
+- rehydration time of the user's index from the database, and the process
+  RSS before and after it.
+
+Runs against a throwaway SQLite database with the local embedder; no
+external services are needed. Results are printed as a table and can be
+written as JSON with --json, so runs can be compared in review.
+
+Usage:
+    python benchmarks/memory_benchmark.py [--scales N ...] [--add-sample N] [--queries Q] [--dim D] [--json PATH]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import resource
+import numpy as np
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Benchmark memory_system throughput, latency and memory use.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 100000, 1000000],
+                        help='Memories per synthetic user')
+    parser.add_argument('--add-sample', type=int, default=500,
+                        help='Memories per scale added one at a time with add_memory (the rest are imported)')
+    parser.add_argument('--queries', type=int, default=200, help='Searches timed per scale')
+    parser.add_argument('--limit', type=int, default=5, help='Results per search')
+    parser.add_argument('--dim', type=int, default=256, help='Dimension of the local embedder')
+    parser.add_argument('--vocabulary', type=int, default=20000, help='Distinct words in the synthetic memories')
+    parser.add_argument('--workdir', help='Directory for the database and caches (default a new temporary one)')
+    parser.add_argument('--json', help='Write results as JSON to this path')
+    return parser.parse_args()
+
+def configure_environment(workdir, dim):
+    """Point the app at a throwaway database before it (and its config) is imported."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.sqlite3")
+    os.environ["VECTOR_DB_PATH"] = workdir
+    os.environ["MEMORY_EMBEDDER"] = "local"
+    os.environ["MEMORY_EMBEDDING_DIM"] = str(dim)
+    os.environ["MEMORY_WARM_START"] = "false"
+    os.environ["MEMORY_REEMBED_ON_START"] = "false"
+    # Rehydration is timed from the database, not from segment files
+    os.environ["MEMORY_SHARED_INDEX"] = "false"
+    # Every search is scored, never served from the result cache
+    os.environ["MEMORY_SEARCH_CACHE_SIZE"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def rss_mb():
+    """Current resident set size in MiB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def synthetic_records(words, count, rng, start=0):
+    """Memories of a dozen words drawn from a Zipf-like vocabulary, so term frequencies look like text."""
+    weights = 1.0 / np.arange(1, len(words) + 1)
+    weights /= weights.sum()
+    types = ["note", "project", "person", "event", "idea", "task"]
+    for i in range(start, start + count):
+        picks = rng.choice(len(words), 14, p=weights)
+        yield {
+            "type": types[i % len(types)],
+            "title": f"{words[picks[0]]} {words[picks[1]]} {i}",
+            "content": " ".join(words[pick] for pick in picks[2:])
+        }
+
+def percentile_ms(latencies, q):
+    return round(float(np.percentile(latencies, q)), 3) if len(latencies) else None
+
+def run_scale(scale, words, add_sample, queries, limit, rng):
+    from app import db
+    from models import User
+    import memory_system
+
+    user = User(id=f"bench-{scale}", username=f"bench-{scale}")
+    db.session.add(user)
+    db.session.commit()
+    report = {"memories": scale}
+
+    # Individual add_memory calls, each embedding, committing and indexing one memory
+    add_count = min(add_sample, scale)
+    started = time.perf_counter()
+    for record in synthetic_records(words, add_count, rng):
+        memory_system.add_memory(user, record["type"], record["title"], record["content"])
+    elapsed = time.perf_counter() - started
+    report["add_memory"] = {
+        "calls": add_count,
+        "per_second": round(add_count / elapsed, 1) if elapsed else None,
+        "mean_ms": round(elapsed * 1000 / add_count, 3) if add_count else None
+    }
+
+    # The rest of the scale through the batched import path
+    import_count = scale - add_count
+    started = time.perf_counter()
+    if import_count:
+        memory_system.import_memories(user, synthetic_records(words, import_count, rng, start=add_count), dedup="off")
+    elapsed = time.perf_counter() - started
+    report["import_memories"] = {
+        "memories": import_count,
+        "per_second": round(import_count / elapsed, 1) if import_count and elapsed else None
+    }
+
+    # Rehydrate the user's index from the database, as after a restart
+    memory_system.memory_indexes.pop(user.id, None)
+    db.session.expire_all()
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    index = memory_system.get_user_index(user.id)
+    report["rehydrate"] = {
+        "seconds": round(time.perf_counter() - started, 3),
+        "rows": len(index),
+        "rss_before_mb": round(rss_before, 1),
+        "rss_after_mb": round(rss_mb(), 1)
+    }
+
+    latencies = []
+    for record in synthetic_records(words, queries, rng, start=scale):
+        query = " ".join(record["content"].split()[:4])
+        started = time.perf_counter()
+        memory_system.search_memory(user, query, limit=limit)
+        latencies.append((time.perf_counter() - started) * 1000)
+    report["search_memory"] = {
+        "queries": queries,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99)
+    }
+
+    # Free this scale's index before the next one is measured
+    memory_system.memory_indexes.pop(user.id, None)
+    return report
+
+def run_benchmark(scales, add_sample, queries, limit, dim, vocabulary):
+    from app import app
+    import memory_system
+
+    rng = np.random.default_rng(42)
+    words = [f"w{i}" for i in range(vocabulary)]
+    report = {"dim": dim, "embedder": None, "scales": []}
+    with app.app_context():
+        report["embedder"] = memory_system.embedding_model()
+        for scale in scales:
+            print(f"Running scale {scale}...", file=sys.stderr)
+            report["scales"].append(run_scale(scale, words, add_sample, queries, limit, rng))
+    return report
+
+def print_report(report):
+    print(f"Embedder: {report['embedder']}")
+    print(f"{'memories':>10} {'add/s':>9} {'import/s':>10} {'rehydrate s':>12} {'RSS MiB':>16} "
+          f"{'search p50':>11} {'search p99':>11}")
+    for row in report["scales"]:
+        rss = f"{row['rehydrate']['rss_before_mb']:.0f} -> {row['rehydrate']['rss_after_mb']:.0f}"
+        import_rate = row['import_memories']['per_second']
+        print(f"{row['memories']:>10} {row['add_memory']['per_second'] or 0:>9.1f} "
+              f"{import_rate if import_rate is not None else '-':>10} "
+              f"{row['rehydrate']['seconds']:>12.3f} {rss:>16} "
+              f"{row['search_memory']['p50_ms']:>11.3f} {row['search_memory']['p99_ms']:>11.3f}")
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    configure_environment(args.workdir or tempfile.mkdtemp(prefix="memory_benchmark_"), args.dim)
+    report = run_benchmark(args.scales, args.add_sample, args.queries, args.limit, args.dim, args.vocabulary)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
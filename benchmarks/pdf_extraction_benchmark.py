@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+PDF Extraction Benchmark
+
+Measures pdf_extraction throughput in pages per second, extracting the same
+PDF inline (one process, as before) and with process pools of several sizes,
+and checks that every run returns the same text.
+
+By default the PDF is synthetic: text pages written directly in PDF syntax,
+so no PDF library beyond PyPDF2 is needed. Pass --pdf to time a real file.
+Results are printed as a table and can be written as JSON with --json.
+
+Usage:
+    python benchmarks/pdf_extraction_benchmark.py [--pages N] [--lines N] [--workers W ...] [--pdf PATH] [--json PATH]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_extraction
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Benchmark parallel PDF text extraction in pages per second.')
+    parser.add_argument('--pages', type=int, default=300, help='Pages in the synthetic PDF')
+    parser.add_argument('--lines', type=int, default=50, help='Lines of text per synthetic page')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4],
+                        help='Pool sizes to time (0 extracts inline)')
+    parser.add_argument('--pages-per-task', type=int, default=None,
+                        help='Pages per worker task (default DOCUMENT_PDF_PAGES_PER_TASK)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per pool size; the best is reported')
+    parser.add_argument('--pdf', help='Time this PDF instead of a synthetic one')
+    parser.add_argument('--json', help='Write results as JSON to this path')
+    return parser.parse_args()
+
+def synthetic_pdf(pages, lines):
+    """A PDF of ``pages`` pages, each with ``lines`` lines of Helvetica text."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # the page tree, once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_numbers = []
+    for page in range(pages):
+        text = [b"BT /F1 10 Tf 12 TL 50 780 Td"]
+        for line in range(lines):
+            text.append(f"(Clause {page + 1}.{line + 1}: the parties agree to the terms set out in "
+                        f"schedule {line % 7} of this agreement.) '".encode())
+        text.append(b"ET")
+        stream = b"\n".join(text)
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_numbers.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % number for number in page_numbers)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+def run_benchmark(data, workers_list, pages_per_task, repeat):
+    report = {"runs": []}
+    reference = None
+    for workers in workers_list:
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            extraction = pdf_extraction.extract_pdf(data, workers=workers, pages_per_task=pages_per_task)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        # The first run of a pool size includes starting its workers; later runs reuse them
+        pdf_extraction.shutdown_pool()
+
+        reference = extraction.text if reference is None else reference
+        report["pages"] = len(extraction.pages)
+        report["runs"].append({
+            "workers": workers,
+            "seconds": round(best, 3),
+            "pages_per_second": round(len(extraction.pages) / best, 1) if best else None,
+            "timed_out": len(extraction.timed_out),
+            "same_text": extraction.text == reference
+        })
+    return report
+
+def print_report(report):
+    print(f"Pages: {report['pages']}")
+    print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8} {'timed out':>10} {'same text':>10}")
+    baseline = report["runs"][0]["seconds"] if report["runs"] else None
+    for run in report["runs"]:
+        speedup = baseline / run["seconds"] if baseline and run["seconds"] else 0
+        print(f"{run['workers'] or 'inline':>8} {run['seconds']:>9.3f} {run['pages_per_second'] or 0:>9.1f} "
+              f"{speedup:>7.2f}x {run['timed_out']:>10} {str(run['same_text']):>10}")
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.pdf:
+        with open(args.pdf, 'rb') as f:
+            data = f.read()
+    else:
+        data = synthetic_pdf(args.pages, args.lines)
+    report = run_benchmark(data, args.workers, args.pages_per_task, args.repeat)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
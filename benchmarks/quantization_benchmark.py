@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Int8 Quantization Benchmark
+
+Compares the int8 tier of the memory index against exact float32 search on
+synthetic clustered embeddings. For each re-scoring depth it reports
+recall@k (the fraction of the exact top-k the quantized search also
+returned) and per-query latency, so MEMORY_QUANTIZE_RESCORE can be tuned,
+and the process's private (anonymous) memory before and after the tier is
+built: the int8 codes are added and the float32 matrix moves to a
+file-backed map.
+
+No database or external services are needed.
+
+Usage:
+    python benchmarks/quantization_benchmark.py [--rows N] [--dim D] [--queries Q] [--k K] [--json PATH]
+"""
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from memory_index import UserMemoryIndex
+from quant_index import build_quantized
+from ann_benchmark import synthetic_embeddings, time_queries
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Benchmark int8 recall, latency and memory against exact search.')
+    parser.add_argument('--rows', type=int, default=100000, help='Memories in the synthetic index')
+    parser.add_argument('--dim', type=int, default=256, help='Embedding dimension')
+    parser.add_argument('--clusters', type=int, default=2000, help='Topics the synthetic memories are drawn around')
+    parser.add_argument('--spread', type=float, default=1.0,
+                        help='Per-dimension noise around each topic centre (higher = less clustered)')
+    parser.add_argument('--queries', type=int, default=200, help='Queries to time')
+    parser.add_argument('--k', type=int, default=10, help='Results per query')
+    parser.add_argument('--rescore', type=int, nargs='+', default=[32, 64, 128, 256, 512],
+                        help='Re-scoring depths to evaluate')
+    parser.add_argument('--json', help='Write results as JSON to this path')
+    return parser.parse_args()
+
+def private_bytes():
+    """This process's anonymous resident memory (Linux), or None where it cannot be read."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def run_benchmark(rows, dim, clusters, spread, queries, k, depths):
+    rng = np.random.default_rng(42)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = synthetic_embeddings(centres, rows, spread, rng)
+    query_vectors = synthetic_embeddings(centres, queries, spread, rng)
+
+    # Similarity only, so recall measures quantization and nothing else
+    config.MEMORY_RECENCY_WEIGHT = 0.0
+    config.MEMORY_ACCESS_WEIGHT = 0.0
+
+    index = UserMemoryIndex("benchmark", dim=dim, capacity=rows)
+    index.upsert_many(range(rows), vectors)
+    exact_results, exact_latency = time_queries(index, query_vectors, k, exact=True)
+
+    private_before = private_bytes()
+    quantized = build_quantized(index)
+    private_after = private_bytes()
+    report = {
+        "rows": rows,
+        "dim": dim,
+        "k": k,
+        "float32_bytes": rows * dim * 4,
+        "int8_bytes": quantized.nbytes,
+        "spilled": index.is_spilled(),
+        "private_bytes_change": private_after - private_before if private_before is not None else None,
+        "exact": {
+            "p50_ms": round(float(np.percentile(exact_latency, 50)), 3),
+            "p99_ms": round(float(np.percentile(exact_latency, 99)), 3)
+        },
+        "int8": []
+    }
+
+    for depth in depths:
+        config.MEMORY_QUANTIZE_RESCORE = depth
+        int8_results, int8_latency = time_queries(index, query_vectors, k, exact=False)
+        recall = np.mean([
+            len(set(approximate) & set(exact)) / len(exact)
+            for approximate, exact in zip(int8_results, exact_results) if exact
+        ])
+        report["int8"].append({
+            "rescore": depth,
+            "recall_at_k": round(float(recall), 4),
+            "p50_ms": round(float(np.percentile(int8_latency, 50)), 3),
+            "p99_ms": round(float(np.percentile(int8_latency, 99)), 3)
+        })
+
+    return report
+
+def print_report(report):
+    print(f"Rows: {report['rows']}  dim: {report['dim']}  k: {report['k']}  "
+          f"float32: {report['float32_bytes'] / 2**20:.1f} MiB ({'file-backed' if report['spilled'] else 'private'})  "
+          f"int8 codes: {report['int8_bytes'] / 2**20:.1f} MiB")
+    if report['private_bytes_change'] is not None:
+        print(f"Private memory change from building the tier: {report['private_bytes_change'] / 2**20:+.1f} MiB")
+    print(f"{'mode':>12} {'recall@k':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    print(f"{'exact':>12} {1.0:>10.4f} {report['exact']['p50_ms']:>10.3f} {report['exact']['p99_ms']:>10.3f}")
+    for row in report["int8"]:
+        print(f"{'rescore=' + str(row['rescore']):>12} {row['recall_at_k']:>10.4f} "
+              f"{row['p50_ms']:>10.3f} {row['p99_ms']:>10.3f}")
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    report = run_benchmark(args.rows, args.dim, args.clusters, args.spread, args.queries, args.k, args.rescore)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Memory Search Query-Count Check
+
+Guards against N+1 hydration in memory_system.search_memory: once a user's
+index is loaded, a search must issue exactly one SQL statement no matter how
+many results it returns, filtered or not, and even when some memories have
+no embedding (as during a model migration) and are found by BM25 alone.
+Exits with status 1 if that no longer holds.
+
+Runs against a throwaway SQLite database; no external services are needed.
+
+Usage:
+    python benchmarks/search_query_count.py [--memories N] [--limit K]
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+from contextlib import contextmanager
+
+# Isolate the run before the app (and its config) is imported
+_workdir = tempfile.mkdtemp(prefix="memory_query_count_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'bench.db')}"
+os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(_workdir, "embedding_cache.sqlite3")
+os.environ["VECTOR_DB_PATH"] = _workdir
+os.environ["MEMORY_WARM_START"] = "false"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from app import app, db
+from models import User, MemoryEntry
+import memory_system
+
+# Statements a loaded-index search may issue (the single hydration query)
+MAX_SEARCH_QUERIES = 1
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Check the number of SQL queries issued by search_memory.')
+    parser.add_argument('--memories', type=int, default=200, help='Memories to create')
+    parser.add_argument('--limit', type=int, default=20, help='Results requested per search')
+    parser.add_argument('--text-only-every', type=int, default=10,
+                        help='Strip the embedding of every Nth memory, leaving it to BM25')
+    return parser.parse_args()
+
+@contextmanager
+def count_queries():
+    """Count SQL statements executed on the app's engine inside the block."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+def check_search_query_count(memories, limit, text_only_every):
+    with app.app_context():
+        user = User(id="query-count-user", username="query-count-user")
+        db.session.add(user)
+        db.session.commit()
+
+        memory_ids = [memory_system.add_memory(user, "note", f"Note {i}", f"Project update number {i} for the team",
+                                               dedup="off").id
+                      for i in range(memories)]
+        if text_only_every > 0:
+            MemoryEntry.query.filter(MemoryEntry.id.in_(memory_ids[::text_only_every])).update(
+                {MemoryEntry.packed_embedding: None, MemoryEntry.vector_embedding: None}, synchronize_session=False)
+            db.session.commit()
+            memory_system.memory_indexes.pop(user.id, None)
+
+        # Drop cached ORM objects so hydration has to hit the database
+        db.session.expire_all()
+        index = memory_system.get_user_index(user.id)
+        print(f"{len(index)} memories embedded, {len(index.text_only)} text only")
+
+        passed = True
+        for label, filters in (("unfiltered", {}), ("filtered", {"entry_type": "note"})):
+            with count_queries() as statements:
+                results = memory_system.search_memory(user, "project update for the team", limit, **filters)
+
+            print(f"{label} search_memory returned {len(results)} results using {len(statements)} queries")
+            for statement in statements:
+                print(f"  {' '.join(statement.split())[:120]}")
+
+            if len(results) != min(limit, memories):
+                print(f"FAIL: expected {min(limit, memories)} results")
+                passed = False
+            if len(statements) > MAX_SEARCH_QUERIES:
+                print(f"FAIL: expected at most {MAX_SEARCH_QUERIES} queries per search")
+                passed = False
+    if passed:
+        print("OK")
+    return passed
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    sys.exit(0 if check_search_query_count(args.memories, args.limit, args.text_only_every) else 1)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Memory Compaction
+
+Merges near-duplicate memories that were stored before add_memory caught
+them on insert (see memory_dedup), user by user, and reports how much the
+memory store shrank.
+
+Each user is compacted and committed on its own, so an interrupted run can
+simply be started again.
+
+Usage:
+    python compact_memories.py [--user USER_ID] [--threshold T] [--dry-run]
+"""
+
+import argparse
+import logging
+import time
+from app import app, db
+from models import MemoryEntry
+from db_upgrade import upgrade_schema
+import memory_system
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Merge near-duplicate memories.')
+    parser.add_argument('--user', help='Only compact this user id')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='Similarity at which memories are merged (default MEMORY_DEDUP_THRESHOLD)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report what would be merged')
+    return parser.parse_args()
+
+def compact_memories(user_id=None, threshold=None, dry_run=False):
+    """Compact every user's memories (or one user's). Returns the summed report."""
+    with app.app_context():
+        upgrade_schema()
+
+        if user_id:
+            user_ids = [user_id]
+        else:
+            user_ids = [row[0] for row in db.session.query(MemoryEntry.user_id).distinct().all()]
+
+        totals = {"memories_before": 0, "memories_after": 0, "clusters": 0,
+                  "duplicates_removed": 0, "bytes_before": 0, "bytes_after": 0}
+        started = time.perf_counter()
+
+        for user_id in user_ids:
+            report = memory_system.compact_user_memories(user_id, threshold=threshold, dry_run=dry_run)
+            for key in totals:
+                totals[key] += report[key]
+            if report["duplicates_removed"]:
+                print(f"User {user_id}: {report['memories_before']} -> {report['memories_after']} memories "
+                      f"({report['duplicates_removed']} duplicates in {report['clusters']} clusters)")
+
+        verb = "Would remove" if dry_run else "Removed"
+        print(f"{verb} {totals['duplicates_removed']} duplicates across {len(user_ids)} users "
+              f"in {time.perf_counter() - started:.1f} s")
+        print(f"Memories: {totals['memories_before']} -> {totals['memories_after']}")
+        if totals["bytes_before"]:
+            shrunk = 1 - totals["bytes_after"] / totals["bytes_before"]
+            print(f"Storage: {totals['bytes_before']} -> {totals['bytes_after']} bytes ({shrunk:.1%} smaller)")
+        return totals
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    compact_memories(
+        user_id=args.user,
+        threshold=args.threshold,
+        dry_run=args.dry_run
+    )
@@ -69,6 +69,116 @@ DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///manus_assistant.db")
 # Vector database configuration
 VECTOR_DB_PATH = os.environ.get("VECTOR_DB_PATH", "./vector_db")
 
+# Memory index configuration
+# Load user indexes from the database in a background thread at startup
+MEMORY_WARM_START = os.environ.get("MEMORY_WARM_START", "true").lower() == "true"
+# Rows fetched per round-trip when streaming embeddings out of the database
+MEMORY_LOAD_BATCH_SIZE = int(os.environ.get("MEMORY_LOAD_BATCH_SIZE", 1000))
+# Total embeddings the warm load may bring into memory; the rest load lazily
+MEMORY_WARM_MAX_ROWS = int(os.environ.get("MEMORY_WARM_MAX_ROWS", 200000))
+# Users larger than this are always loaded lazily on their first search
+MEMORY_WARM_MAX_USER_ROWS = int(os.environ.get("MEMORY_WARM_MAX_USER_ROWS", 50000))
+# Precision of stored embeddings: "float32" or "float16"
+MEMORY_EMBEDDING_DTYPE = os.environ.get("MEMORY_EMBEDDING_DTYPE", "float32")
+# Embedding provider: "local" (hashing trick, CPU only) or "openai"
+MEMORY_EMBEDDER = os.environ.get("MEMORY_EMBEDDER", "local")
+# Dimension of the local embedder's vectors
+MEMORY_EMBEDDING_DIM = int(os.environ.get("MEMORY_EMBEDDING_DIM", 512))
+# Model used by the "openai" embedder
+MEMORY_EMBEDDING_MODEL = os.environ.get("MEMORY_EMBEDDING_MODEL", "text-embedding-3-small")
+# On-disk cache of embeddings keyed by content hash and model version
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(VECTOR_DB_PATH, "embedding_cache.sqlite3"))
+# Embeddings kept in that cache; the least recently used are evicted past this
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 100000))
+# Users with at least this many memories are searched through an approximate (IVF) index
+MEMORY_ANN_THRESHOLD = int(os.environ.get("MEMORY_ANN_THRESHOLD", 20000))
+# Inverted lists probed per ANN search; higher is slower but more accurate
+MEMORY_ANN_NPROBE = int(os.environ.get("MEMORY_ANN_NPROBE", 16))
+# Save a user's ANN index to disk after this many inserts, updates or deletes
+MEMORY_ANN_SAVE_EVERY = int(os.environ.get("MEMORY_ANN_SAVE_EVERY", 1000))
+# Keep an int8 copy of large users' embedding matrices, scan it before re-scoring in float32 and
+# move their float32 matrices to file-backed maps under VECTOR_DB_PATH
+MEMORY_QUANTIZE = os.environ.get("MEMORY_QUANTIZE", "false").lower() == "true"
+# Users with at least this many memories get the int8 copy
+MEMORY_QUANTIZE_MIN_ROWS = int(os.environ.get("MEMORY_QUANTIZE_MIN_ROWS", 5000))
+# Candidates from the int8 scan re-scored with full-precision vectors
+MEMORY_QUANTIZE_RESCORE = int(os.environ.get("MEMORY_QUANTIZE_RESCORE", 256))
+# Candidates taken from each retriever (vector and BM25) per result requested before fusion
+MEMORY_HYBRID_CANDIDATES = int(os.environ.get("MEMORY_HYBRID_CANDIDATES", 4))
+# Reciprocal rank fusion constant; larger values flatten the weight of top ranks
+MEMORY_RRF_K = int(os.environ.get("MEMORY_RRF_K", 60))
+# meta_data keys memory searches can filter on (comma separated)
+MEMORY_FILTER_METADATA_KEYS = [key.strip() for key in os.environ.get("MEMORY_FILTER_METADATA_KEYS", "category").split(",") if key.strip()]
+# Share indexes between worker processes through segment files and the memory change log
+MEMORY_SHARED_INDEX = os.environ.get("MEMORY_SHARED_INDEX", "true").lower() == "true"
+# Seconds between polls of the change log; bounds how stale another worker's view can be
+MEMORY_SYNC_INTERVAL = float(os.environ.get("MEMORY_SYNC_INTERVAL", 1.0))
+# Rewrite a user's segment file after this many changes have been applied to the index
+MEMORY_SEGMENT_REWRITE_EVERY = int(os.environ.get("MEMORY_SEGMENT_REWRITE_EVERY", 1000))
+# Hours of change log history kept; older segments are rebuilt from the database instead
+MEMORY_CHANGE_LOG_RETENTION_HOURS = int(os.environ.get("MEMORY_CHANGE_LOG_RETENTION_HOURS", 24))
+
+# Memory search results kept in the per-process LRU cache; 0 disables it
+MEMORY_SEARCH_CACHE_SIZE = int(os.environ.get("MEMORY_SEARCH_CACHE_SIZE", 1024))
+# Memories embedded, inserted and committed together by a bulk import
+MEMORY_IMPORT_CHUNK_SIZE = int(os.environ.get("MEMORY_IMPORT_CHUNK_SIZE", 500))
+# Share of a memory's search score given to how recently it was used (0 ranks by similarity alone)
+MEMORY_RECENCY_WEIGHT = float(os.environ.get("MEMORY_RECENCY_WEIGHT", 0.1))
+# Days after which the recency part of a memory's score has halved
+MEMORY_RECENCY_HALF_LIFE_DAYS = float(os.environ.get("MEMORY_RECENCY_HALF_LIFE_DAYS", 30))
+# Share of a memory's search score given to how often it has been returned by searches
+MEMORY_ACCESS_WEIGHT = float(os.environ.get("MEMORY_ACCESS_WEIGHT", 0.05))
+# Seconds between flushes of buffered access counts to the database
+MEMORY_ACCESS_FLUSH_INTERVAL = float(os.environ.get("MEMORY_ACCESS_FLUSH_INTERVAL", 30))
+# What add_memory does with a near-duplicate of an existing memory of the same type:
+# "merge" into the existing memory, "flag" it in meta_data and store it anyway, or "off"
+MEMORY_DEDUP_MODE = os.environ.get("MEMORY_DEDUP_MODE", "merge").lower()
+# Estimated Jaccard similarity of word shingles at which two memories count as near-duplicates
+MEMORY_DEDUP_THRESHOLD = float(os.environ.get("MEMORY_DEDUP_THRESHOLD", 0.8))
+# Links followed from each memory search hit to related memories (0 disables, at most 2)
+MEMORY_GRAPH_HOPS = int(os.environ.get("MEMORY_GRAPH_HOPS", 1))
+# Related memories attached to one memory search's results in total
+MEMORY_GRAPH_MAX_RELATED = int(os.environ.get("MEMORY_GRAPH_MAX_RELATED", 10))
+
+# Re-embed memories stored by a different embedding model in the background at startup
+MEMORY_REEMBED_ON_START = os.environ.get("MEMORY_REEMBED_ON_START", "true").lower() == "true"
+# Memories re-embedded and committed per batch by the re-embedding job
+MEMORY_REEMBED_BATCH_SIZE = int(os.environ.get("MEMORY_REEMBED_BATCH_SIZE", 100))
+# Seconds the re-embedding job pauses between batches, throttling its load on the database and embedder
+MEMORY_REEMBED_INTERVAL = float(os.environ.get("MEMORY_REEMBED_INTERVAL", 1.0))
+
+# Upper bound on the tokens of conversation sent per memory extraction call
+MEMORY_EXTRACTION_WINDOW_TOKENS = int(os.environ.get("MEMORY_EXTRACTION_WINDOW_TOKENS", 1500))
+# New messages a conversation needs before a background extraction runs mid-conversation
+MEMORY_EXTRACTION_MIN_MESSAGES = int(os.environ.get("MEMORY_EXTRACTION_MIN_MESSAGES", 6))
+
+# Drive downloads are held in memory up to this many bytes, then spill to an anonymous temporary file
+DOCUMENT_SPOOL_MAX_MEMORY = int(os.environ.get("DOCUMENT_SPOOL_MAX_MEMORY", 8 * 1024 * 1024))
+# Drive files larger than this are not downloaded for text extraction (the download stops early)
+DOCUMENT_MAX_DOWNLOAD_BYTES = int(os.environ.get("DOCUMENT_MAX_DOWNLOAD_BYTES", 50 * 1024 * 1024))
+# Bytes requested per Drive download chunk; the size limit is checked after each one
+DOCUMENT_DOWNLOAD_CHUNK_BYTES = int(os.environ.get("DOCUMENT_DOWNLOAD_CHUNK_BYTES", 1024 * 1024))
+# Processes extracting PDF pages in parallel, shared by all documents in this process (0 extracts inline)
+DOCUMENT_PDF_WORKERS = int(os.environ.get("DOCUMENT_PDF_WORKERS", min(4, os.cpu_count() or 1)))
+# Fewest consecutive PDF pages extracted by one worker task (a PDF is split into one range per worker)
+DOCUMENT_PDF_PAGES_PER_TASK = int(os.environ.get("DOCUMENT_PDF_PAGES_PER_TASK", 16))
+# Seconds one PDF page may take to extract before it is skipped (left empty)
+DOCUMENT_PDF_PAGE_TIMEOUT = float(os.environ.get("DOCUMENT_PDF_PAGE_TIMEOUT", 10))
+# Upper bound on the tokens of one document passage embedded for retrieval
+DOCUMENT_CHUNK_TOKENS = int(os.environ.get("DOCUMENT_CHUNK_TOKENS", 200))
+# Tokens each passage shares with the one before it, so text cut at a boundary is whole in one of them
+DOCUMENT_CHUNK_OVERLAP = int(os.environ.get("DOCUMENT_CHUNK_OVERLAP", 40))
+# Passages sent to the embedder per call when a document is indexed
+DOCUMENT_CHUNK_EMBED_BATCH = int(os.environ.get("DOCUMENT_CHUNK_EMBED_BATCH", 64))
+# Index passages of documents stored before passage retrieval, or by another embedder, at startup
+DOCUMENT_CHUNK_BACKFILL_ON_START = os.environ.get("DOCUMENT_CHUNK_BACKFILL_ON_START", "true").lower() == "true"
+# Upper bound on the tokens of document text (or of section summaries) sent per summarization call
+DOCUMENT_SUMMARY_CHUNK_TOKENS = int(os.environ.get("DOCUMENT_SUMMARY_CHUNK_TOKENS", 1500))
+# Summarization calls for one document in flight at once
+DOCUMENT_SUMMARY_CONCURRENCY = int(os.environ.get("DOCUMENT_SUMMARY_CONCURRENCY", 4))
+# On-disk cache of section summaries keyed by content hash and model
+DOCUMENT_SUMMARY_CACHE_PATH = os.environ.get("DOCUMENT_SUMMARY_CACHE_PATH", os.path.join(VECTOR_DB_PATH, "summary_cache.sqlite3"))
+
 # Flask configuration
 SESSION_SECRET = os.environ.get("SESSION_SECRET", "dev_secret_key")
 FLASK_ENV = os.environ.get("FLASK_ENV", "development")
@@ -0,0 +1,248 @@
+"""
+Structured store of business card contacts.
+
+Contacts are saved as MemoryEntry rows of type 'contact' whose content is the
+card's JSON. Finding one by name, email or phone used to mean loading every
+contact and parsing its JSON. Each contact memory now also has a Contact row
+with the card's fields normalized into indexed columns, plus a
+ContactTrigram row per three-character substring of its name:
+
+- email and phone lookups are equality matches on (user_id, email/phone);
+- name prefix lookups are a range scan on (user_id, name_key);
+- name substring lookups intersect the (user_id, trigram) postings of the
+  query's trigrams and confirm the few candidates left.
+
+Contact rows are kept in step with their memories by memory_system (add,
+update, import, compaction and delete all call sync_contacts), and
+backfill_contacts() creates them for contacts stored before this table.
+"""
+
+import re
+import json
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import func
+from app import db
+from models import MemoryEntry, Contact, ContactTrigram
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Contact memories read per batch by the backfill
+BACKFILL_BATCH_SIZE = 500
+
+# Upper bound of a prefix range scan: sorts after any character a name can contain
+_PREFIX_END = "\U0010ffff"
+
+
+def normalize_name(name):
+    """Lower-case a name and collapse its whitespace."""
+    return " ".join((name or "").lower().split())
+
+
+def normalize_email(email):
+    return (email or "").strip().lower() or None
+
+
+def normalize_phone(phone):
+    """Keep only the digits of a phone number, so '+1 (555) 010-2030' and '15550102030' match."""
+    digits = re.sub(r'\D', '', phone or "")
+    return digits or None
+
+
+def trigrams(name_key):
+    """The distinct three-character substrings of a normalized name."""
+    return {name_key[i:i + 3] for i in range(len(name_key) - 2)}
+
+
+def parse_card(content):
+    """The card dict stored in a contact memory's content, or {} if it is not card JSON."""
+    try:
+        card = json.loads(content or "")
+    except (TypeError, ValueError):
+        return {}
+    return card if isinstance(card, dict) else {}
+
+
+def sync_contacts(memory_ids):
+    """
+    Bring the Contact rows of the given memories in line with them, in the
+    current transaction: contact memories get their fields (re)normalized,
+    and memories that are gone or no longer contacts lose their Contact row.
+    """
+    memory_ids = set(memory_ids)
+    if not memory_ids:
+        return
+    entries = MemoryEntry.query.filter(
+        MemoryEntry.id.in_(memory_ids),
+        MemoryEntry.entry_type == 'contact'
+    ).all()
+    contacts = {contact.memory_id: contact for contact in Contact.query.filter(Contact.memory_id.in_(memory_ids))}
+
+    for entry in entries:
+        _update_contact(entry, contacts.pop(entry.id, None))
+    if contacts:
+        delete_contacts(contacts.keys())
+
+
+def delete_contacts(memory_ids):
+    """Delete the Contact rows (and trigrams) of the given memories, in the current transaction."""
+    contact_ids = [contact_id for contact_id, in
+                   db.session.query(Contact.id).filter(Contact.memory_id.in_(list(memory_ids)))]
+    if not contact_ids:
+        return
+    ContactTrigram.query.filter(ContactTrigram.contact_id.in_(contact_ids)).delete(synchronize_session=False)
+    Contact.query.filter(Contact.id.in_(contact_ids)).delete(synchronize_session=False)
+
+
+def _update_contact(entry, contact=None):
+    card = parse_card(entry.content)
+    name = card.get('name') or entry.title
+    if contact is None:
+        contact = Contact(user_id=entry.user_id, memory_id=entry.id)
+        db.session.add(contact)
+    previous_key = contact.name_key
+
+    contact.name = name
+    contact.name_key = normalize_name(name)
+    contact.email = normalize_email(card.get('email'))
+    contact.phone = normalize_phone(card.get('phone'))
+    contact.company = card.get('company')
+    contact.updated_at = datetime.utcnow()
+    db.session.flush()
+
+    if contact.name_key != previous_key:
+        ContactTrigram.query.filter_by(contact_id=contact.id).delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(ContactTrigram, [
+            {"user_id": entry.user_id, "contact_id": contact.id, "trigram": trigram}
+            for trigram in trigrams(contact.name_key)
+        ])
+    return contact
+
+
+def find_contacts_by_email(user_id, email):
+    """Contacts with exactly this email address (ignoring case)."""
+    email = normalize_email(email)
+    if not email:
+        return []
+    return Contact.query.filter_by(user_id=user_id, email=email).all()
+
+
+def find_contacts_by_phone(user_id, phone):
+    """Contacts with this phone number (ignoring formatting)."""
+    phone = normalize_phone(phone)
+    if not phone:
+        return []
+    return Contact.query.filter_by(user_id=user_id, phone=phone).all()
+
+
+def find_contacts_by_name(user_id, query, limit=20):
+    """
+    Contacts whose name contains ``query`` (ignoring case and extra
+    whitespace), in name order. Queries shorter than three characters match
+    name prefixes only.
+    """
+    key = normalize_name(query)
+    if not key:
+        return []
+    if len(key) < 3:
+        return Contact.query.filter(
+            Contact.user_id == user_id,
+            Contact.name_key >= key,
+            Contact.name_key < key + _PREFIX_END
+        ).order_by(Contact.name_key).limit(limit).all()
+
+    # Contacts holding every trigram of the query; confirm the substring on the survivors
+    query_trigrams = trigrams(key)
+    candidate_ids = db.session.query(ContactTrigram.contact_id).filter(
+        ContactTrigram.user_id == user_id,
+        ContactTrigram.trigram.in_(query_trigrams)
+    ).group_by(ContactTrigram.contact_id).having(
+        func.count(func.distinct(ContactTrigram.trigram)) == len(query_trigrams)
+    )
+    candidates = Contact.query.filter(Contact.id.in_(candidate_ids)).order_by(Contact.name_key).all()
+    return [contact for contact in candidates if key in contact.name_key][:limit]
+
+
+def find_contacts_named(user_id, name):
+    """Contacts with exactly this name (ignoring case and extra whitespace), oldest first."""
+    name_key = normalize_name(name)
+    if not name_key:
+        return []
+    return Contact.query.filter_by(user_id=user_id, name_key=name_key).order_by(Contact.id).all()
+
+
+def _email_domain(email):
+    email = normalize_email(email)
+    return email.rsplit('@', 1)[1] if email and '@' in email else None
+
+
+def _shares_detail(contact, card):
+    """Whether ``card`` has the same company, email domain or phone number as ``contact``."""
+    company = normalize_name(card.get('company'))
+    if company and company == normalize_name(contact.company):
+        return True
+    domain = _email_domain(card.get('email'))
+    if domain and domain == _email_domain(contact.email):
+        return True
+    phone = normalize_phone(card.get('phone'))
+    return bool(phone) and phone == contact.phone
+
+
+def find_duplicate_contact(user_id, card):
+    """
+    An existing contact for the same person as ``card``: one with the same
+    email, else the same phone number, else the same name and also the same
+    company or email domain. A name alone is not enough (two people can share
+    one); callers can flag such contacts, found by find_contacts_named. None
+    if there is no such contact.
+    """
+    for matches in (find_contacts_by_email(user_id, card.get('email')),
+                    find_contacts_by_phone(user_id, card.get('phone'))):
+        if matches:
+            return matches[0]
+    for contact in find_contacts_named(user_id, card.get('name')):
+        if _shares_detail(contact, card):
+            return contact
+    return None
+
+
+def backfill_contacts(batch_size=BACKFILL_BATCH_SIZE):
+    """Create Contact rows for contact memories that do not have one yet. Returns how many were created."""
+    created = 0
+    last_id = 0
+    while True:
+        memory_ids = [memory_id for memory_id, in db.session.query(MemoryEntry.id).outerjoin(
+            Contact, Contact.memory_id == MemoryEntry.id
+        ).filter(
+            MemoryEntry.entry_type == 'contact',
+            Contact.id.is_(None),
+            MemoryEntry.id > last_id
+        ).order_by(MemoryEntry.id).limit(batch_size)]
+        if not memory_ids:
+            break
+        sync_contacts(memory_ids)
+        db.session.commit()
+        created += len(memory_ids)
+        last_id = memory_ids[-1]
+
+    if created:
+        logger.info(f"Backfilled {created} contacts")
+    return created
+
+
+def backfill_contacts_in_background():
+    """Run backfill_contacts in a daemon thread so it never blocks application boot."""
+    def run():
+        from app import app
+        try:
+            with app.app_context():
+                backfill_contacts()
+        except Exception as e:
+            logger.error(f"Error backfilling contacts: {e}")
+
+    thread = threading.Thread(target=run, name="contact-backfill", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,50 @@
+"""
+In-place schema upgrades for existing databases.
+
+db.create_all() only creates missing tables; it never adds columns to a table
+that already exists. Columns added to existing models after the first deploy
+are listed here and added with ALTER TABLE at startup.
+"""
+
+import logging
+from sqlalchemy import inspect, text
+from app import db
+from models import MemoryEntry, Conversation
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# (model, column name) pairs added after the model's table first shipped
+ADDED_COLUMNS = [
+    (MemoryEntry, 'packed_embedding'),
+    (MemoryEntry, 'minhash_signature'),
+    (Conversation, 'extracted_message_id'),
+    (MemoryEntry, 'access_count'),
+    (MemoryEntry, 'last_accessed_at'),
+    (MemoryEntry, 'embedding_model'),
+]
+
+def upgrade_schema():
+    """Add any columns from ADDED_COLUMNS that the live database is missing."""
+    inspector = inspect(db.engine)
+    added = []
+
+    for model, column_name in ADDED_COLUMNS:
+        table_name = model.__table__.name
+        if not inspector.has_table(table_name):
+            continue  # create_all() builds the full table
+
+        existing = {column['name'] for column in inspector.get_columns(table_name)}
+        if column_name in existing:
+            continue
+
+        column = model.__table__.columns[column_name]
+        column_type = column.type.compile(dialect=db.engine.dialect)
+        with db.engine.begin() as connection:
+            connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+        added.append(f"{table_name}.{column_name}")
+
+    if added:
+        logger.info(f"Added columns: {', '.join(added)}")
+    return added
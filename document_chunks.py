@@ -0,0 +1,259 @@
+"""
+Passage index over document text.
+
+A document is stored as one content_text blob, so "find documents related to
+X" could only match whole bodies, and answering from a document meant
+sending the model the whole file. At ingestion each document is now split
+into overlapping passages of at most DOCUMENT_CHUNK_TOKENS tokens (words, as
+the memory system counts them), sharing DOCUMENT_CHUNK_OVERLAP tokens with
+the previous passage. Passages are embedded DOCUMENT_CHUNK_EMBED_BATCH at a
+time and stored as DocumentChunk rows holding (document_id, character
+offsets) and the embedding, not a copy of the text.
+
+search_passages() scores a query against a user's passage embeddings,
+which are kept in memory per user and reloaded when that user's passages
+change, and returns the best passages with their document ids and text
+(sliced out of content_text by the database).
+
+Passages embedded by another model are ignored by searches;
+backfill_document_chunks() re-indexes them, along with documents stored
+before this index existed.
+"""
+
+import re
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import func
+from app import db
+from models import Document, DocumentChunk
+from embeddings import TOKEN_PATTERN, get_embedder
+from embedding_codec import pack_embedding, unpack_embedding
+import config
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Documents indexed and committed per batch by the backfill
+BACKFILL_BATCH_SIZE = 20
+
+# Users whose passage embeddings are kept in memory between searches
+PASSAGE_CACHE_USERS = 32
+
+# "find documents related to/about X", capturing X
+RELATED_DOCUMENTS_PATTERN = re.compile(
+    r"\bfind\s+(?:my\s+)?(?:documents?|files?|docs?)\s+(?:related\s+to|about|on|mentioning)\s+(.+?)[\s?.!]*$",
+    re.IGNORECASE
+)
+
+# user_id -> (model version, (passage count, max passage id), passage ids, document ids, embedding matrix)
+_passage_matrices = OrderedDict()
+_passage_lock = threading.Lock()
+
+
+def chunk_spans(text, max_tokens=None, overlap=None):
+    """
+    Overlapping passages of ``text`` as ``(start, end, tokens)`` character
+    offsets and token counts. Each passage holds at most ``max_tokens``
+    tokens and starts ``max_tokens - overlap`` tokens after the previous one;
+    it runs on to the next token, so trailing punctuation stays with it.
+    """
+    max_tokens = max(1, max_tokens or config.DOCUMENT_CHUNK_TOKENS)
+    overlap = config.DOCUMENT_CHUNK_OVERLAP if overlap is None else overlap
+    step = max(1, max_tokens - max(0, overlap))
+    tokens = [match.span() for match in TOKEN_PATTERN.finditer(text or "")]
+
+    spans = []
+    for first in range(0, len(tokens), step):
+        last = min(first + max_tokens, len(tokens))
+        start = tokens[first][0]
+        end = tokens[last][0] if last < len(tokens) else len(text)
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        spans.append((start, end, last - first))
+        if last == len(tokens):
+            break
+    return spans
+
+
+def passage_input(title, passage):
+    """The text embedded for a passage: its document's title gives it context."""
+    return f"{title}\n{passage}" if title else passage
+
+
+def index_document_chunks(document, embedder=None):
+    """
+    Replace the passages of ``document`` with fresh ones from its current
+    content_text, in the current transaction. Returns how many were stored.
+    """
+    embedder = embedder or get_embedder()
+    DocumentChunk.query.filter_by(document_id=document.id).delete(synchronize_session=False)
+    text = document.content_text or ""
+    spans = chunk_spans(text)
+    batch_size = max(1, config.DOCUMENT_CHUNK_EMBED_BATCH)
+
+    rows = []
+    for batch_start in range(0, len(spans), batch_size):
+        batch = spans[batch_start:batch_start + batch_size]
+        vectors = embedder.embed_many([passage_input(document.title, text[start:end]) for start, end, _ in batch])
+        for position, ((start, end, tokens), vector) in enumerate(zip(batch, vectors), start=batch_start):
+            rows.append({
+                "user_id": document.user_id,
+                "document_id": document.id,
+                "position": position,
+                "start_offset": start,
+                "end_offset": end,
+                "token_count": tokens,
+                "packed_embedding": pack_embedding(vector, dtype=config.MEMORY_EMBEDDING_DTYPE),
+                "embedding_model": embedder.model_version
+            })
+    if rows:
+        db.session.bulk_insert_mappings(DocumentChunk, rows)
+    return len(rows)
+
+
+def _user_passages(user_id, model):
+    """
+    The user's passage ids, document ids and embedding matrix for ``model``,
+    from memory unless the user's passages changed since they were loaded.
+    """
+    stamp = tuple(db.session.query(func.count(DocumentChunk.id), func.max(DocumentChunk.id)).filter(
+        DocumentChunk.user_id == user_id,
+        DocumentChunk.embedding_model == model
+    ).one())
+    with _passage_lock:
+        cached = _passage_matrices.get(user_id)
+        if cached is not None and cached[:2] == (model, stamp):
+            _passage_matrices.move_to_end(user_id)
+            return cached[2:]
+
+    rows = db.session.query(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.packed_embedding).filter(
+        DocumentChunk.user_id == user_id,
+        DocumentChunk.embedding_model == model
+    ).order_by(DocumentChunk.id).all()
+    passage_ids = np.array([row.id for row in rows], dtype=np.int64)
+    document_ids = np.array([row.document_id for row in rows], dtype=np.int64)
+    matrix = np.vstack([unpack_embedding(row.packed_embedding) for row in rows]).astype(np.float32) \
+        if rows else np.zeros((0, 0), dtype=np.float32)
+
+    with _passage_lock:
+        _passage_matrices[user_id] = (model, stamp, passage_ids, document_ids, matrix)
+        _passage_matrices.move_to_end(user_id)
+        while len(_passage_matrices) > PASSAGE_CACHE_USERS:
+            _passage_matrices.popitem(last=False)
+    return passage_ids, document_ids, matrix
+
+
+def search_passages(user_id, query, limit=5, document_ids=None, max_per_document=None):
+    """
+    The user's document passages most similar to ``query``, best first, as
+    dicts with ``document_id``, ``title``, ``position``, ``start_offset``,
+    ``end_offset``, ``text`` and ``score`` (cosine similarity).
+    ``document_ids`` restricts the search to those documents and
+    ``max_per_document`` caps the passages returned from any one document.
+    Passages with no similarity to the query are never returned.
+    """
+    if not (query or "").strip():
+        return []
+    embedder = get_embedder()
+    passage_ids, passage_documents, matrix = _user_passages(str(user_id), embedder.model_version)
+    if not len(passage_ids):
+        return []
+
+    scores = matrix @ embedder.embed_query(query)
+    if document_ids is not None:
+        scores = np.where(np.isin(passage_documents, list(document_ids)), scores, -np.inf)
+
+    # Best first, skipping passages past a document's cap, until ``limit`` are chosen
+    chosen = []
+    per_document = {}
+    for index in np.argsort(-scores, kind="stable"):
+        # Past this point passages are unrelated (or outside ``document_ids``)
+        if len(chosen) >= limit or not scores[index] > 0:
+            break
+        document_id = int(passage_documents[index])
+        if max_per_document is not None and per_document.get(document_id, 0) >= max_per_document:
+            continue
+        per_document[document_id] = per_document.get(document_id, 0) + 1
+        chosen.append((int(passage_ids[index]), float(scores[index])))
+    if not chosen:
+        return []
+
+    rows = db.session.query(
+        DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.position,
+        DocumentChunk.start_offset, DocumentChunk.end_offset, Document.title,
+        func.substr(Document.content_text, DocumentChunk.start_offset + 1,
+                    DocumentChunk.end_offset - DocumentChunk.start_offset).label("text")
+    ).join(Document, Document.id == DocumentChunk.document_id).filter(
+        DocumentChunk.id.in_([passage_id for passage_id, _ in chosen])
+    ).all()
+    by_id = {row.id: row for row in rows}
+
+    results = []
+    for passage_id, score in chosen:
+        row = by_id.get(passage_id)
+        if row is None:
+            continue  # Re-indexed since the embeddings were loaded
+        results.append({
+            "document_id": row.document_id,
+            "title": row.title,
+            "position": row.position,
+            "start_offset": row.start_offset,
+            "end_offset": row.end_offset,
+            "text": row.text,
+            "score": round(score, 4)
+        })
+    return results
+
+
+def related_documents_topic(message):
+    """The topic of a "find documents related to X" request, or None if ``message`` is not one."""
+    match = RELATED_DOCUMENTS_PATTERN.search(message or "")
+    return match.group(1).strip() if match else None
+
+
+def backfill_document_chunks(batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Index the passages of documents with text but no passages from the
+    current embedder. Returns how many documents were indexed.
+    """
+    embedder = get_embedder()
+    indexed = db.session.query(DocumentChunk.document_id).filter(
+        DocumentChunk.embedding_model == embedder.model_version
+    )
+    count = 0
+    last_id = 0
+    while True:
+        documents = Document.query.filter(
+            Document.content_text.isnot(None),
+            Document.id > last_id,
+            ~Document.id.in_(indexed)
+        ).order_by(Document.id).limit(batch_size).all()
+        if not documents:
+            break
+        for document in documents:
+            index_document_chunks(document, embedder)
+        db.session.commit()
+        count += len(documents)
+        last_id = documents[-1].id
+
+    if count:
+        logger.info(f"Indexed passages of {count} documents")
+    return count
+
+
+def backfill_document_chunks_in_background():
+    """Run backfill_document_chunks in a daemon thread so it never blocks application boot."""
+    def run():
+        from app import app
+        try:
+            with app.app_context():
+                backfill_document_chunks()
+        except Exception as e:
+            logger.error(f"Error indexing document passages: {e}")
+
+    thread = threading.Thread(target=run, name="document-chunk-backfill", daemon=True)
+    thread.start()
+    return thread
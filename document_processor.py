@@ -1,13 +1,15 @@
-import os
 import logging
 import tempfile
 import json
 from datetime import datetime
-import PyPDF2
 import docx
 from app import db
 from models import Document, MemoryEntry
 import google_services
+import pdf_extraction
+from document_search import search_document_text
+from document_chunks import index_document_chunks
+import config
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -39,12 +41,88 @@ def process_document(user, document_data, document_type=None, memory_id=None):
         db.session.add(document)
         db.session.commit()
         
+        # Split the text into embedded passages for retrieval; the startup backfill retries failures
+        if document.content_text:
+            try:
+                index_document_chunks(document)
+                db.session.commit()
+            except Exception as e:
+                logger.error(f"Error indexing passages of document {document.id}: {e}")
+                db.session.rollback()
+        
         return document
     except Exception as e:
         logger.error(f"Error processing document: {e}")
         db.session.rollback()
         return None
 
+class DocumentTooLarge(Exception):
+    """A Drive file is over DOCUMENT_MAX_DOWNLOAD_BYTES; its download was abandoned."""
+
+def download_drive_file(drive_service, file_id, max_bytes=None):
+    """
+    Download a Drive file into a spooled buffer, rewound and ready to read.
+    
+    The buffer stays in memory up to DOCUMENT_SPOOL_MAX_MEMORY bytes and then
+    spills to an anonymous temporary file, which the OS removes even if the
+    process dies. The download is fetched in DOCUMENT_DOWNLOAD_CHUNK_BYTES
+    chunks and abandoned with DocumentTooLarge as soon as the file is known to
+    exceed ``max_bytes`` (default DOCUMENT_MAX_DOWNLOAD_BYTES), usually after
+    the first chunk. The caller closes the returned buffer.
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+    max_bytes = max_bytes or config.DOCUMENT_MAX_DOWNLOAD_BYTES
+    
+    buffer = tempfile.SpooledTemporaryFile(max_size=config.DOCUMENT_SPOOL_MAX_MEMORY)
+    try:
+        request = drive_service.files().get_media(fileId=file_id)
+        downloader = MediaIoBaseDownload(buffer, request, chunksize=config.DOCUMENT_DOWNLOAD_CHUNK_BYTES)
+        done = False
+        while not done:
+            status, done = downloader.next_chunk()
+            # The first response reports the full size; the bytes written catch servers that do not
+            total_size = status.total_size if status else None
+            if (total_size or 0) > max_bytes or buffer.tell() > max_bytes:
+                raise DocumentTooLarge(f"Drive file {file_id} is larger than {max_bytes} bytes")
+        buffer.seek(0)
+        return buffer
+    except Exception:
+        buffer.close()
+        raise
+
+def extract_pdf_text(stream):
+    """
+    Text of every page of a PDF read from a binary file-like object. Pages
+    are extracted in parallel by pdf_extraction's process pool, which is
+    handed the stream itself (never read whole into memory); pages that time
+    out or cannot be read are left empty.
+    """
+    extraction = pdf_extraction.extract_pdf(stream)
+    if extraction.failed:
+        logger.warning(f"Could not extract {len(extraction.failed)} PDF pages: {extraction.failed[:10]}")
+    return extraction.text
+
+def extract_docx_text(stream):
+    """Text of every paragraph of a Word document read from a binary file-like object."""
+    doc = docx.Document(stream)
+    return "\n".join(para.text for para in doc.paragraphs) + "\n"
+
+def extract_plain_text(stream):
+    """A text file read from a binary file-like object, as UTF-8 with undecodable bytes dropped."""
+    return stream.read().decode('utf-8', errors='ignore')
+
+def extract_text_from_stream(stream, mime_type):
+    """Extract text from a binary file-like object by MIME type; None if the type is not supported."""
+    mime_type = (mime_type or "").lower()
+    if 'pdf' in mime_type:
+        return extract_pdf_text(stream)
+    if 'word' in mime_type or 'docx' in mime_type:
+        return extract_docx_text(stream)
+    if 'text' in mime_type or 'txt' in mime_type:
+        return extract_plain_text(stream)
+    logger.warning(f"Unsupported file type for text extraction: {mime_type}")
+    return None
+
 def extract_text_from_document(user, document):
     """Extract text content from a document based on its type."""
     try:
@@ -56,51 +134,14 @@ def extract_text_from_document(user, document):
         if not drive_service:
             return None
         
-        # Download file content
-        from googleapiclient.http import MediaIoBaseDownload
-        request = drive_service.files().get_media(fileId=document.drive_id)
-        
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            downloader = MediaIoBaseDownload(temp_file, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-            
-            temp_file_path = temp_file.name
-        
-        # Extract text based on file type
-        extracted_text = ""
-        
-        try:
-            mime_type = document.file_type.lower()
-            
-            if 'pdf' in mime_type:
-                # Process PDF
-                with open(temp_file_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    for page_num in range(len(pdf_reader.pages)):
-                        page = pdf_reader.pages[page_num]
-                        extracted_text += page.extract_text() + "\n"
-            
-            elif 'word' in mime_type or 'docx' in mime_type:
-                # Process Word document
-                doc = docx.Document(temp_file_path)
-                for para in doc.paragraphs:
-                    extracted_text += para.text + "\n"
-            
-            elif 'text' in mime_type or 'txt' in mime_type:
-                # Process plain text
-                with open(temp_file_path, 'r', encoding='utf-8', errors='ignore') as file:
-                    extracted_text = file.read()
-            
-            else:
-                logger.warning(f"Unsupported file type for text extraction: {mime_type}")
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+        # Stream the file into memory (or an anonymous temp file) and extract from the buffer
+        with download_drive_file(drive_service, document.drive_id) as buffer:
+            extracted_text = extract_text_from_stream(buffer, document.file_type)
         
         return extracted_text if extracted_text else None
+    except DocumentTooLarge as e:
+        logger.warning(f"Skipping text extraction: {e}")
+        return None
     except Exception as e:
         logger.error(f"Error extracting text from document: {e}")
         return None
@@ -118,7 +159,8 @@ def create_document_summary(user, document_id):
         # Use OpenManus to generate summary
         from manus_integration import generate_document_summary
         
-        summary = generate_document_summary(document.content_text)
+        # Summarizes the whole text section by section; unchanged sections come from the cache
+        summary = generate_document_summary(document.content_text, title=document.title)
         
         # Create memory entry for the summary
         memory_entry = MemoryEntry(
@@ -128,11 +170,12 @@ def create_document_summary(user, document_id):
             content=summary,
             created_at=datetime.utcnow()
         )
+        db.session.add(memory_entry)
+        db.session.flush()
         
         # Link document to this memory
         document.memory_id = memory_entry.id
         
-        db.session.add(memory_entry)
         db.session.commit()
         
         return summary
@@ -234,7 +277,10 @@ def categorize_document(user, document_id, category):
         return f"Error categorizing document: {str(e)}"
 
 def search_documents(user, query, category=None, limit=10):
-    """Search documents based on content and metadata."""
+    """
+    Search documents based on content and metadata. With a query, results
+    are ranked by relevance and carry a 'score' and a highlighted 'snippet'.
+    """
     try:
         # Base query
         document_query = Document.query.filter_by(user_id=user.id)
@@ -248,15 +294,14 @@ def search_documents(user, query, category=None, limit=10):
                 MemoryEntry.metadata.contains({'category': category})
             )
         
-        # Filter by content if query specified
+        # Match the query against the full-text index, best match first
         if query:
-            document_query = document_query.filter(Document.content_text.ilike(f"%{query}%"))
-        
-        # Get results
-        documents = document_query.limit(limit).all()
+            matches = search_document_text(document_query, query, limit=limit)
+        else:
+            matches = [(doc, None, None) for doc in document_query.limit(limit).all()]
         
         result_list = []
-        for doc in documents:
+        for doc, score, snippet in matches:
             result = {
                 'id': doc.id,
                 'title': doc.title,
@@ -264,6 +309,9 @@ def search_documents(user, query, category=None, limit=10):
                 'created_at': doc.created_at.isoformat(),
                 'drive_id': doc.drive_id
             }
+            if query:
+                result['score'] = score
+                result['snippet'] = snippet
             
             # Get category from memory if available
             if doc.memory_id:
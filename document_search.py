@@ -0,0 +1,173 @@
+"""
+Full-text search over extracted document text.
+
+search_documents used to filter with ``content_text ILIKE '%query%'``, a
+sequential scan over every document body of the user with no ranking. The
+index now lives in the database and is maintained by it on every insert,
+update and delete of a Document, so text stored by process_document is
+searchable as soon as it is committed:
+
+- SQLite: an external-content FTS5 table (``document_fts``) over title and
+  content_text kept in step by triggers, ranked with bm25() (title matches
+  weigh more) and highlighted with snippet();
+- PostgreSQL: a generated ``search_tsv`` tsvector column (title weighted
+  above content) with a GIN index, ranked with ts_rank_cd() and highlighted
+  with ts_headline().
+
+Other databases fall back to a LIKE scan, newest first, with snippets cut
+around the first match in Python.
+"""
+
+import logging
+from sqlalchemy import func, text, literal_column, Integer, Float, String
+from app import db
+from models import Document
+from memory_text_index import tokenize
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "document_fts"
+
+# Matched words in snippets are wrapped in these (Markdown bold, as the bot sends it)
+HIGHLIGHT_START = "**"
+HIGHLIGHT_END = "**"
+# Rough length of a snippet in words, and the marker for text cut from either side
+SNIPPET_WORDS = 24
+ELLIPSIS = "…"
+
+# bm25() weights of the title and content_text columns
+TITLE_WEIGHT = 5.0
+CONTENT_WEIGHT = 1.0
+
+_SQLITE_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, content_text, content='document', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON document BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, content_text) VALUES (new.id, new.title, new.content_text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON document BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content_text)
+        VALUES ('delete', old.id, old.title, old.content_text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF title, content_text ON document BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content_text)
+        VALUES ('delete', old.id, old.title, old.content_text);
+        INSERT INTO {FTS_TABLE}(rowid, title, content_text) VALUES (new.id, new.title, new.content_text);
+    END""",
+]
+
+_POSTGRES_STATEMENTS = [
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(content_text, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_document_search_tsv ON document USING GIN (search_tsv)",
+]
+
+# Which kind of index ensure_document_index() set up: 'fts5', 'tsvector' or 'scan'
+_index_kind = None
+
+
+def ensure_document_index():
+    """
+    Create the full-text index for the current database if it is missing,
+    indexing existing documents. Safe to call at every startup. Returns the
+    kind of index in use.
+    """
+    global _index_kind
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == "sqlite":
+            with db.engine.begin() as connection:
+                existed = connection.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ), {"name": FTS_TABLE}).first() is not None
+                for statement in _SQLITE_STATEMENTS:
+                    connection.execute(text(statement))
+                if not existed:
+                    # Index the documents stored before the table existed
+                    connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                    logger.info("Built FTS5 index over document text")
+            _index_kind = "fts5"
+        elif dialect == "postgresql":
+            with db.engine.begin() as connection:
+                for statement in _POSTGRES_STATEMENTS:
+                    connection.execute(text(statement))
+            _index_kind = "tsvector"
+        else:
+            _index_kind = "scan"
+    except Exception as e:
+        # e.g. SQLite built without FTS5; searches still work by scanning
+        logger.warning(f"Full-text index over documents unavailable, falling back to scans: {e}")
+        _index_kind = "scan"
+    return _index_kind
+
+
+def scan_snippet(content, terms, words=SNIPPET_WORDS):
+    """A snippet of ``content`` around the first of ``terms`` it contains, with every term highlighted."""
+    tokens = (content or "").split()
+    if not tokens:
+        return ""
+    lowered = [token.lower() for token in tokens]
+    first = next((i for i, token in enumerate(lowered) if any(term in token for term in terms)), 0)
+    start = max(0, first - words // 3)
+    end = min(len(tokens), start + words)
+    shown = [f"{HIGHLIGHT_START}{token}{HIGHLIGHT_END}" if any(term in lowered[i] for term in terms) else token
+             for i, token in enumerate(tokens[start:end], start=start)]
+    return (ELLIPSIS if start else "") + " ".join(shown) + (ELLIPSIS if end < len(tokens) else "")
+
+
+def search_document_text(document_query, query, limit=10):
+    """
+    Run ``document_query`` (a Document query, e.g. already restricted to a
+    user) restricted to documents containing every word of ``query`` in
+    their title or text, best match first. Returns ``(document, score,
+    snippet)`` tuples; ``score`` is higher for better matches (None when
+    scanning) and ``snippet`` is a short highlighted excerpt.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    kind = _index_kind or ensure_document_index()
+
+    if kind == "fts5":
+        matches = text(
+            f"SELECT rowid AS document_id, bm25({FTS_TABLE}, {TITLE_WEIGHT}, {CONTENT_WEIGHT}) AS rank, "
+            f"snippet({FTS_TABLE}, -1, :highlight_start, :highlight_end, :ellipsis, :snippet_words) AS snippet "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+        ).bindparams(
+            # Quoted terms, so words like AND/NEAR or stray punctuation are never read as FTS5 syntax
+            match=" ".join(f'"{term}"' for term in terms),
+            highlight_start=HIGHLIGHT_START,
+            highlight_end=HIGHLIGHT_END,
+            ellipsis=ELLIPSIS,
+            # snippet() takes at most 64 tokens
+            snippet_words=min(SNIPPET_WORDS, 64)
+        ).columns(document_id=Integer, rank=Float, snippet=String).subquery()
+        rows = document_query.join(matches, matches.c.document_id == Document.id).add_columns(
+            # bm25() is lower for better matches
+            -matches.c.rank, matches.c.snippet
+        ).order_by(matches.c.rank, Document.id.desc()).limit(limit).all()
+        return [(document, score, snippet) for document, score, snippet in rows]
+
+    if kind == "tsvector":
+        ts_query = func.plainto_tsquery('english', " ".join(terms))
+        rank = func.ts_rank_cd(literal_column("document.search_tsv"), ts_query)
+        rows = document_query.filter(literal_column("document.search_tsv").op("@@")(ts_query)).add_columns(
+            rank,
+            func.ts_headline(
+                'english', func.coalesce(Document.content_text, Document.title), ts_query,
+                f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, FragmentDelimiter={ELLIPSIS}, "
+                f"MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}, MaxFragments=2"
+            )
+        ).order_by(rank.desc(), Document.id.desc()).limit(limit).all()
+        return [(document, float(score), snippet) for document, score, snippet in rows]
+
+    for term in terms:
+        pattern = f"%{term}%"
+        document_query = document_query.filter(Document.content_text.ilike(pattern) | Document.title.ilike(pattern))
+    documents = document_query.order_by(Document.created_at.desc(), Document.id.desc()).limit(limit).all()
+    return [(document, None, scan_snippet(document.content_text or document.title, terms)) for document in documents]
@@ -0,0 +1,208 @@
+"""
+Map-reduce summarization of long documents.
+
+Summaries used to be written from the first 3000 characters of a document.
+Now the whole text is split into sections of at most
+DOCUMENT_SUMMARY_CHUNK_TOKENS tokens (map), each section is summarized with
+at most DOCUMENT_SUMMARY_CONCURRENCY calls in flight, and the section
+summaries are combined in rounds of calls that each fit the same budget
+(reduce) until one summary of the whole document is left.
+
+Every call's result is cached on disk by a hash of (prompt version, model,
+step, input text). Section boundaries are content-defined: a section ends
+after a line whose hash picks it as a boundary (once the section is half
+full), or when the next line would not fit. An edit only moves the
+boundaries up to the next such line, so re-summarizing an edited document
+redoes the sections it touched and the reduce steps above them, and takes
+everything else from the cache.
+"""
+
+import os
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from embeddings import TOKEN_PATTERN
+import config
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Bump when the prompts change, so summaries written with the old ones are not reused
+PROMPT_VERSION = 1
+
+# On average one line in this many may end a section (once the section is half full)
+BOUNDARY_MODULUS = 4
+
+MAP_PROMPT = (
+    "Summarize the following section of a longer document. Keep the names, dates, figures, "
+    "obligations and decisions it mentions; do not comment on what is missing.\n\n{text}"
+)
+REDUCE_PROMPT = (
+    "The following are summaries of consecutive sections of a document. Combine them into one "
+    "summary, keeping the names, dates, figures, obligations and decisions.\n\n{text}"
+)
+FINAL_PROMPT = "Please summarize the following document{title}:\n\n{text}"
+FINAL_FROM_SECTIONS_PROMPT = (
+    "The following are summaries of consecutive sections of a document{title}, in order. "
+    "Write one summary of the whole document from them.\n\n{text}"
+)
+
+
+class SummaryError(Exception):
+    """A summarization call failed; nothing is cached for it."""
+
+
+class SummaryCache:
+    """On-disk cache of summaries in a SQLite file, keyed by content hash."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def key(model, step, text):
+        return hashlib.sha256(f"{PROMPT_VERSION}\n{model}\n{step}\n{text}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, summary):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary) VALUES (?, ?)", (key, summary)
+            )
+            self.connection.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_summary_cache():
+    """Return the process-wide summary cache, opening it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SummaryCache(config.DOCUMENT_SUMMARY_CACHE_PATH)
+    return _cache
+
+
+def count_tokens(text):
+    return len(TOKEN_PATTERN.findall(text or ""))
+
+
+def _is_boundary(line):
+    digest = hashlib.blake2b(line.encode('utf-8'), digest_size=4).digest()
+    return int.from_bytes(digest, 'little') % BOUNDARY_MODULUS == 0
+
+
+def _split_long_line(line, max_tokens):
+    """Cut a line of more than ``max_tokens`` tokens into consecutive pieces of at most that many."""
+    starts = [match.start() for match in TOKEN_PATTERN.finditer(line)]
+    cuts = starts[max_tokens::max_tokens]
+    return [line[start:end].strip() for start, end in zip([0] + cuts, cuts + [len(line)])]
+
+
+def split_sections(text, max_tokens=None):
+    """
+    Split ``text`` into sections of whole lines of at most ``max_tokens``
+    tokens (longer lines are cut), with content-defined boundaries (see the
+    module docstring).
+    """
+    max_tokens = max(1, max_tokens or config.DOCUMENT_SUMMARY_CHUNK_TOKENS)
+    sections = []
+    lines, tokens = [], 0
+    for raw_line in (text or "").splitlines():
+        line = raw_line.strip()
+        line_tokens = count_tokens(line)
+        if not line_tokens:
+            continue
+        for piece in (_split_long_line(line, max_tokens) if line_tokens > max_tokens else [line]):
+            piece_tokens = count_tokens(piece)
+            if lines and tokens + piece_tokens > max_tokens:
+                sections.append("\n".join(lines))
+                lines, tokens = [], 0
+            lines.append(piece)
+            tokens += piece_tokens
+            if tokens >= max_tokens // 2 and _is_boundary(piece):
+                sections.append("\n".join(lines))
+                lines, tokens = [], 0
+    if lines:
+        sections.append("\n".join(lines))
+    return sections
+
+
+def _group(summaries, max_tokens):
+    """Consecutive groups of summaries that fit ``max_tokens`` together, at least two to a group."""
+    groups = []
+    group, tokens = [], 0
+    for summary in summaries:
+        summary_tokens = count_tokens(summary)
+        if len(group) >= 2 and tokens + summary_tokens > max_tokens:
+            groups.append(group)
+            group, tokens = [], 0
+        group.append(summary)
+        tokens += summary_tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+async def summarize_document(text, complete, title=None, model=None, max_tokens=None, concurrency=None,
+                             cache=None):
+    """
+    Summarize ``text`` by map-reduce. ``complete`` is an async callable
+    taking a prompt and returning the model's reply, raising SummaryError on
+    failure; ``model`` names it in cache keys. Returns the summary.
+    """
+    max_tokens = max_tokens or config.DOCUMENT_SUMMARY_CHUNK_TOKENS
+    semaphore = asyncio.Semaphore(max(1, concurrency or config.DOCUMENT_SUMMARY_CONCURRENCY))
+    cache = cache or get_summary_cache()
+    title_part = f' titled "{title}"' if title else ""
+    stats = {"calls": 0, "cached": 0}
+
+    async def run(step, prompt, body):
+        key = SummaryCache.key(model, step, body)
+        summary = await asyncio.to_thread(cache.get, key)
+        if summary is not None:
+            stats["cached"] += 1
+            return summary
+        async with semaphore:
+            summary = await complete(prompt.format(text=body, title=title_part))
+        stats["calls"] += 1
+        await asyncio.to_thread(cache.put, key, summary)
+        return summary
+
+    sections = split_sections(text, max_tokens)
+    if not sections:
+        return ""
+    if len(sections) == 1:
+        return await run(f"final:{title_part}", FINAL_PROMPT, sections[0])
+
+    summaries = await asyncio.gather(*(run("map", MAP_PROMPT, section) for section in sections))
+    rounds = 0
+    groups = _group(summaries, max_tokens)
+    while len(groups) > 1:
+        summaries = await asyncio.gather(*(run("reduce", REDUCE_PROMPT, "\n\n".join(group)) for group in groups))
+        groups = _group(summaries, max_tokens)
+        rounds += 1
+    summary = await run(f"final-sections:{title_part}", FINAL_FROM_SECTIONS_PROMPT, "\n\n".join(groups[0]))
+
+    logger.info(f"Summarized {len(sections)} sections in {rounds} reduce rounds: "
+                f"{stats['calls']} model calls, {stats['cached']} from cache")
+    return summary
@@ -0,0 +1,80 @@
+"""
+Packed binary storage format for memory embeddings.
+
+An encoded embedding is an 8 byte header followed by the raw vector:
+
+    magic (2 bytes, b'EV') | version (uint8) | dtype code (uint8) | dimension (uint32)
+
+All fields are little-endian. The header keeps the payload 4-byte aligned so
+float32 vectors can be read straight out of the stored bytes with
+``np.frombuffer`` without copying.
+"""
+
+import struct
+import numpy as np
+
+MAGIC = b'EV'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<2sBBI')
+
+# dtype code stored in the header -> numpy dtype
+DTYPES = {
+    0: np.dtype('<f4'),
+    1: np.dtype('<f2'),
+}
+DTYPE_CODES = {'float32': 0, 'float16': 1}
+
+
+def pack_embedding(vector, dtype='float32'):
+    """Encode a vector as header + packed little-endian floats."""
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    code = DTYPE_CODES[dtype]
+    values = np.asarray(vector, dtype=DTYPES[code]).ravel()
+    return HEADER.pack(MAGIC, FORMAT_VERSION, code, len(values)) + values.tobytes()
+
+
+def unpack_embedding(blob):
+    """
+    Decode a packed embedding. The returned array is a read-only view over
+    ``blob`` and is not copied.
+    """
+    if blob is None or len(blob) < HEADER.size:
+        raise ValueError("Packed embedding is missing or truncated")
+    magic, version, code, dim = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Not a packed embedding")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported packed embedding version: {version}")
+    if code not in DTYPES:
+        raise ValueError(f"Unknown packed embedding dtype code: {code}")
+    return np.frombuffer(blob, dtype=DTYPES[code], count=dim, offset=HEADER.size)
+
+
+def unpack_embeddings(blobs, dim):
+    """
+    Decode many packed embeddings of dimension ``dim`` from one joined buffer
+    per dtype, instead of one ``np.frombuffer`` call per blob. Returns a
+    float32 matrix with a row per blob and a boolean array marking the rows
+    decoded; blobs that are missing, unreadable or of another dimension are
+    left as zero rows for the caller to handle one by one.
+    """
+    matrix = np.zeros((len(blobs), dim), dtype=np.float32)
+    decoded = np.zeros(len(blobs), dtype=bool)
+    for code, dtype in DTYPES.items():
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, code, dim)
+        size = HEADER.size + dtype.itemsize * dim
+        positions = [position for position, blob in enumerate(blobs)
+                     if blob is not None and len(blob) == size and blob[:HEADER.size] == header]
+        if not positions:
+            continue
+        joined = np.frombuffer(b''.join(blobs[position] for position in positions), dtype=np.uint8)
+        payload = np.ascontiguousarray(joined.reshape(len(positions), size)[:, HEADER.size:])
+        matrix[positions] = payload.view(dtype)
+        decoded[positions] = True
+    return matrix, decoded
+
+
+def embedding_dimension(blob):
+    """Read only the dimension from a packed embedding header."""
+    return HEADER.unpack_from(blob)[3]
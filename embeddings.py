@@ -0,0 +1,342 @@
+"""
+Embedding providers for the memory system.
+
+Every provider exposes ``embed(text)`` and a batched ``embed_many(texts)`` and
+returns L2-normalised float32 vectors, so a dot product between two
+embeddings is their cosine similarity. ``model_version`` identifies the
+vector space; vectors from different versions must never be compared.
+
+Providers are wrapped in a CachedEmbedder backed by an on-disk cache keyed by
+a hash of (model version, text), so identical text is only embedded once.
+"""
+
+import os
+import re
+import math
+import time
+import atexit
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import Counter
+import numpy as np
+import config
+from embedding_codec import pack_embedding, unpack_embedding
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def model_slug(model_version):
+    """A model version made safe to use as a file or directory name."""
+    return re.sub(r'[^\w.-]', '_', model_version)
+
+
+def normalize_rows(matrix):
+    """L2-normalise each row of a matrix in place, leaving all-zero rows untouched."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+class Embedder:
+    """Base class for embedding providers."""
+
+    model_version = None
+    dim = None
+
+    def embed(self, text):
+        """Embed a single text."""
+        return self.embed_many([text])[0]
+
+    def embed_query(self, text):
+        """Embed a one-off text such as a search query; providers that cache do not keep it."""
+        return self.embed(text)
+
+    def embed_many(self, texts):
+        """Embed a list of texts, returning a float32 matrix with one row per text."""
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """
+    Local CPU embedder using the hashing trick.
+
+    Lower-cased word unigrams and bigrams are hashed into ``dim`` signed buckets
+    and weighted by sublinear term frequency (1 + log tf). No model download or
+    network access is needed, and texts sharing words get similar vectors.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.model_version = f"hashing-v1-{dim}"
+
+    def _features(self, text):
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        features = Counter(tokens)
+        features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    def _bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        sign = 1.0 if value >> 63 else -1.0
+        return value % self.dim, sign
+
+    def embed_many(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text or "").items():
+                bucket, sign = self._bucket(feature)
+                matrix[row, bucket] += sign * (1.0 + math.log(count))
+        return normalize_rows(matrix)
+
+
+class OpenAIEmbedder(Embedder):
+    """Embedder backed by the OpenAI embeddings API."""
+
+    # Inputs sent per API request
+    BATCH_SIZE = 256
+
+    def __init__(self, model="text-embedding-3-small", api_key=None):
+        import openai
+        self.client = openai.OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"))
+        self.model = model
+        self.model_version = f"openai:{model}"
+
+    def embed_many(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.BATCH_SIZE):
+            batch = [text or " " for text in texts[start:start + self.BATCH_SIZE]]
+            response = self.client.embeddings.create(model=self.model, input=batch)
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None and len(matrix):
+            self.dim = matrix.shape[1]
+        return normalize_rows(matrix)
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of embeddings in a SQLite file, keyed by content hash.
+
+    Holds at most ``max_entries`` embeddings; past that the least recently
+    used are evicted. Writes (new embeddings, and refreshed use times, which
+    are only recorded once per TOUCH_INTERVAL per entry) are buffered and
+    committed together every FLUSH_ROWS rows or FLUSH_INTERVAL seconds, and
+    at exit, so embedding one text does not cost a commit.
+    """
+
+    # Buffered writes committed together once this many are waiting
+    FLUSH_ROWS = 256
+    # ... or once the oldest has waited this many seconds
+    FLUSH_INTERVAL = 2.0
+    # Seconds before a cache hit refreshes its entry's use time again
+    TOUCH_INTERVAL = 3600.0
+    # Eviction trims the cache to this share of max_entries, so it does not run on every flush
+    EVICT_TO = 0.9
+
+    def __init__(self, path, max_entries=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries or config.EMBEDDING_CACHE_MAX_ENTRIES
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # A lost write only costs a re-embed, so commits need not wait for fsync
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "used_at REAL NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(embeddings)")}
+        if "used_at" not in columns:
+            # Caches written before eviction; their entries count as least recently used
+            self.connection.execute("ALTER TABLE embeddings ADD COLUMN used_at REAL NOT NULL DEFAULT 0")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_used_at ON embeddings (used_at)")
+        self.connection.commit()
+        self.entries = self.connection.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+
+        self._pending = {}
+        self._touched = {}
+        self._pending_since = None
+        atexit.register(self.flush)
+
+    @staticmethod
+    def key(model_version, text):
+        return hashlib.sha256(f"{model_version}\n{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys present in the cache."""
+        found = {}
+        now = time.time()
+        with self.lock:
+            unwritten = [key for key in keys if key in self._pending]
+            for key in unwritten:
+                found[key] = unpack_embedding(self._pending[key])
+            keys = [key for key in keys if key not in found]
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, vector, used_at FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob, used_at in rows:
+                    found[key] = unpack_embedding(blob)
+                    if used_at < now - self.TOUCH_INTERVAL:
+                        self._touched[key] = now
+                        self._pending_since = self._pending_since or now
+            self._flush_if_due(now)
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs (buffered, see the class docstring)."""
+        now = time.time()
+        with self.lock:
+            for key, vector in items:
+                self._pending[key] = pack_embedding(vector)
+            self._pending_since = self._pending_since or now
+            self._flush_if_due(now)
+
+    def flush(self):
+        """Commit buffered writes now."""
+        with self.lock:
+            self._flush()
+
+    def _flush_if_due(self, now):
+        if self._pending_since is None:
+            return
+        if len(self._pending) + len(self._touched) >= self.FLUSH_ROWS or now - self._pending_since >= self.FLUSH_INTERVAL:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending and not self._touched:
+            return
+        now = time.time()
+        try:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, used_at) VALUES (?, ?, ?)",
+                [(key, blob, now) for key, blob in self._pending.items()]
+            )
+            self.connection.executemany(
+                "UPDATE embeddings SET used_at = ? WHERE key = ?",
+                [(used_at, key) for key, used_at in self._touched.items()]
+            )
+            self.entries += len(self._pending)
+            if self.entries > self.max_entries:
+                self._evict()
+            self.connection.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+            self.connection.rollback()
+        finally:
+            self._pending = {}
+            self._touched = {}
+            self._pending_since = None
+
+    def _evict(self):
+        """Delete the least recently used entries down to EVICT_TO of max_entries."""
+        # Replaced keys were counted as new; count exactly before deleting anything
+        self.entries = self.connection.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+        excess = self.entries - int(self.max_entries * self.EVICT_TO)
+        if self.entries <= self.max_entries or excess <= 0:
+            return
+        self.connection.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used_at LIMIT ?)", (excess,)
+        )
+        self.entries -= excess
+        logger.debug(f"Evicted {excess} least recently used embeddings from the cache")
+
+
+class CachedEmbedder(Embedder):
+    """Wraps an embedder so repeated or unchanged text is never embedded twice."""
+
+    def __init__(self, embedder, cache):
+        self.embedder = embedder
+        self.cache = cache
+        self.model_version = embedder.model_version
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def dim(self):
+        return self.embedder.dim
+
+    def embed_query(self, text):
+        """Embed a one-off text such as a search query: served from the cache, but not added to it."""
+        return self.embed_many([text], store=False)[0]
+
+    def flush(self):
+        """Commit the cache's buffered writes."""
+        self.cache.flush()
+
+    def embed_many(self, texts, store=True):
+        """Embed texts, from the cache where possible; new embeddings are cached unless ``store`` is False."""
+        keys = [EmbeddingCache.key(self.model_version, text) for text in texts]
+        try:
+            cached = self.cache.get_many(set(keys))
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache read failed: {e}")
+            cached = {}
+
+        # Embed each distinct uncached text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = self.embedder.embed_many(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            cached.update(fresh)
+            if store:
+                self.cache.put_many(fresh.items())
+
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        matrix = np.vstack([cached[key] for key in keys]).astype(np.float32, copy=False)
+        if self.embedder.dim is None:
+            # API-backed providers learn their dimension from a first call, which the cache may have answered
+            self.embedder.dim = matrix.shape[1]
+        return matrix
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def create_embedder(name=None):
+    """Build the configured provider, falling back to the local embedder if the API one is unavailable."""
+    name = name or config.MEMORY_EMBEDDER
+    if name == "openai":
+        try:
+            if not os.environ.get("OPENAI_API_KEY"):
+                raise RuntimeError("OPENAI_API_KEY is not set")
+            return OpenAIEmbedder(model=config.MEMORY_EMBEDDING_MODEL)
+        except Exception as e:
+            logger.warning(f"OpenAI embedder unavailable ({e}), falling back to local embedder")
+    elif name != "local":
+        logger.warning(f"Unknown embedder '{name}', using local embedder")
+    return HashingEmbedder(dim=config.MEMORY_EMBEDDING_DIM)
+
+
+def get_embedder():
+    """Return the process-wide cached embedder, creating it on first use."""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                cache = EmbeddingCache(config.EMBEDDING_CACHE_PATH)
+                _embedder = CachedEmbedder(create_embedder(), cache)
+                logger.info(f"Using embedder {_embedder.model_version}")
+    return _embedder
@@ -13,6 +13,7 @@ import time
 from PIL import Image
 from app import db
 from models import User, MemoryEntry, FaceImage
+import contact_store
 # Access OpenAI through the manus_integration module
 import manus_integration
 from sqlalchemy.exc import SQLAlchemyError
@@ -192,25 +193,16 @@ def identify_person_in_photo(user_id, image_path, query_name=None):
                 "faces": faces
             }
             
-        # If a name is provided, try to match with memory entries
-        memory_entries = MemoryEntry.query.filter_by(
-            user_id=user_id,
-            entry_type='contact'
-        ).all()
-        
+        # If a name is provided, look it up in the contact store's name index
         possible_matches = []
         
-        for entry in memory_entries:
-            content = json.loads(entry.content)
-            name = content.get('name', '')
-            
-            # Simple name matching - would be enhanced with actual face recognition
-            if query_name.lower() in name.lower():
-                possible_matches.append({
-                    "memory_id": entry.id,
-                    "name": name,
-                    "faces": faces
-                })
+        # Simple name matching - would be enhanced with actual face recognition
+        for contact in contact_store.find_contacts_by_name(user_id, query_name):
+            possible_matches.append({
+                "memory_id": contact.memory_id,
+                "name": contact.name,
+                "faces": faces
+            })
         
         if possible_matches:
             return {
@@ -13,10 +13,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Import app after logging is configured
-from app import app
-# Import routes after app to register blueprints
-import routes
+# Worker processes started by spawn or a fork server (see pdf_extraction) import this
+# module again as __mp_main__; they must not start the app a second time
+if __name__ != "__mp_main__":
+    # Import app after logging is configured
+    from app import app
+    # Import routes after app to register blueprints
+    import routes
 
 # Log startup information
 logger.info(f"Starting application in {config.ENVIRONMENT.upper()} mode")
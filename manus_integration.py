@@ -6,6 +6,7 @@ import sys
 from datetime import datetime
 import re
 import random
+from document_summary import summarize_document, SummaryError
 
 # Add OpenManus to the Python path
 sys.path.append('./OpenManus')
@@ -98,7 +99,7 @@ class OpenManus:
         else:
             return "I'm here to help you manage emails, calendar, drive, and other tasks. How can I assist you today?"
     
-    def generate_document_summary(self, document_text):
+    def generate_document_summary(self, document_text, title=None):
         """Generate a summary of a document."""
         if not self.initialized:
             return "Unable to generate summary: Service unavailable."
@@ -403,20 +404,26 @@ class RealOpenManus:
             logger.error(f"Error processing message with real OpenManus: {e}")
             return "I encountered an error processing your request."
     
-    def generate_document_summary(self, document_text):
-        """Generate a summary of a document."""
+    async def _summary_completion(self, prompt):
+        """One summarization call for document_summary, raising SummaryError on failure."""
+        result = await self._async_run(prompt)
+        if result["error"]:
+            raise SummaryError(result["response"])
+        return result["response"]
+    
+    def generate_document_summary(self, document_text, title=None):
+        """Generate a summary of a whole document, map-reduce style (see document_summary)."""
         try:
-            # Create a prompt for document summarization
-            prompt = f"Please summarize the following document:\n\n{document_text[:3000]}..."
+            from config import MANUS_MODEL
             
             # Run the agent in the event loop
             loop = asyncio.get_event_loop()
-            result = loop.run_until_complete(self._async_run(prompt))
-            
-            if result["error"]:
-                return "Failed to generate document summary."
-            
-            return result["response"]
+            return loop.run_until_complete(summarize_document(
+                document_text, self._summary_completion, title=title, model=MANUS_MODEL
+            ))
+        except SummaryError as e:
+            logger.error(f"Error generating document summary with real OpenManus: {e}")
+            return "Failed to generate document summary."
         except Exception as e:
             logger.error(f"Error generating document summary with real OpenManus: {e}")
             return "Failed to generate document summary."
@@ -626,14 +633,14 @@ def process_message(user, message, current_state):
     
     return _current_openmanus.process_message(user, message, current_state)
 
-def generate_document_summary(document_text):
+def generate_document_summary(document_text, title=None):
     """Generate a summary of a document using OpenManus."""
     global _current_openmanus
     
     if _current_openmanus is None:
         initialize_manus()
     
-    return _current_openmanus.generate_document_summary(document_text)
+    return _current_openmanus.generate_document_summary(document_text, title=title)
 
 def extract_memories(user, conversation_text):
     """Extract potential memory entries from conversation text."""
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Bulk Memory Import and Export
+
+Backs up a user's memories to NDJSON (one JSON object per line) and loads
+them back, streaming in both directions so files of any size are handled in
+flat memory. Uses the same code as the /api/memories/export and
+/api/memories/import endpoints.
+
+Usage:
+    python memory_bulk.py export --user USER_ID [--output FILE]
+    python memory_bulk.py import --user USER_ID [--input FILE] [--chunk-size N] [--dedup merge|flag|off]
+
+FILE defaults to standard output / standard input. Anything else printed while
+the script runs (the app's startup messages, logging) goes to standard error,
+so an export to standard output holds nothing but the NDJSON.
+"""
+
+import sys
+import json
+import argparse
+import logging
+import time
+
+# The app prints startup messages on standard output; send every print to
+# standard error and keep the real standard output for the export itself
+ndjson_output = sys.stdout
+sys.stdout = sys.stderr
+
+from app import app
+from models import User
+from db_upgrade import upgrade_schema
+import memory_system
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Import or export memories as NDJSON.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Write a user\'s memories as NDJSON')
+    export_parser.add_argument('--user', required=True, help='User id')
+    export_parser.add_argument('--output', help='File to write (default standard output)')
+
+    import_parser = subparsers.add_parser('import', help='Add memories from NDJSON')
+    import_parser.add_argument('--user', required=True, help='User id')
+    import_parser.add_argument('--input', help='File to read (default standard input)')
+    import_parser.add_argument('--chunk-size', type=int, default=None,
+                               help='Memories embedded and committed together (default MEMORY_IMPORT_CHUNK_SIZE)')
+    import_parser.add_argument('--dedup', choices=['merge', 'flag', 'off'], default=None,
+                               help='Near-duplicate handling (default MEMORY_DEDUP_MODE)')
+    return parser.parse_args()
+
+def export_command(user_id, output=None):
+    """Write a user's memories to ``output`` (or standard output). Returns the number written."""
+    with app.app_context():
+        stream = open(output, 'w', encoding='utf-8') if output else ndjson_output
+        written = 0
+        try:
+            for memory in memory_system.export_memories(user_id):
+                stream.write(json.dumps(memory) + "\n")
+                written += 1
+        finally:
+            if output:
+                stream.close()
+            else:
+                stream.flush()
+        print(f"Exported {written} memories for user {user_id}", file=sys.stderr)
+        return written
+
+def import_command(user_id, input_path=None, chunk_size=None, dedup=None):
+    """Add memories from ``input_path`` (or stdin) to a user. Returns the import report."""
+    with app.app_context():
+        upgrade_schema()
+
+        user = User.query.get(user_id)
+        if user is None:
+            print(f"No user with id {user_id}", file=sys.stderr)
+            return None
+
+        stream = open(input_path, 'r', encoding='utf-8') if input_path else sys.stdin
+        started = time.perf_counter()
+        try:
+            report = memory_system.import_memories(
+                user, memory_system.iter_ndjson(stream), chunk_size=chunk_size, dedup=dedup
+            )
+        finally:
+            if input_path:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        print(f"Imported {report['imported']} memories in {report['chunks']} chunks "
+              f"({report['imported'] / elapsed if elapsed else 0:.0f} memories/s); "
+              f"{report['duplicates']} duplicates, {report['invalid']} invalid records", file=sys.stderr)
+        for error in report['errors']:
+            print(f"  line {error['line']}: {error['error']}", file=sys.stderr)
+        if report['invalid'] > len(report['errors']):
+            print(f"  ... and {report['invalid'] - len(report['errors'])} more", file=sys.stderr)
+        return report
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.command == 'export':
+        export_command(args.user, output=args.output)
+    else:
+        import_command(args.user, input_path=args.input, chunk_size=args.chunk_size, dedup=args.dedup)
@@ -0,0 +1,285 @@
+"""
+Near-duplicate detection for memories with MinHash signatures and LSH.
+
+Extraction and the business-card flow store the same person or project again
+and again. Each memory gets a MinHash signature over the word shingles of its
+title and content; the estimated Jaccard similarity of two memories is the
+fraction of signature positions that agree. Signatures are split into bands
+and hashed into per-band buckets (locality-sensitive hashing), so finding the
+near-duplicates of a new memory only compares it with memories that share at
+least one band, not with every memory the user has.
+"""
+
+import json
+import zlib
+import threading
+import numpy as np
+from memory_text_index import tokenize
+
+# Signature length, and its split into LSH bands of NUM_PERMUTATIONS // LSH_BANDS rows.
+# 16 bands of 8 rows make pairs above ~0.7 similarity very likely to share a band.
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 16
+BAND_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+
+# Words per shingle; texts shorter than this are shingled by single words
+SHINGLE_SIZE = 2
+
+# Multiply-shift hash family: h(x) = (a * x + b) >> 32 over 64-bit arithmetic, a odd
+# (fixed seed, so signatures are comparable across processes and restarts)
+_rng = np.random.RandomState(20250506)
+_A = _rng.randint(0, 2 ** 63, size=NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_B = _rng.randint(0, 2 ** 63, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+EMPTY_SIGNATURE = np.full(NUM_PERMUTATIONS, np.iinfo(np.uint32).max, dtype=np.uint32)
+
+
+def shingles(text):
+    """Set of word shingles of a text."""
+    words = tokenize(text)
+    if len(words) < SHINGLE_SIZE:
+        return set(words)
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signature(text):
+    """MinHash signature of a text, as NUM_PERMUTATIONS uint32 values."""
+    hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)], dtype=np.uint64)
+    if not len(hashes):
+        return EMPTY_SIGNATURE.copy()
+    # One row per permutation; numpy wraps uint64 products mod 2**64 as the hash family requires
+    with np.errstate(over="ignore"):
+        permuted = (np.outer(_A, hashes) + _B[:, None]) >> np.uint64(32)
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def pack_signature(signature):
+    """Bytes for the MemoryEntry.minhash_signature column."""
+    return np.asarray(signature, dtype="<u4").tobytes()
+
+
+def unpack_signature(data):
+    """Read a stored signature; None if missing or computed with a different length."""
+    if not data or len(data) != NUM_PERMUTATIONS * 4:
+        return None
+    return np.frombuffer(data, dtype="<u4").astype(np.uint32)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return float(np.count_nonzero(a == b)) / NUM_PERMUTATIONS
+
+
+# Odd multipliers folding a band's BAND_ROWS values into one 64-bit hash
+# (a separate fixed seed, so the permutations above stay as they were)
+_BAND_MIX = np.random.RandomState(20250507).randint(0, 2 ** 63, size=BAND_ROWS, dtype=np.uint64) | np.uint64(1)
+
+# Bucket keys carry their band in the top bits, so all bands sort into one array
+BAND_BITS = max(1, (LSH_BANDS - 1).bit_length())
+_BAND_PREFIX = np.arange(LSH_BANDS, dtype=np.uint64)[:, None] << np.uint64(64 - BAND_BITS)
+
+# Newly added signatures are scanned linearly until there are this many (or a sixteenth
+# of the sorted ones), then everything is sorted again
+TAIL_ROWS = 4096
+
+# Rebuild the arrays once removed or replaced memories make up this share of the slots
+COMPACT_DEAD_SHARE = 0.5
+
+
+def band_keys(signatures):
+    """Bucket keys of signatures, as an array of shape (LSH_BANDS, len(signatures))."""
+    rows = np.asarray(signatures, dtype=np.uint32).reshape(-1, LSH_BANDS, BAND_ROWS).astype(np.uint64)
+    # numpy wraps uint64 products and sums mod 2**64
+    with np.errstate(over="ignore"):
+        hashes = (rows * _BAND_MIX).sum(axis=2, dtype=np.uint64).T
+    return (hashes >> np.uint64(BAND_BITS)) | _BAND_PREFIX
+
+
+class UserDedupIndex:
+    """
+    LSH index over one user's memory signatures, in numpy arrays.
+
+    Each indexed memory gets a slot: ``slot_ids[slot]`` is its memory id,
+    ``signatures[slot]`` its signature, ``type_codes[slot]`` its entry type
+    and ``keys[band, slot]`` its bucket key in each band. The keys of the
+    first ``sorted_count`` slots in all bands are sorted into ``sorted_keys``
+    (``sorted_slots`` holds the slot of each), so the buckets of a signature
+    are found with one vectorized binary search; slots added since are
+    compared directly until there are enough of them to sort everything
+    again.
+    Removing or replacing a memory only clears its slot. Only memories of
+    the same entry type are ever reported as duplicates of each other.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = str(user_id)
+        self.lock = threading.RLock()
+        self.slot_of = {}
+        self.slot_ids = np.zeros(0, dtype=np.int64)
+        self.signatures = np.zeros((0, NUM_PERMUTATIONS), dtype=np.uint32)
+        self.keys = np.zeros((LSH_BANDS, 0), dtype=np.uint64)
+        self.type_codes = np.zeros(0, dtype=np.int32)
+        self.type_code_of = {}
+        self.alive = np.zeros(0, dtype=bool)
+        self.slot_count = 0
+        self.sorted_count = 0
+        self.sorted_slots = np.zeros(0, dtype=np.int32)
+        self.sorted_keys = np.zeros(0, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the index, for status reporting."""
+        arrays = (self.slot_ids, self.signatures, self.keys, self.type_codes, self.alive, self.sorted_slots,
+                  self.sorted_keys)
+        # slot_of entries are estimated at 100 bytes each
+        return sum(array.nbytes for array in arrays) + 100 * len(self.slot_of)
+
+    def to_arrays(self):
+        """Snapshot the index as named arrays, for a segment file (see adopt)."""
+        with self.lock:
+            count = self.slot_count
+            types = json.dumps(list(self.type_code_of)).encode("utf-8")
+            return {
+                "dedup_types": np.frombuffer(types, dtype=np.uint8).copy(),
+                "dedup_slot_ids": self.slot_ids[:count].copy(),
+                "dedup_signatures": self.signatures[:count].copy(),
+                "dedup_keys": np.ascontiguousarray(self.keys[:, :count]),
+                "dedup_type_codes": self.type_codes[:count].copy(),
+                "dedup_alive": self.alive[:count].copy(),
+                "dedup_sorted_keys": self.sorted_keys.copy(),
+                "dedup_sorted_slots": self.sorted_slots.copy(),
+            }
+
+    def adopt(self, arrays):
+        """
+        Use arrays written by to_arrays as the backing store, e.g. mapped from
+        a segment file; the first memory added afterwards copies them into
+        private memory.
+        """
+        with self.lock:
+            types = json.loads(arrays["dedup_types"].tobytes().decode("utf-8"))
+            self.type_code_of = {entry_type: code for code, entry_type in enumerate(types)}
+            self.slot_ids = arrays["dedup_slot_ids"]
+            self.signatures = arrays["dedup_signatures"]
+            self.keys = arrays["dedup_keys"]
+            self.type_codes = arrays["dedup_type_codes"]
+            self.alive = arrays["dedup_alive"]
+            self.sorted_keys = arrays["dedup_sorted_keys"]
+            self.sorted_slots = arrays["dedup_sorted_slots"]
+            self.slot_count = len(self.slot_ids)
+            self.sorted_count = len(self.sorted_keys) // LSH_BANDS
+            live = np.flatnonzero(self.alive)
+            self.slot_of = dict(zip(self.slot_ids[live].tolist(), live.tolist()))
+
+    def add(self, memory_id, signature, entry_type=None):
+        """Index a memory's signature, replacing whatever was indexed for it before."""
+        self.add_many([(memory_id, signature, entry_type)])
+
+    def add_many(self, items):
+        """Index ``(memory_id, signature, entry_type)`` triples, replacing whatever was indexed for them before."""
+        # A memory listed twice is indexed with its last signature
+        latest = {int(memory_id): (signature, entry_type) for memory_id, signature, entry_type in items}
+        with self.lock:
+            for memory_id, (signature, entry_type) in list(latest.items()):
+                slot = self.slot_of.get(memory_id)
+                if slot is not None and self.type_codes[slot] == self.type_code_of.get(entry_type) \
+                        and np.array_equal(self.signatures[slot], signature):
+                    # Unchanged, e.g. a change log replay; leaves mapped segment arrays shared
+                    del latest[memory_id]
+                else:
+                    self._remove(memory_id)
+            if not latest:
+                return
+            first = self.slot_count
+            end = first + len(latest)
+            if end > len(self.slot_ids):
+                self._resize(max(end, 2 * len(self.slot_ids), 16))
+            signatures = np.array([signature for signature, _ in latest.values()], dtype=np.uint32)
+            self.signatures[first:end] = signatures
+            self.keys[:, first:end] = band_keys(signatures)
+            self.slot_ids[first:end] = list(latest)
+            self.type_codes[first:end] = [
+                self.type_code_of.setdefault(entry_type, len(self.type_code_of)) for _, entry_type in latest.values()
+            ]
+            self.alive[first:end] = True
+            self.slot_of.update(zip(latest, range(first, end)))
+            self.slot_count = end
+            if end - self.sorted_count > max(TAIL_ROWS, self.sorted_count // 16):
+                self._sort()
+
+    def remove(self, memory_id):
+        with self.lock:
+            removed = self._remove(int(memory_id))
+            dead = self.slot_count - len(self.slot_of)
+            if removed and dead >= 1024 and dead >= COMPACT_DEAD_SHARE * self.slot_count:
+                self._compact()
+            return removed
+
+    def _remove(self, memory_id):
+        slot = self.slot_of.pop(memory_id, None)
+        if slot is None:
+            return False
+        self.alive[slot] = False
+        return True
+
+    def _resize(self, capacity):
+        count = self.slot_count
+        for name in ("slot_ids", "signatures", "type_codes", "alive"):
+            old = getattr(self, name)
+            grown = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:count] = old[:count]
+            setattr(self, name, grown)
+        keys = np.zeros((LSH_BANDS, capacity), dtype=np.uint64)
+        keys[:, :count] = self.keys[:, :count]
+        self.keys = keys
+
+    def _sort(self):
+        keys = self.keys[:, :self.slot_count].ravel()
+        order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[order]
+        self.sorted_slots = (order % max(1, self.slot_count)).astype(np.int32)
+        self.sorted_count = self.slot_count
+
+    def _compact(self):
+        """Renumber the live slots densely and sort them again."""
+        alive = self.alive[:self.slot_count]
+        self.slot_ids = self.slot_ids[:self.slot_count][alive]
+        self.signatures = self.signatures[:self.slot_count][alive]
+        self.keys = np.ascontiguousarray(self.keys[:, :self.slot_count][:, alive])
+        self.type_codes = self.type_codes[:self.slot_count][alive]
+        self.slot_count = len(self.slot_ids)
+        self.alive = np.ones(self.slot_count, dtype=bool)
+        self.slot_of = dict(zip(self.slot_ids.tolist(), range(self.slot_count)))
+        self._sort()
+
+    def duplicates(self, signature, entry_type=None, threshold=0.8, exclude=None):
+        """
+        Memories of ``entry_type`` whose estimated similarity to ``signature``
+        is at least ``threshold``, as ``(memory_id, similarity)`` pairs, most
+        similar first. ``exclude`` is a memory id to leave out (the memory itself).
+        """
+        if np.array_equal(signature, EMPTY_SIGNATURE):
+            return []
+        keys = band_keys(signature)[:, 0]
+        with self.lock:
+            code = self.type_code_of.get(entry_type)
+            if code is None or not self.slot_of:
+                return []
+            low = np.searchsorted(self.sorted_keys, keys, side="left")
+            high = np.searchsorted(self.sorted_keys, keys, side="right")
+            found = [self.sorted_slots[start:stop] for start, stop in zip(low.tolist(), high.tolist()) if stop > start]
+            # Slots added since the last sort
+            tail = self.keys[:, self.sorted_count:self.slot_count]
+            found.append(np.flatnonzero((tail == keys[:, None]).any(axis=0)) + self.sorted_count)
+
+            slots = np.unique(np.concatenate(found))
+            slots = slots[self.alive[slots] & (self.type_codes[slots] == code)]
+            scores = np.count_nonzero(self.signatures[slots] == signature, axis=1) / NUM_PERMUTATIONS
+            keep = scores >= threshold
+            matches = [(memory_id, score) for memory_id, score in
+                       zip(self.slot_ids[slots[keep]].tolist(), scores[keep].tolist()) if memory_id != exclude]
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches
@@ -0,0 +1,157 @@
+"""
+Per-user graph of typed links between memories.
+
+"Tell me about Jane" should also surface Jane's company and the project she
+was mentioned with. Links come from extracted entities (a contact's company,
+memories extracted from the same stretch of conversation) and are stored in
+the MemoryLink table. Each user's links are held in compressed sparse row
+(CSR) form: a sorted array of memory ids, an offsets array and flat neighbour
+and relation arrays, so expanding a set of search hits by one or two hops is
+a few array slices rather than queries or LLM calls.
+
+Links are undirected for expansion: each is stored in both directions with
+the same relation.
+"""
+
+import threading
+import numpy as np
+
+# Expansion never goes further than this many hops
+MAX_HOPS = 2
+
+
+class UserGraph:
+    """
+    CSR adjacency over one user's memories.
+
+    ``nodes`` holds the linked memory ids in ascending order; the neighbours
+    of ``nodes[i]`` are ``nodes[neighbors[indptr[i]:indptr[i + 1]]]`` and
+    ``edge_relations`` gives each link's relation as an index into
+    ``relations``. Changes are staged in ``_added`` and ``_removed_nodes``
+    and merged into the arrays on the next expansion.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = str(user_id)
+        self.lock = threading.RLock()
+        self.relations = []
+        self._relation_codes = {}
+        self.nodes = np.empty(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.neighbors = np.empty(0, dtype=np.int32)
+        self.edge_relations = np.empty(0, dtype=np.uint16)
+        self._added = []
+        self._removed_nodes = set()
+
+    def __len__(self):
+        """Number of links (each counted once)."""
+        with self.lock:
+            self._compact()
+            return len(self.neighbors) // 2
+
+    def _code(self, relation):
+        code = self._relation_codes.get(relation)
+        if code is None:
+            code = self._relation_codes[relation] = len(self.relations)
+            self.relations.append(relation)
+        return code
+
+    def add(self, source_id, target_id, relation):
+        """Stage a link between two memories."""
+        if int(source_id) == int(target_id):
+            return
+        with self.lock:
+            self._added.append((int(source_id), int(target_id), self._code(relation)))
+
+    def load(self, links):
+        """Replace the graph with ``(source_id, target_id, relation)`` links, e.g. from the database."""
+        with self.lock:
+            self.nodes = np.empty(0, dtype=np.int64)
+            self.indptr = np.zeros(1, dtype=np.int64)
+            self.neighbors = np.empty(0, dtype=np.int32)
+            self.edge_relations = np.empty(0, dtype=np.uint16)
+            self._added = []
+            self._removed_nodes = set()
+            for source_id, target_id, relation in links:
+                self.add(source_id, target_id, relation)
+            self._compact()
+
+    def remove_nodes(self, memory_ids):
+        """Drop every link touching the given memories."""
+        with self.lock:
+            self._removed_nodes.update(int(memory_id) for memory_id in memory_ids)
+
+    def replace_links(self, memory_ids, links):
+        """Drop the links touching ``memory_ids`` and add ``links`` (their current set) instead."""
+        with self.lock:
+            self._compact()
+            self.remove_nodes(memory_ids)
+            self._compact()
+            for source_id, target_id, relation in links:
+                self.add(source_id, target_id, relation)
+
+    def _compact(self):
+        """Merge staged changes into the CSR arrays."""
+        if not self._added and not self._removed_nodes:
+            return
+        degrees = np.diff(self.indptr)
+        sources = np.repeat(self.nodes, degrees)
+        targets = self.nodes[self.neighbors]
+        codes = self.edge_relations
+
+        if self._added:
+            added = np.array(self._added, dtype=np.int64)
+            # Both directions, so expansion can follow a link from either end
+            sources = np.concatenate([sources, added[:, 0], added[:, 1]])
+            targets = np.concatenate([targets, added[:, 1], added[:, 0]])
+            codes = np.concatenate([codes, added[:, 2], added[:, 2]]).astype(np.uint16)
+        if self._removed_nodes:
+            removed = np.fromiter(self._removed_nodes, dtype=np.int64)
+            keep = ~(np.isin(sources, removed) | np.isin(targets, removed))
+            sources, targets, codes = sources[keep], targets[keep], codes[keep]
+
+        edges = np.unique(np.stack([sources, targets, codes.astype(np.int64)], axis=1), axis=0) \
+            if len(sources) else np.empty((0, 3), dtype=np.int64)
+        self.nodes = np.unique(edges[:, 0])
+        self.indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(np.bincount(np.searchsorted(self.nodes, edges[:, 0]), minlength=len(self.nodes)))
+        self.neighbors = np.searchsorted(self.nodes, edges[:, 1]).astype(np.int32)
+        self.edge_relations = edges[:, 2].astype(np.uint16)
+        self._added = []
+        self._removed_nodes = set()
+
+    def expand(self, seed_ids, hops=1, limit=None):
+        """
+        Memories within ``hops`` (at most MAX_HOPS) links of the seeds, nearest
+        first and in seed order within a hop, as ``(memory_id, seed_id,
+        relation, hops)`` tuples; ``relation`` is that of the link reaching it.
+        Seeds themselves are never returned.
+        """
+        hops = max(0, min(int(hops), MAX_HOPS))
+        with self.lock:
+            self._compact()
+            if not hops or not len(self.nodes):
+                return []
+            seed_ids = [int(seed_id) for seed_id in seed_ids]
+            positions = np.searchsorted(self.nodes, seed_ids)
+            frontier = [(int(position), seed_id) for position, seed_id in zip(positions, seed_ids)
+                        if position < len(self.nodes) and self.nodes[position] == seed_id]
+
+            seen = set(seed_ids)
+            related = []
+            for hop in range(1, hops + 1):
+                next_frontier = []
+                for position, seed_id in frontier:
+                    start, end = self.indptr[position], self.indptr[position + 1]
+                    for neighbor, code in zip(self.neighbors[start:end].tolist(),
+                                              self.edge_relations[start:end].tolist()):
+                        memory_id = int(self.nodes[neighbor])
+                        if memory_id in seen:
+                            continue
+                        seen.add(memory_id)
+                        related.append((memory_id, seed_id, self.relations[code], hop))
+                        if limit is not None and len(related) >= limit:
+                            return related
+                        next_frontier.append((neighbor, seed_id))
+                frontier = next_frontier
+            return related
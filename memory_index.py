@@ -0,0 +1,633 @@
+"""
+Per-user vector index for the memory system.
+
+Each user's embeddings live in one contiguous float32 matrix so that a search
+is a single matrix-vector product followed by a partial sort, instead of a
+Python loop over every memory held by every user. Rows are stored
+L2-normalised, so the product is cosine similarity.
+"""
+
+import os
+import logging
+import tempfile
+import itertools
+import threading
+from datetime import datetime, timezone
+import numpy as np
+import config
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Initial number of rows allocated for a new user index
+DEFAULT_CAPACITY = 64
+
+EPOCH = datetime(1970, 1, 1)
+
+# Index versions are unique across instances, so a reloaded index never reuses an old one
+_versions = itertools.count(1)
+
+
+def to_timestamp(value):
+    """Seconds since the epoch for a datetime (naive values are UTC, as stored) or a number."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return (value - EPOCH).total_seconds()
+    return float(value)
+
+
+class UserMemoryIndex:
+    """
+    Embedding matrix for a single user.
+
+    Rows ``0..size-1`` of ``matrix`` are live. ``ids[row]`` holds the memory id
+    stored in that row and ``row_of[memory_id]`` maps back to the row. Deleting
+    a memory moves the last row into the freed slot, so the live rows always
+    stay contiguous and only the moved memory's mapping changes.
+
+    ``ann`` is an optional ann_index.IVFIndex over the same rows. When set,
+    searches only score the rows it proposes; every row change is mirrored
+    into it.
+
+    ``quantized`` is an optional quant_index.Int8Matrix copy of the rows. When
+    set, full scans run over it and only the best MEMORY_QUANTIZE_RESCORE
+    rows are re-scored from ``matrix``; row changes are mirrored into it too.
+    While it is attached, a private ``matrix`` is moved to an unnamed file
+    under VECTOR_DB_PATH (see spill_matrix()), so the float32 rows are paged
+    in from the page cache as re-scoring reads them rather than held in RAM.
+
+    ``text_index`` is the user's memory_text_index.UserTextIndex,
+    ``dedup_index`` their memory_dedup.UserDedupIndex and ``graph`` their
+    memory_graph.UserGraph, all loaded and kept up to date alongside the
+    embeddings by memory_system.
+
+    Rows also carry filter attributes: ``created[row]`` is the memory's
+    creation time, and ``bitmaps[tag]`` is a boolean column marking the rows
+    that carry ``tag``, e.g. ``("entry_type", "contact")``. ``_time_order``
+    lists rows sorted by creation time so date ranges are found by binary
+    search; it is rebuilt on the first date-filtered search after rows change.
+    Memories with no row (not embedded, e.g. awaiting re-embedding by a new
+    model) keep theirs in ``text_only``, memory id -> (created, tags), so
+    filtered BM25 searches over them stay in memory too (filter_text_only()).
+
+    Rows carry ranking signals too: ``used[row]`` is when the memory was last
+    updated or returned by a search and ``access_counts[row]`` how often it
+    has been returned. _blend() mixes them into similarity scores as part of
+    the same vectorized pass (see MEMORY_RECENCY_WEIGHT and
+    MEMORY_ACCESS_WEIGHT).
+
+    ``log_position`` is the MemoryChangeLog id the index is known to reflect
+    and ``changes_since_segment`` counts writes applied since its segment file
+    was last written; both are maintained by memory_system.
+
+    ``version`` changes whenever memory_system writes to the user's memories
+    (see bump_version()); cached search results record the version they were
+    computed against and are stale once it moves on.
+    """
+
+    def __init__(self, user_id, dim=None, capacity=DEFAULT_CAPACITY):
+        self.user_id = str(user_id)
+        self.dim = dim
+        self.size = 0
+        self.lock = threading.RLock()
+        self._capacity = max(1, capacity)
+        self.matrix = None
+        self.ids = np.empty(self._capacity, dtype=np.int64)
+        self.row_of = {}
+        self.created = np.zeros(self._capacity, dtype=np.float64)
+        self.used = np.zeros(self._capacity, dtype=np.float64)
+        self.access_counts = np.zeros(self._capacity, dtype=np.float32)
+        self._max_access = 0.0
+        self.bitmaps = {}
+        self.tags_of = {}
+        self._time_order = None
+        self._time_values = None
+        self.text_only = {}
+        self._text_only_arrays = None
+        self.ann = None
+        self.quantized = None
+        self._spill_file = None
+        self.text_index = None
+        self.dedup_index = None
+        self.graph = None
+        self.log_position = 0
+        self.changes_since_segment = 0
+        self.version = next(_versions)
+        if dim:
+            self.matrix = np.zeros((self._capacity, dim), dtype=np.float32)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, memory_id):
+        return int(memory_id) in self.row_of
+
+    def _fit(self, vector):
+        """Convert a vector to unit-length float32, padded or truncated to the index dimension."""
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        if self.dim is None:
+            self.dim = len(vector)
+            self.matrix = np.zeros((self._capacity, self.dim), dtype=np.float32)
+        if len(vector) != self.dim:
+            fitted = np.zeros(self.dim, dtype=np.float32)
+            length = min(len(vector), self.dim)
+            fitted[:length] = vector[:length]
+            vector = fitted
+        norm = np.linalg.norm(vector)
+        if norm > 0 and abs(norm - 1.0) > 1e-4:
+            vector = vector / norm
+        return vector
+
+    def _grow(self, min_capacity):
+        """Grow the backing arrays geometrically so appends stay amortised O(1)."""
+        if min_capacity <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < min_capacity:
+            capacity *= 2
+
+        if self._spill_file is not None:
+            matrix = self._map_spill_file(capacity)
+        elif self.quantized is not None:
+            # Re-scoring reads few rows, so an outgrown segment map moves to a spill file, not RAM
+            self._open_spill_file()
+            matrix = self._map_spill_file(capacity)
+            matrix[:self.size] = self.matrix[:self.size]
+        else:
+            matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            matrix[:self.size] = self.matrix[:self.size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+        created = np.zeros(capacity, dtype=np.float64)
+        created[:self.size] = self.created[:self.size]
+        used = np.zeros(capacity, dtype=np.float64)
+        used[:self.size] = self.used[:self.size]
+        access_counts = np.zeros(capacity, dtype=np.float32)
+        access_counts[:self.size] = self.access_counts[:self.size]
+        for tag, bitmap in self.bitmaps.items():
+            grown = np.zeros(capacity, dtype=bool)
+            grown[:self.size] = bitmap[:self.size]
+            self.bitmaps[tag] = grown
+
+        self.matrix = matrix
+        self.ids = ids
+        self.created = created
+        self.used = used
+        self.access_counts = access_counts
+        self._capacity = capacity
+
+    def bump_version(self):
+        """Mark the user's memories as changed, making cached search results stale."""
+        self.version = next(_versions)
+
+    def reserve(self, capacity):
+        """Pre-size the backing arrays, e.g. before a bulk load of known size."""
+        with self.lock:
+            if self.matrix is None:
+                if capacity > self._capacity:
+                    self._capacity = capacity
+                    self.ids = np.empty(capacity, dtype=np.int64)
+                    self.created = np.zeros(capacity, dtype=np.float64)
+                    self.used = np.zeros(capacity, dtype=np.float64)
+                    self.access_counts = np.zeros(capacity, dtype=np.float32)
+            else:
+                self._grow(capacity)
+
+    def is_mapped(self):
+        """
+        Whether the matrix is memory-mapped (a segment, or spilled by
+        spill_matrix()), so its pages live in the page cache rather than in
+        this process's private memory.
+        """
+        return isinstance(self.matrix, np.memmap)
+
+    def is_spilled(self):
+        """Whether the matrix was moved to a spill file by spill_matrix() (or _grow())."""
+        return self._spill_file is not None
+
+    def _open_spill_file(self, directory=None):
+        directory = directory or config.VECTOR_DB_PATH
+        os.makedirs(directory, exist_ok=True)
+        self._spill_file = tempfile.TemporaryFile(prefix="matrix_", dir=directory)
+
+    def _map_spill_file(self, capacity):
+        """Size the spill file to ``capacity`` rows and map it; rows already in the file are kept."""
+        self._spill_file.truncate(capacity * self.dim * 4)
+        return np.memmap(self._spill_file, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+
+    def spill_matrix(self, directory=None):
+        """
+        Move a private matrix into an unnamed file in ``directory`` (default
+        VECTOR_DB_PATH) and map it, so its pages can be dropped from RAM and
+        read back on demand. The file has no name, so nothing is left behind
+        if the process dies. Already mapped matrices are left alone.
+        """
+        with self.lock:
+            if self.matrix is None or self.is_mapped():
+                return False
+            self._open_spill_file(directory)
+            matrix = self._map_spill_file(self._capacity)
+            matrix[:self.size] = self.matrix[:self.size]
+            self.matrix = matrix
+            return True
+
+    def unspill_matrix(self):
+        """Bring a spilled matrix back into private memory and close its file."""
+        with self.lock:
+            if self._spill_file is None:
+                return
+            self.matrix = np.array(self.matrix)
+            self._close_spill_file()
+
+    def _close_spill_file(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def adopt(self, ids, matrix, size):
+        """
+        Use existing arrays as the backing store, e.g. a memory-mapped segment.
+        ``matrix`` must hold unit-length rows; its spare rows absorb appends
+        until the index outgrows it and _grow() copies into private memory
+        (or a spill file, with the int8 tier attached).
+        """
+        with self.lock:
+            self._close_spill_file()
+            self.dim = matrix.shape[1]
+            self.matrix = matrix
+            self.ids = ids
+            self._capacity = len(matrix)
+            self.size = size
+            self.row_of = {memory_id: row for row, memory_id in enumerate(ids[:size].tolist())}
+            self.quantized = None
+            # Segments hold embeddings only; attributes are set afterwards
+            self.created = np.zeros(self._capacity, dtype=np.float64)
+            self.used = np.zeros(self._capacity, dtype=np.float64)
+            self.access_counts = np.zeros(self._capacity, dtype=np.float32)
+            self._max_access = 0.0
+            self.bitmaps = {}
+            self.tags_of = {}
+            self._time_order = None
+            self.text_only = {}
+            self._text_only_arrays = None
+
+    def upsert(self, memory_id, vector):
+        """Insert a memory's embedding, or overwrite its row in place if already indexed."""
+        memory_id = int(memory_id)
+        with self.lock:
+            vector = self._fit(vector)
+            row = self.row_of.get(memory_id)
+            if row is None:
+                self._grow(self.size + 1)
+                row = self.size
+                self.ids[row] = memory_id
+                self.row_of[memory_id] = row
+                self.size += 1
+                self.matrix[row] = vector
+                self.created[row] = 0.0
+                self.used[row] = 0.0
+                self.access_counts[row] = 0.0
+                self._time_order = None
+                self._adopt_text_only_attributes(memory_id, row)
+                if self.ann is not None:
+                    self.ann.add(row, vector)
+                if self.quantized is not None:
+                    self.quantized.set_row(row, vector)
+            else:
+                self.matrix[row] = vector
+                if self.ann is not None:
+                    self.ann.reassign(row, vector)
+                if self.quantized is not None:
+                    self.quantized.set_row(row, vector)
+            return row
+
+    def upsert_many(self, memory_ids, vectors):
+        """
+        Insert a block of embeddings with one resize and one matrix copy, e.g.
+        for a bulk import. Memories that are already indexed are overwritten
+        one by one through upsert().
+        """
+        with self.lock:
+            fresh = []
+            for memory_id, vector in zip(memory_ids, vectors):
+                if int(memory_id) in self.row_of:
+                    self.upsert(memory_id, vector)
+                else:
+                    fresh.append((int(memory_id), vector))
+            if not fresh:
+                return
+
+            if isinstance(vectors, np.ndarray) and vectors.ndim == 2 and vectors.shape[1] == self.dim \
+                    and len(fresh) == len(vectors):
+                # A ready matrix of new rows, normalized in one step
+                block = vectors.astype(np.float32)
+                norms = np.linalg.norm(block, axis=1)
+                rescale = (norms > 0) & (np.abs(norms - 1.0) > 1e-4)
+                block[rescale] /= norms[rescale, None]
+            else:
+                block = np.vstack([self._fit(vector) for _, vector in fresh])
+            first = self.size
+            self._grow(first + len(fresh))
+            self.matrix[first:first + len(fresh)] = block
+            for offset, (memory_id, _) in enumerate(fresh):
+                self.ids[first + offset] = memory_id
+                self.row_of[memory_id] = first + offset
+            self.created[first:first + len(fresh)] = 0.0
+            self.used[first:first + len(fresh)] = 0.0
+            self.access_counts[first:first + len(fresh)] = 0.0
+            self.size += len(fresh)
+            self._time_order = None
+            if self.text_only:
+                for offset, (memory_id, _) in enumerate(fresh):
+                    self._adopt_text_only_attributes(memory_id, first + offset)
+            if self.ann is not None:
+                self.ann.add_rows(first, self.ann.assign(block))
+                self.ann.mutations += len(fresh)
+            if self.quantized is not None:
+                self.quantized.set_rows(first, block)
+
+    def remove(self, memory_id):
+        """Remove a memory (its row, or its text_only attributes). Returns False if it had no row."""
+        memory_id = int(memory_id)
+        with self.lock:
+            if self.text_only.pop(memory_id, None) is not None:
+                self._text_only_arrays = None
+            row = self.row_of.pop(memory_id, None)
+            if row is None:
+                return False
+
+            for tag in self.tags_of.pop(memory_id, ()):
+                self.bitmaps[tag][row] = False
+
+            last = self.size - 1
+            if row != last:
+                # Move the last row into the hole to keep the matrix contiguous
+                moved_id = int(self.ids[last])
+                self.matrix[row] = self.matrix[last]
+                self.ids[row] = moved_id
+                self.row_of[moved_id] = row
+                self.created[row] = self.created[last]
+                self.used[row] = self.used[last]
+                self.access_counts[row] = self.access_counts[last]
+                for tag in self.tags_of.get(moved_id, ()):
+                    self.bitmaps[tag][row] = True
+                    self.bitmaps[tag][last] = False
+
+            self.matrix[last] = 0.0
+            self.size = last
+            self._time_order = None
+            if self.ann is not None:
+                self.ann.remove(row, last)
+            if self.quantized is not None:
+                self.quantized.move(row, last)
+            return True
+
+    def set_attributes(self, memory_id, created_at=None, tags=(), used_at=None, access_count=None):
+        """
+        Record a memory's creation time, filter tags and, when given, its
+        last-used time and access count. Returns False if the memory has no
+        row (it is not embedded); its creation time and tags are then kept in
+        ``text_only`` until it gets one.
+        """
+        memory_id = int(memory_id)
+        with self.lock:
+            row = self.row_of.get(memory_id)
+            if row is None:
+                previous = self.text_only.get(memory_id)
+                created = to_timestamp(created_at) if created_at is not None else previous[0] if previous else 0.0
+                self.text_only[memory_id] = (created, tuple(set(tags)))
+                self._text_only_arrays = None
+                return False
+
+            self._set_tags(memory_id, row, tags)
+
+            if created_at is not None:
+                created = to_timestamp(created_at)
+                if created != self.created[row]:
+                    self.created[row] = created
+                    self._time_order = None
+            if used_at is not None:
+                self.used[row] = max(self.used[row], to_timestamp(used_at))
+            if access_count is not None:
+                self.access_counts[row] = access_count
+                self._max_access = max(self._max_access, float(access_count))
+            return True
+
+    def _set_tags(self, memory_id, row, tags):
+        for tag in self.tags_of.pop(memory_id, ()):
+            self.bitmaps[tag][row] = False
+        tags = tuple(set(tags))
+        for tag in tags:
+            bitmap = self.bitmaps.get(tag)
+            if bitmap is None:
+                bitmap = self.bitmaps[tag] = np.zeros(self._capacity, dtype=bool)
+            bitmap[row] = True
+        if tags:
+            self.tags_of[memory_id] = tags
+
+    def _adopt_text_only_attributes(self, memory_id, row):
+        """Move a newly embedded memory's text_only attributes onto its new row."""
+        attributes = self.text_only.pop(memory_id, None)
+        if attributes is None:
+            return
+        self._text_only_arrays = None
+        created, tags = attributes
+        self.created[row] = created
+        self._set_tags(memory_id, row, tags)
+
+    def record_access(self, memory_ids, used_at):
+        """Count one use of each memory, as of ``used_at``; unindexed ids are ignored."""
+        used = to_timestamp(used_at)
+        with self.lock:
+            for memory_id in memory_ids:
+                row = self.row_of.get(int(memory_id))
+                if row is None:
+                    continue
+                self.access_counts[row] += 1
+                self.used[row] = max(self.used[row], used)
+                self._max_access = max(self._max_access, float(self.access_counts[row]))
+
+    def _blend(self, scores, rows=None, now=None):
+        """
+        Mix recency and use into similarity scores (for all live rows, or for
+        ``rows``):
+
+            (1 - wr - wa) * similarity + wr * 0.5 ** (age / half_life) + wa * log(1 + uses) / log(1 + max uses)
+
+        where age is the time since the memory was last used. Returns the
+        scores unchanged when both weights are zero.
+        """
+        recency_weight = config.MEMORY_RECENCY_WEIGHT
+        access_weight = config.MEMORY_ACCESS_WEIGHT
+        if not recency_weight and not access_weight:
+            return scores
+
+        blended = scores * np.float32(1.0 - recency_weight - access_weight)
+        if recency_weight:
+            used = self.used[:self.size] if rows is None else self.used[rows]
+            now = to_timestamp(now) if now is not None else (datetime.utcnow() - EPOCH).total_seconds()
+            age = np.maximum(now - used, 0.0) / (config.MEMORY_RECENCY_HALF_LIFE_DAYS * 86400.0)
+            blended += np.float32(recency_weight) * np.exp2(-age).astype(np.float32)
+        if access_weight and self._max_access > 0:
+            counts = self.access_counts[:self.size] if rows is None else self.access_counts[rows]
+            blended += np.float32(access_weight / np.log1p(self._max_access)) * np.log1p(counts)
+        return blended
+
+    def _sorted_times(self):
+        """Rows ordered by creation time, with their times; rebuilt only after changes."""
+        if self._time_order is None:
+            created = self.created[:self.size]
+            self._time_order = np.argsort(created, kind='stable')
+            self._time_values = created[self._time_order]
+        return self._time_order, self._time_values
+
+    def filter_rows(self, tags=(), start=None, end=None):
+        """
+        Rows carrying every tag in ``tags`` and created in ``[start, end)``,
+        or None when no filter is given.
+        """
+        with self.lock:
+            if not tags and start is None and end is None:
+                return None
+            if self.size == 0:
+                return np.empty(0, dtype=np.int64)
+
+            if start is not None or end is not None:
+                order, values = self._sorted_times()
+                low = 0 if start is None else np.searchsorted(values, to_timestamp(start), side='left')
+                high = len(values) if end is None else np.searchsorted(values, to_timestamp(end), side='left')
+                rows = np.sort(order[low:high])
+                for tag in tags:
+                    bitmap = self.bitmaps.get(tag)
+                    if bitmap is None:
+                        return np.empty(0, dtype=np.int64)
+                    rows = rows[bitmap[rows]]
+                return rows
+
+            mask = None
+            for tag in tags:
+                bitmap = self.bitmaps.get(tag)
+                if bitmap is None:
+                    return np.empty(0, dtype=np.int64)
+                mask = bitmap[:self.size].copy() if mask is None else mask & bitmap[:self.size]
+            return np.flatnonzero(mask)
+
+    def filter_text_only(self, tags=(), start=None, end=None):
+        """
+        Ids of the memories in ``text_only`` carrying every tag in ``tags``
+        and created in ``[start, end)``. Their attributes are laid out as
+        arrays on the first call after they change.
+        """
+        with self.lock:
+            if not self.text_only:
+                return np.empty(0, dtype=np.int64)
+            if self._text_only_arrays is None:
+                ids = np.fromiter(self.text_only.keys(), dtype=np.int64, count=len(self.text_only))
+                created = np.fromiter((created for created, _ in self.text_only.values()),
+                                      dtype=np.float64, count=len(self.text_only))
+                bitmaps = {}
+                for position, (_, memory_tags) in enumerate(self.text_only.values()):
+                    for tag in memory_tags:
+                        bitmap = bitmaps.get(tag)
+                        if bitmap is None:
+                            bitmap = bitmaps[tag] = np.zeros(len(ids), dtype=bool)
+                        bitmap[position] = True
+                self._text_only_arrays = (ids, created, bitmaps)
+            ids, created, bitmaps = self._text_only_arrays
+
+            mask = np.ones(len(ids), dtype=bool)
+            if start is not None:
+                mask &= created >= to_timestamp(start)
+            if end is not None:
+                mask &= created < to_timestamp(end)
+            for tag in tags:
+                bitmap = bitmaps.get(tag)
+                if bitmap is None:
+                    return np.empty(0, dtype=np.int64)
+                mask &= bitmap
+            return ids[mask]
+
+    def scores(self, query_vector):
+        """Score every live row against a query vector (cosine similarity clipped to 0-1)."""
+        with self.lock:
+            if self.size == 0:
+                return np.empty(0, dtype=np.float32)
+            query = self._fit(query_vector)
+            scores = self.matrix[:self.size] @ query
+            np.clip(scores, 0.0, 1.0, out=scores)
+            return scores
+
+    def search(self, query_vector, limit=5, exact=False, rows=None):
+        """
+        Return the ``limit`` best matching memories as ``(memory_id, score)`` pairs,
+        best first. Uses the ANN tier when one is attached unless ``exact`` is set.
+        Scores are similarity blended with recency and use (see _blend()).
+        Without an ANN tier, scans go through the int8 tier when one is attached
+        (see quantized_search_rows()).
+
+        ``rows`` (from filter_rows(), under the same lock) restricts the search
+        to those rows; only they are scored.
+        """
+        with self.lock:
+            if self.size == 0 or limit <= 0:
+                return []
+            if self.quantized is not None and not exact and (self.ann is None or rows is not None) \
+                    and (rows is None or len(rows) > config.MEMORY_QUANTIZE_RESCORE):
+                top_rows, scores = self.quantized_search_rows(self._fit(query_vector), limit, rows)
+                return [(int(self.ids[row]), float(score)) for row, score in zip(top_rows, scores)]
+            if rows is None and (self.ann is None or exact):
+                scores = self._blend(self.scores(query_vector))
+                top_rows = top_k(scores, limit)
+                return [(int(self.ids[row]), float(scores[row])) for row in top_rows]
+
+            query = self._fit(query_vector)
+            if rows is None:
+                rows = self.ann.candidates(query, config.MEMORY_ANN_NPROBE)
+            elif self.ann is not None and not exact and len(rows) > config.MEMORY_ANN_THRESHOLD:
+                # A broad filter: probe the ANN lists and keep the candidates that pass it
+                allowed = np.zeros(self.size, dtype=bool)
+                allowed[rows] = True
+                candidates = self.ann.candidates(query, config.MEMORY_ANN_NPROBE)
+                rows = candidates[allowed[candidates]]
+            if len(rows) == 0:
+                return []
+            scores = self.matrix[rows] @ query
+            np.clip(scores, 0.0, 1.0, out=scores)
+            scores = self._blend(scores, rows)
+            best = top_k(scores, limit)
+            return [(int(self.ids[rows[i]]), float(scores[i])) for i in best]
+
+
+    def quantized_search_rows(self, query, limit, rows=None, blend=True):
+        """
+        Scan the int8 copy (of all rows, or of ``rows``), re-score the best
+        MEMORY_QUANTIZE_RESCORE from the float32 matrix and return the top
+        ``limit`` as ``(rows, scores)``, best first. Call under the lock with
+        a fitted query.
+        """
+        first_pass = self.quantized.scores(query, self.size, rows)
+        np.clip(first_pass, 0.0, 1.0, out=first_pass)
+        if blend:
+            first_pass = self._blend(first_pass, rows)
+        picked = top_k(first_pass, max(limit, config.MEMORY_QUANTIZE_RESCORE))
+        # Sorted so re-scoring reads the (possibly memory-mapped) matrix in order
+        candidates = np.sort(picked if rows is None else rows[picked])
+
+        scores = self.matrix[candidates] @ query
+        np.clip(scores, 0.0, 1.0, out=scores)
+        if blend:
+            scores = self._blend(scores, candidates)
+        best = top_k(scores, limit)
+        return candidates[best], scores[best]
+
+def top_k(scores, limit):
+    """Indices of the ``limit`` highest scores, highest first, via argpartition."""
+    count = len(scores)
+    if limit >= count:
+        return np.argsort(-scores, kind='stable')
+    candidates = np.argpartition(-scores, limit - 1)[:limit]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
@@ -0,0 +1,192 @@
+"""
+On-disk segment files for sharing memory indexes between worker processes.
+
+A segment is a snapshot of one user's UserMemoryIndex: a small header, a
+directory of named arrays, the memory id of every row, the float32 embedding
+matrix laid out exactly as the index holds it, and the arrays behind the
+user's BM25 and near-duplicate indexes (see UserTextIndex.to_arrays and
+UserDedupIndex.to_arrays). Workers map all of it copy-on-write with
+np.memmap, so every gunicorn worker serving the same user shares one copy
+through the page cache; only the pages a worker later modifies become
+private to it.
+
+A segment records the MemoryChangeLog position it reflects. A worker that maps
+it replays later changes from the log, then keeps up by tailing the log (see
+memory_system.sync_memory_indexes).
+"""
+
+import os
+import re
+import struct
+import logging
+import numpy as np
+import config
+from embeddings import get_embedder, model_slug
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# magic, format version, embedding dim, live rows, allocated rows, change log position, named arrays
+HEADER = struct.Struct('<4sB3xIQQQQ')
+MAGIC = b'MSEG'
+FORMAT_VERSION = 2
+
+# name, numpy dtype string, shape (second dimension 0 for 1-D arrays), file offset
+ARRAY_ENTRY = struct.Struct('<32s8sQQQ')
+
+# Named arrays start on multiples of this many bytes
+ARRAY_ALIGNMENT = 64
+
+# Spare rows written after the live ones so appends land in the mapped file
+MIN_HEADROOM = 64
+
+
+class Segment:
+    """
+    A mapped segment: ``ids`` and ``matrix`` have ``capacity`` rows, ``count``
+    of them live; ``arrays`` maps the names of the other arrays to them.
+    """
+
+    def __init__(self, path, dim, count, capacity, log_position, ids, matrix, arrays):
+        self.path = path
+        self.dim = dim
+        self.count = count
+        self.capacity = capacity
+        self.log_position = log_position
+        self.ids = ids
+        self.matrix = matrix
+        self.arrays = arrays
+
+
+def segment_path(user_id):
+    """Segments are kept per embedding model, so a model change never maps vectors from the old one."""
+    safe_id = re.sub(r'[^\w.-]', '_', str(user_id))
+    return os.path.join(config.VECTOR_DB_PATH, "segments", model_slug(get_embedder().model_version),
+                        f"{safe_id}.seg")
+
+
+def read_header(path):
+    """Return ``(dim, count, capacity, log_position, array_count)`` for a segment file, or None."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, version, dim, count, capacity, log_position, array_count = HEADER.unpack(header)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    return dim, count, capacity, log_position, array_count
+
+
+def _map_array(path, dtype, shape, offset):
+    if not np.prod(shape):
+        # mmap cannot map zero bytes
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='c', offset=offset, shape=shape)
+
+
+def open_segment(user_id, dim, path=None):
+    """Map a user's segment copy-on-write. Returns None if there is no usable segment."""
+    path = path or segment_path(user_id)
+    header = read_header(path)
+    if header is None:
+        return None
+    segment_dim, count, capacity, log_position, array_count = header
+    if segment_dim != dim:
+        return None
+
+    with open(path, 'rb') as f:
+        f.seek(HEADER.size)
+        directory = f.read(ARRAY_ENTRY.size * array_count)
+    ids_offset = HEADER.size + ARRAY_ENTRY.size * array_count
+    matrix_offset = ids_offset + 8 * capacity
+    expected_size = matrix_offset + 4 * capacity * dim
+    entries = []
+    for position in range(array_count):
+        name, dtype, rows, columns, offset = ARRAY_ENTRY.unpack_from(directory, position * ARRAY_ENTRY.size)
+        dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        shape = (rows, columns) if columns else (rows,)
+        entries.append((name.rstrip(b'\0').decode('ascii'), dtype, shape, offset))
+        expected_size = max(expected_size, offset + dtype.itemsize * int(np.prod(shape)))
+    if len(directory) < ARRAY_ENTRY.size * array_count or os.path.getsize(path) < expected_size:
+        logger.warning(f"Ignoring truncated memory segment {path}")
+        return None
+
+    ids = np.fromfile(path, dtype=np.int64, count=capacity, offset=ids_offset)
+    matrix = _map_array(path, np.float32, (capacity, dim), matrix_offset)
+    arrays = {name: _map_array(path, dtype, shape, offset) for name, dtype, shape, offset in entries}
+    return Segment(path, dim, count, capacity, log_position, ids, matrix, arrays)
+
+
+def write_segment(index, log_position, path=None):
+    """
+    Snapshot an index to its segment file at ``log_position``.
+
+    Skipped if the file on disk is already at least that recent or another
+    process is writing it. The file is replaced atomically, so workers that
+    mapped the previous version keep a consistent view.
+    """
+    path = path or segment_path(index.user_id)
+    existing = read_header(path)
+    if existing is not None and existing[3] >= log_position and existing[0] == index.dim:
+        return False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_file = open(f"{path}.lock", 'w')
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False
+
+        with index.lock:
+            if index.dim is None:
+                return False
+            dim = index.dim
+            count = index.size
+            ids = index.ids[:count].copy()
+            matrix = np.array(index.matrix[:count])
+            arrays = {}
+            for attached in (index.text_index, index.dedup_index):
+                if attached is not None:
+                    arrays.update(attached.to_arrays())
+
+        # Written outside the lock so searches are not blocked by disk I/O
+        capacity = count + max(MIN_HEADROOM, count // 4)
+        ids_offset = HEADER.size + ARRAY_ENTRY.size * len(arrays)
+        offset = ids_offset + 8 * capacity + 4 * capacity * dim
+        directory = []
+        for name, array in arrays.items():
+            offset = -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+            rows, columns = array.shape if array.ndim == 2 else (len(array), 0)
+            directory.append(ARRAY_ENTRY.pack(name.encode('ascii'), array.dtype.str.encode('ascii'),
+                                              rows, columns, offset))
+            offset += array.nbytes
+
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, dim, count, capacity, log_position, len(arrays)))
+            f.write(b''.join(directory))
+            f.write(ids.tobytes())
+            f.write(bytes(8 * (capacity - count)))
+            f.write(matrix.tobytes())
+            f.truncate(ids_offset + 8 * capacity + 4 * capacity * dim)
+            for entry, array in zip(directory, arrays.values()):
+                f.seek(ARRAY_ENTRY.unpack(entry)[4])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(offset)
+
+        os.replace(temp_path, path)
+        logger.debug(f"Wrote memory segment for user {index.user_id}: {count} rows at change {log_position}")
+        return True
+    finally:
+        lock_file.close()
@@ -1,65 +1,763 @@
 import os
+import asyncio
 import logging
 import json
-import hashlib
-import re
-from datetime import datetime
+import socket
+import threading
+import time
+from collections import Counter, OrderedDict
+from itertools import islice
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
 from app import db
-from models import MemoryEntry, Message
+from models import (User, Conversation, Message, MemoryEntry, MemoryLink, MemoryChangeLog, EmbeddingMigration,
+                    Document, FaceImage)
+from memory_index import UserMemoryIndex, to_timestamp
+from memory_text_index import UserTextIndex, reciprocal_rank_fusion, tokenize
+from memory_dedup import UserDedupIndex, minhash_signature, pack_signature, unpack_signature
+from memory_graph import UserGraph
+from contact_store import sync_contacts, delete_contacts, backfill_contacts_in_background
+from embedding_codec import pack_embedding, unpack_embedding, unpack_embeddings
+from embeddings import get_embedder
+from ann_index import maybe_update_ann
+from quant_index import maybe_update_quantized
+from memory_segments import open_segment, write_segment
+import config
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Simple in-memory storage for development
-memory_store = {}
+# Per-user embedding indexes, keyed by user id
+memory_indexes = {}
+_memory_indexes_lock = threading.Lock()
 
-def simple_embedding(text):
+# Progress of the startup warm load, exposed through get_memory_index_status()
+memory_index_status = {
+    "state": "idle",
+    "users_total": 0,
+    "users_loaded": 0,
+    "users_deferred": 0,
+    "rows_loaded": 0,
+    "started_at": None,
+    "finished_at": None
+}
+
+# Per-retriever search latency, exposed through get_memory_index_status()
+search_latency = {
+    retriever: {"searches": 0, "total_ms": 0.0, "last_ms": None}
+    for retriever in ("vector", "bm25", "fusion")
+}
+
+# LRU cache of search results keyed by (user, normalized query, filters, limit).
+# Each entry records the index version it was computed against; a write to the
+# user's memories bumps the version, so only that user's entries go stale.
+_search_cache = OrderedDict()
+_search_cache_lock = threading.Lock()
+search_cache_stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+# How far this process has tailed MemoryChangeLog, exposed through get_memory_index_status()
+change_log_status = {
+    "position": 0,
+    "last_sync_at": None,
+    "changes_applied": 0,
+    "segments_written": 0
+}
+
+# Change ids near the tail that were already handled. Ids are allocated before
+# commit, so a slow transaction can land behind ids already seen; each poll
+# re-reads CHANGE_LOG_OVERLAP ids behind the position to pick those up.
+_seen_changes = set()
+CHANGE_LOG_OVERLAP = 200
+
+# Changes read per change log query
+CHANGE_LOG_BATCH = 1000
+
+# Seconds between change log prunes
+CHANGE_LOG_PRUNE_INTERVAL = 600
+_last_prune = 0.0
+
+# Search hits not yet written to MemoryEntry.access_count, keyed by memory id;
+# flushed in batches every MEMORY_ACCESS_FLUSH_INTERVAL seconds
+_pending_accesses = Counter()
+_pending_accesses_lock = threading.Lock()
+access_flush_status = {"flushes": 0, "memories_updated": 0, "last_flush_at": None}
+
+# Conversations with a background memory extraction running in this process
+_extractions_running = set()
+_extractions_lock = threading.Lock()
+
+# Progress of this process's re-embedding job, exposed through get_memory_index_status()
+reembed_status = {
+    "state": "idle",
+    "model": None,
+    "stale_rows": None,
+    "rows_reembedded": 0,
+    "last_memory_id": 0,
+    "started_at": None,
+    "finished_at": None
+}
+
+def embed_text(text):
+    """Embed a single text with the configured (cached) embedding provider."""
+    return get_embedder().embed(text)
+
+def memory_text(title, content):
+    """The text a memory is embedded from."""
+    return f"{title} {content}"
+
+def memory_signature(title, content):
+    """Near-duplicate signature of a memory, over the same text it is embedded from."""
+    return minhash_signature(memory_text(title, content))
+
+def embedding_dim():
+    """Dimension of the configured embedder's vectors."""
+    embedder = get_embedder()
+    if embedder.dim is None:
+        # API-backed providers only learn their dimension from a first call
+        embedder.embed("")
+    return embedder.dim
+
+def embedding_model():
+    """Model version of the configured embedder, stored with every embedding it produces."""
+    return get_embedder().model_version
+
+def _stale_embedding(model):
+    """Filter clause matching rows whose embedding was not produced by ``model`` (or is untagged)."""
+    return or_(MemoryEntry.embedding_model.is_(None), MemoryEntry.embedding_model != model)
+
+def encode_embedding(embedding):
+    """Pack an embedding for the MemoryEntry.packed_embedding column."""
+    return pack_embedding(embedding, dtype=config.MEMORY_EMBEDDING_DTYPE)
+
+def decode_stored_embedding(packed_embedding, vector_embedding=None):
+    """
+    Read a stored embedding, preferring the packed column and falling back to
+    the legacy JSON text for rows that have not been migrated yet.
+    """
+    if packed_embedding is not None:
+        return unpack_embedding(packed_embedding)
+    if vector_embedding:
+        return json.loads(vector_embedding)
+    return None
+
+def _process_origin():
+    """Identifies this worker process in MemoryChangeLog (computed per call so forks differ)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def record_change(user_id, memory_id, operation):
+    """Log a memory write in the current transaction so other workers can apply it."""
+    if not config.MEMORY_SHARED_INDEX:
+        return
+    db.session.add(MemoryChangeLog(
+        user_id=str(user_id),
+        memory_id=memory_id,
+        operation=operation,
+        origin=_process_origin()
+    ))
+
+def current_change_position():
+    """Highest change id written so far."""
+    return db.session.query(func.max(MemoryChangeLog.id)).scalar() or 0
+
+# MemoryEntry columns the text index, dedup index and filter attributes are built from
+_TEXT_COLUMNS = (MemoryEntry.id, MemoryEntry.title, MemoryEntry.content, MemoryEntry.entry_type,
+                 MemoryEntry.meta_data, MemoryEntry.created_at, MemoryEntry.minhash_signature,
+                 MemoryEntry.updated_at, MemoryEntry.last_accessed_at, MemoryEntry.access_count)
+_EMBEDDING_COLUMNS = (MemoryEntry.packed_embedding, MemoryEntry.vector_embedding, MemoryEntry.embedding_model)
+_ATTRIBUTE_COLUMNS = (MemoryEntry.id, MemoryEntry.entry_type, MemoryEntry.meta_data, MemoryEntry.created_at,
+                      MemoryEntry.updated_at, MemoryEntry.last_accessed_at, MemoryEntry.access_count)
+
+def _set_row_attributes(index, row):
+    """Set a row's filter attributes and ranking signals in a user's index."""
+    used_at = max((value for value in (row.created_at, row.updated_at, row.last_accessed_at) if value),
+                  default=None)
+    index.set_attributes(row.id, row.created_at, memory_tags(row.entry_type, row.meta_data),
+                         used_at=used_at, access_count=row.access_count or 0)
+
+def _row_signature(row):
+    """A row's stored signature, computed from its text for rows stored before signatures were."""
+    signature = unpack_signature(row.minhash_signature)
+    if signature is None:
+        signature = memory_signature(row.title, row.content)
+    return signature
+
+def memory_tags(entry_type, metadata=None):
+    """
+    Filter tags for a memory: its entry type plus the values of the
+    MEMORY_FILTER_METADATA_KEYS present in its metadata.
+    """
+    tags = [("entry_type", entry_type)]
+    metadata = metadata or {}
+    for key in config.MEMORY_FILTER_METADATA_KEYS:
+        value = metadata.get(key)
+        values = value if isinstance(value, (list, tuple)) else [value]
+        tags.extend((key, str(item)) for item in values if item is not None)
+    return tags
+
+def filter_tags(entry_type=None, metadata=None):
+    """Tags a search must match; raises ValueError for metadata keys that are not indexed."""
+    tags = []
+    if entry_type:
+        tags.append(("entry_type", entry_type))
+    for key, value in (metadata or {}).items():
+        if key not in config.MEMORY_FILTER_METADATA_KEYS:
+            raise ValueError(f"meta_data key '{key}' is not indexed for filtering "
+                             f"(see MEMORY_FILTER_METADATA_KEYS)")
+        tags.append((key, str(value)))
+    return tags
+
+def _has_embedding():
+    """Filter clause matching rows that carry an embedding in either column."""
+    return or_(MemoryEntry.packed_embedding.isnot(None), MemoryEntry.vector_embedding.isnot(None))
+
+def update_index_tiers(index):
+    """Build, rebuild or drop a user's ANN and int8 tiers as their index grows or shrinks."""
+    maybe_update_ann(index)
+    maybe_update_quantized(index)
+
+def get_user_index(user_id):
+    """Get the embedding index for a user, rehydrating it from the database on first use."""
+    index = memory_indexes.get(str(user_id))
+    if index is None:
+        index = load_user_index(user_id)
+    return index
+
+def load_user_index(user_id, batch_size=None):
+    """
+    Build a user's embedding and text indexes from their stored MemoryEntry
+    rows, and their memory graph from their MemoryLink rows.
+    
+    The index is registered before it is filled and its lock is held while
+    rows stream in, so concurrent searches for the same user wait for the
+    load instead of seeing a half-built index.
+    """
+    user_key = str(user_id)
+    batch_size = batch_size or config.MEMORY_LOAD_BATCH_SIZE
+    dim = embedding_dim()
+    
+    with _memory_indexes_lock:
+        index = memory_indexes.get(user_key)
+        if index is not None:
+            return index
+        index = UserMemoryIndex(user_key, dim=dim)
+        index.text_index = UserTextIndex(user_key)
+        index.dedup_index = UserDedupIndex(user_key)
+        index.graph = UserGraph(user_key)
+        index.lock.acquire()
+        memory_indexes[user_key] = index
+    
+    try:
+        started = time.perf_counter()
+        index.graph.load(db.session.query(MemoryLink.source_id, MemoryLink.target_id, MemoryLink.relation).filter(
+            MemoryLink.user_id == user_key
+        ).yield_per(batch_size))
+        if config.MEMORY_SHARED_INDEX:
+            row_count = _load_shared_index(index, batch_size)
+        else:
+            row_count = _rehydrate_index(index, batch_size)
+        logger.debug(f"Loaded {row_count} memories for user {user_key} "
+                     f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+    except Exception as e:
+        logger.error(f"Error loading memory index for user {user_key}: {e}")
+        # Drop the partial index so the next request retries the load
+        with _memory_indexes_lock:
+            if memory_indexes.get(user_key) is index:
+                del memory_indexes[user_key]
+    finally:
+        index.lock.release()
+    
+    # Large users get an approximate index, loaded from disk or trained in the background
+    update_index_tiers(index)
+    return index
+
+def _rehydrate_index(index, batch_size):
+    """
+    Stream a user's stored memories into an index, one batch of rows at a time.
+    Every memory's text goes into the text index; those with a usable
+    embedding also go into the matrix.
+    """
+    row_total = db.session.query(func.count(MemoryEntry.id)).filter(
+        MemoryEntry.user_id == index.user_id
+    ).scalar() or 0
+    if not row_total:
+        return 0
+    index.reserve(row_total)
+    
+    rows = iter(db.session.query(*_TEXT_COLUMNS, *_EMBEDDING_COLUMNS).filter(
+        MemoryEntry.user_id == index.user_id
+    ).order_by(MemoryEntry.id).yield_per(batch_size))
+    
+    row_count = 0
+    mismatched = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        indexed, unusable = _index_rows(index, batch)
+        row_count += indexed
+        mismatched += unusable
+    
+    if mismatched:
+        logger.warning(f"Skipped {mismatched} memories for user {index.user_id} "
+                       f"whose embeddings do not match the current embedder")
+    return row_count
+
+def _index_row(index, row):
     """
-    A very simple embedding function that just creates a hash of the text.
-    This is NOT suitable for production but works for demonstration.
+    Put one stored memory (a row of _TEXT_COLUMNS and _EMBEDDING_COLUMNS) into
+    a user's text, dedup and embedding indexes.
+    
+    Returns True if its embedding was indexed, None if it has none, and False
+    if the embedding is unusable (unreadable, or from a different model).
+    Rows stored before embeddings were tagged with their model are indexed
+    if their dimension matches; the re-embedding job tags them.
+    """
+    index.text_index.add(row.id, memory_text(row.title, row.content))
+    index.dedup_index.add(row.id, _row_signature(row), row.entry_type)
+    indexed = _index_row_embedding(index, row)
+    if not indexed:
+        # Drop any stale row; the filter attributes move to index.text_only
+        index.remove(row.id)
+        _set_row_attributes(index, row)
+    return indexed
+
+def _index_rows(index, rows):
     """
-    # Convert text to lowercase and remove punctuation for better matching
-    text = text.lower()
-    text = re.sub(r'[^\w\s]', '', text)
+    Put a batch of stored memories into a user's indexes, as _index_row does
+    for one: the text and dedup indexes are each extended in one step, and
+    packed embeddings of the index's dimension are decoded from one joined
+    buffer and appended to the matrix as one block. Other embeddings (legacy
+    JSON, other dimensions) go through _index_row_embedding one by one.
     
-    # Create a hash of the text
-    hash_obj = hashlib.md5(text.encode())
-    hash_hex = hash_obj.hexdigest()
+    Returns how many embeddings were indexed and how many were unusable.
+    """
+    index.text_index.add_many([(row.id, memory_text(row.title, row.content)) for row in rows])
+    index.dedup_index.add_many([(row.id, _row_signature(row), row.entry_type) for row in rows])
     
-    # Convert the hash to a list of floats (simulated embedding)
-    embedding = []
-    for i in range(0, len(hash_hex), 2):
-        if i < len(hash_hex) - 1:
-            val = int(hash_hex[i:i+2], 16) / 255.0  # Normalize to 0-1
-            embedding.append(val)
+    model = embedding_model()
+    decoded = [False] * len(rows)
+    if index.dim:
+        matrix, decoded = unpack_embeddings([
+            row.packed_embedding if row.embedding_model in (None, model) else None for row in rows
+        ], index.dim)
+        index.upsert_many([row.id for row, ok in zip(rows, decoded) if ok], matrix[decoded])
     
-    return embedding
+    indexed = 0
+    unusable = 0
+    for row, ok in zip(rows, decoded):
+        if ok:
+            _set_row_attributes(index, row)
+            indexed += 1
+            continue
+        result = _index_row_embedding(index, row)
+        if result:
+            indexed += 1
+            continue
+        _set_row_attributes(index, row)
+        if result is False:
+            unusable += 1
+    return indexed, unusable
+
+def _index_row_embedding(index, row):
+    """The embedding half of _index_row: same return values, and sets the row's attributes when indexed."""
+    if row.packed_embedding is None and not row.vector_embedding:
+        return None
+    if row.embedding_model is not None and row.embedding_model != embedding_model():
+        # Not re-embedded yet; BM25 still finds it until the job reaches it
+        return False
+    try:
+        embedding = decode_stored_embedding(row.packed_embedding, row.vector_embedding)
+    except (TypeError, ValueError):
+        logger.warning(f"Skipping memory {row.id} with unreadable embedding")
+        return False
+    if embedding is None or len(embedding) != index.dim:
+        # Embedded by a different model; scoring it against this space is meaningless
+        return False
+    index.upsert(row.id, embedding)
+    _set_row_attributes(index, row)
+    return True
+
+def _load_shared_index(index, batch_size):
+    """
+    Load a user's index from their segment file when it is recent enough,
+    replaying the change log since it was written; otherwise rehydrate from
+    the database and write a fresh segment for the other workers.
+    """
+    position = current_change_position()
+    segment = open_segment(index.user_id, index.dim)
+    
+    if segment is not None and _change_log_covers(segment.log_position):
+        index.adopt(segment.ids, segment.matrix, segment.count)
+        if "text_slot_ids" in segment.arrays and "dedup_slot_ids" in segment.arrays:
+            index.text_index.adopt(segment.arrays)
+            index.dedup_index.adopt(segment.arrays)
+            _load_attributes(index, batch_size)
+        else:
+            _load_text_and_attributes(index, batch_size)
+        changed = db.session.query(MemoryChangeLog.memory_id).filter(
+            MemoryChangeLog.user_id == index.user_id,
+            MemoryChangeLog.id > segment.log_position - CHANGE_LOG_OVERLAP,
+            MemoryChangeLog.id <= position
+        ).distinct().all()
+        _apply_memory_changes(index, [memory_id for memory_id, in changed])
+        if (index.changes_since_segment >= config.MEMORY_SEGMENT_REWRITE_EVERY
+                or index.size > segment.capacity):
+            # Far enough behind that the next worker should not replay it all again
+            _write_segment_in_background(index, position)
+    else:
+        _rehydrate_index(index, batch_size)
+        _write_segment_in_background(index, position)
+    
+    index.log_position = position
+    return len(index)
+
+def _change_log_covers(position):
+    """Whether the change log still holds every change after ``position``."""
+    oldest = db.session.query(func.min(MemoryChangeLog.id)).scalar()
+    return oldest is None or position >= oldest - 1
+
+def _load_attributes(index, batch_size):
+    """Set a user's filter attributes and ranking signals from the database (segments do not hold them)."""
+    rows = db.session.query(*_ATTRIBUTE_COLUMNS).filter(
+        MemoryEntry.user_id == index.user_id
+    ).yield_per(batch_size)
+    for row in rows:
+        _set_row_attributes(index, row)
+
+def _load_text_and_attributes(index, batch_size):
+    """Fill a user's text and dedup indexes and filter attributes from the database, for segments without them."""
+    rows = iter(db.session.query(*_TEXT_COLUMNS).filter(
+        MemoryEntry.user_id == index.user_id
+    ).yield_per(batch_size))
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        index.text_index.add_many([(row.id, memory_text(row.title, row.content)) for row in batch])
+        index.dedup_index.add_many([(row.id, _row_signature(row), row.entry_type) for row in batch])
+        for row in batch:
+            _set_row_attributes(index, row)
+
+def _apply_memory_changes(index, memory_ids):
+    """
+    Bring the given memories in a user's indexes in line with the database.
+    
+    Applies current row state rather than replaying operations, so applying
+    the same change twice, or out of order, is harmless.
+    """
+    memory_ids = set(memory_ids)
+    if not memory_ids:
+        return 0
+    rows = db.session.query(*_TEXT_COLUMNS, *_EMBEDDING_COLUMNS).filter(
+        MemoryEntry.user_id == index.user_id,
+        MemoryEntry.id.in_(memory_ids)
+    ).all()
+    links = db.session.query(MemoryLink.source_id, MemoryLink.target_id, MemoryLink.relation).filter(
+        MemoryLink.user_id == index.user_id,
+        or_(MemoryLink.source_id.in_(memory_ids), MemoryLink.target_id.in_(memory_ids))
+    ).all()
+    
+    with index.lock:
+        index.graph.replace_links(memory_ids, links)
+        for row in rows:
+            memory_ids.discard(row.id)
+            _index_row(index, row)
+        # Whatever is left was deleted
+        for memory_id in memory_ids:
+            index.remove(memory_id)
+            index.text_index.remove(memory_id)
+            index.dedup_index.remove(memory_id)
+        index.changes_since_segment += len(rows) + len(memory_ids)
+        index.bump_version()
+    return len(rows) + len(memory_ids)
+
+def _write_segment_in_background(index, position):
+    """Write a segment file without holding up the request that loaded the index."""
+    def run():
+        try:
+            if write_segment(index, position):
+                index.changes_since_segment = 0
+                change_log_status["segments_written"] += 1
+        except Exception as e:
+            logger.error(f"Error writing memory segment for user {index.user_id}: {e}")
+    
+    threading.Thread(target=run, name=f"memory-segment-{index.user_id}", daemon=True).start()
+
+def sync_memory_indexes():
+    """
+    Apply memory changes made by other worker processes to the indexes this
+    process holds, and rewrite segment files that have fallen behind.
+    Returns the number of memories brought up to date.
+    """
+    origin = _process_origin()
+    position = change_log_status["position"]
+    pending = {}
+    
+    while True:
+        changes = db.session.query(
+            MemoryChangeLog.id, MemoryChangeLog.user_id, MemoryChangeLog.memory_id, MemoryChangeLog.origin
+        ).filter(
+            MemoryChangeLog.id > position - CHANGE_LOG_OVERLAP
+        ).order_by(MemoryChangeLog.id).limit(CHANGE_LOG_BATCH).all()
+        
+        new_changes = [change for change in changes if change[0] not in _seen_changes]
+        for change_id, user_id, memory_id, change_origin in new_changes:
+            _seen_changes.add(change_id)
+            position = max(position, change_id)
+            if change_origin != origin and user_id in memory_indexes:
+                pending.setdefault(user_id, set()).add(memory_id)
+        
+        if len(changes) < CHANGE_LOG_BATCH or not new_changes:
+            break
+    
+    applied = 0
+    for user_id, memory_ids in pending.items():
+        index = memory_indexes.get(user_id)
+        if index is not None:
+            applied += _apply_memory_changes(index, memory_ids)
+            update_index_tiers(index)
+    
+    for index in list(memory_indexes.values()):
+        index.log_position = max(index.log_position, position)
+        if index.changes_since_segment >= config.MEMORY_SEGMENT_REWRITE_EVERY:
+            index.changes_since_segment = 0
+            if write_segment(index, index.log_position):
+                change_log_status["segments_written"] += 1
+    
+    _seen_changes.difference_update([change_id for change_id in _seen_changes
+                                     if change_id <= position - CHANGE_LOG_OVERLAP])
+    change_log_status["position"] = position
+    change_log_status["last_sync_at"] = datetime.utcnow().isoformat()
+    change_log_status["changes_applied"] += applied
+    return applied
+
+def prune_change_log():
+    """Delete change log entries older than the retention window, always keeping the newest."""
+    cutoff = datetime.utcnow() - timedelta(hours=config.MEMORY_CHANGE_LOG_RETENTION_HOURS)
+    newest = current_change_position()
+    deleted = MemoryChangeLog.query.filter(
+        MemoryChangeLog.created_at < cutoff,
+        MemoryChangeLog.id < newest
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        logger.info(f"Pruned {deleted} memory change log entries")
+    return deleted
+
+def _sync_memory_indexes_in_background():
+    """Tail the change log every MEMORY_SYNC_INTERVAL seconds in a daemon thread."""
+    def run():
+        global _last_prune
+        from app import app
+        while True:
+            time.sleep(config.MEMORY_SYNC_INTERVAL)
+            try:
+                with app.app_context():
+                    sync_memory_indexes()
+                    if time.monotonic() - _last_prune > CHANGE_LOG_PRUNE_INTERVAL:
+                        _last_prune = time.monotonic()
+                        prune_change_log()
+            except Exception as e:
+                logger.error(f"Error syncing memory indexes: {e}")
+    
+    thread = threading.Thread(target=run, name="memory-index-sync", daemon=True)
+    thread.start()
+    return thread
+
+def warm_memory_indexes(max_rows=None, max_user_rows=None):
+    """
+    Load user indexes from the database ahead of their first search.
+    
+    Users are loaded smallest first until ``max_rows`` embeddings are resident.
+    Users with more than ``max_user_rows`` memories, and everyone left once the
+    budget is spent, are deferred to lazy loading on their first search.
+    """
+    max_rows = max_rows if max_rows is not None else config.MEMORY_WARM_MAX_ROWS
+    max_user_rows = max_user_rows if max_user_rows is not None else config.MEMORY_WARM_MAX_USER_ROWS
+    
+    user_counts = db.session.query(MemoryEntry.user_id, func.count(MemoryEntry.id)).filter(
+        _has_embedding()
+    ).group_by(MemoryEntry.user_id).order_by(func.count(MemoryEntry.id)).all()
+    
+    memory_index_status.update({
+        "state": "warming",
+        "users_total": len(user_counts),
+        "users_loaded": 0,
+        "users_deferred": 0,
+        "rows_loaded": 0,
+        "started_at": datetime.utcnow().isoformat(),
+        "finished_at": None
+    })
+    logger.info(f"Warming memory indexes for {len(user_counts)} users (budget {max_rows} rows)")
+    
+    for user_id, row_count in user_counts:
+        if row_count > max_user_rows or memory_index_status["rows_loaded"] + row_count > max_rows:
+            memory_index_status["users_deferred"] += 1
+            continue
+        
+        index = load_user_index(user_id)
+        memory_index_status["users_loaded"] += 1
+        memory_index_status["rows_loaded"] += len(index)
+        
+        loaded = memory_index_status["users_loaded"]
+        if loaded % 100 == 0:
+            logger.info(f"Memory index warm load: {loaded}/{len(user_counts)} users, "
+                        f"{memory_index_status['rows_loaded']} rows")
+    
+    memory_index_status["state"] = "ready"
+    memory_index_status["finished_at"] = datetime.utcnow().isoformat()
+    logger.info(f"Memory index warm load finished: {memory_index_status['users_loaded']} users, "
+                f"{memory_index_status['rows_loaded']} rows, "
+                f"{memory_index_status['users_deferred']} users deferred to lazy loading")
+
+def _warm_memory_indexes_in_background():
+    """Run the warm load in a daemon thread so it never blocks application boot."""
+    def run():
+        from app import app
+        try:
+            with app.app_context():
+                warm_memory_indexes()
+        except Exception as e:
+            memory_index_status["state"] = "failed"
+            logger.error(f"Error warming memory indexes: {e}")
+    
+    thread = threading.Thread(target=run, name="memory-index-warm", daemon=True)
+    thread.start()
+    return thread
+
+def get_memory_index_status():
+    """Return warm load progress and the number of users and rows currently indexed."""
+    status = dict(memory_index_status)
+    status["users_resident"] = len(memory_indexes)
+    status["rows_resident"] = sum(len(index) for index in list(memory_indexes.values()))
+    status["change_log"] = dict(change_log_status)
+    status["reembedding"] = dict(reembed_status)
+    status["quantization"] = _quantization_status()
+    status["index_bytes"] = _index_bytes_status()
+    status["access_counts"] = dict(access_flush_status, pending=len(_pending_accesses))
+    status["graph_links"] = sum(len(index.graph) for index in list(memory_indexes.values())
+                                if index.graph is not None)
+    lookups = search_cache_stats["hits"] + search_cache_stats["misses"]
+    status["search_cache"] = dict(
+        search_cache_stats,
+        entries=len(_search_cache),
+        capacity=config.MEMORY_SEARCH_CACHE_SIZE,
+        hit_rate=round(search_cache_stats["hits"] / lookups, 3) if lookups else None
+    )
+    status["search_latency"] = {
+        retriever: {
+            "searches": stats["searches"],
+            "avg_ms": round(stats["total_ms"] / stats["searches"], 3) if stats["searches"] else None,
+            "last_ms": stats["last_ms"]
+        }
+        for retriever, stats in search_latency.items()
+    }
+    return status
+
+def _index_bytes_status():
+    """
+    Memory held by the resident indexes. With MEMORY_SHARED_INDEX, the parts
+    mapped from segment files are shared between workers until changed.
+    """
+    indexes = list(memory_indexes.values())
+    return {
+        "vectors": sum(index.size * index.matrix.shape[1] * index.matrix.itemsize
+                       for index in indexes if index.matrix is not None),
+        "text": sum(index.text_index.nbytes for index in indexes if index.text_index is not None),
+        "dedup": sum(index.dedup_index.nbytes for index in indexes if index.dedup_index is not None)
+    }
+
+def _quantization_status():
+    """
+    Memory moved and added by the int8 tier across resident indexes, and its
+    measured recall. Attaching the tier spills a private float32 matrix to a
+    file-backed map and adds the int8 codes; ``private_bytes_saved`` is the
+    difference (negative for users whose matrix was already a mapped
+    segment, for whom the codes only add memory).
+    """
+    quantized = [index for index in list(memory_indexes.values()) if index.quantized is not None]
+    float_bytes = sum(index.size * index.dim * 4 for index in quantized)
+    private_float_bytes = sum(index.size * index.dim * 4 for index in quantized if not index.is_mapped())
+    spilled_bytes = sum(index.size * index.dim * 4 for index in quantized if index.is_spilled())
+    int8_bytes = sum(index.quantized.nbytes for index in quantized)
+    recalls = [index.quantized.recall_at_k for index in quantized if index.quantized.recall_at_k is not None]
+    return {
+        "enabled": config.MEMORY_QUANTIZE,
+        "users": len(quantized),
+        "float32_bytes": float_bytes,
+        "float32_private_bytes": private_float_bytes,
+        "float32_spilled_bytes": spilled_bytes,
+        "int8_bytes": int8_bytes,
+        "private_bytes_saved": spilled_bytes - int8_bytes,
+        "mean_recall_at_k": round(sum(recalls) / len(recalls), 4) if recalls else None
+    }
 
 def initialize_memory_system():
-    """Initialize the memory system with a simple in-memory store."""
-    global memory_store
+    """Initialize the memory system and start warming per-user indexes from the database."""
+    global memory_indexes
     
     try:
-        # Initialize in-memory store
-        memory_store = {}
+        # Indexes are rebuilt from MemoryEntry rows, lazily or by the warm load
+        memory_indexes = {}
+        with _search_cache_lock:
+            _search_cache.clear()
+        
+        if config.MEMORY_SHARED_INDEX:
+            # Start tailing from here; indexes loaded from now on read the current state
+            change_log_status["position"] = current_change_position()
+            _sync_memory_indexes_in_background()
         
-        logger.info("Memory system initialized successfully (simple mode)")
+        if config.MEMORY_WARM_START:
+            _warm_memory_indexes_in_background()
+        
+        _flush_memory_accesses_in_background()
+        backfill_contacts_in_background()
+        
+        if config.MEMORY_REEMBED_ON_START:
+            _reembed_stale_memories_in_background()
+        
+        logger.info("Memory system initialized successfully")
         return True
     except Exception as e:
         logger.error(f"Error initializing memory system: {e}")
         return False
 
-def add_memory(user, entry_type, title, content, metadata=None):
-    """Add a new memory entry to the database and simple store."""
+def add_memory(user, entry_type, title, content, metadata=None, dedup=None):
+    """
+    Add a new memory entry to the database and the user's index.
+    
+    A near-duplicate of an existing memory of the same type is handled as
+    ``dedup`` says (default MEMORY_DEDUP_MODE): "merge" folds it into the
+    existing memory and returns that entry instead, "flag" stores it with
+    ``duplicate_of`` in its metadata, and "off" stores it as is.
+    """
     try:
         # Create new memory entry
         metadata = metadata or {}
+        dedup = (dedup or config.MEMORY_DEDUP_MODE).lower()
+        
+        # Look for a near-duplicate among the user's memories of this type
+        index = get_user_index(user.id)
+        signature = memory_signature(title, content)
+        if dedup != "off":
+            duplicates = index.dedup_index.duplicates(signature, entry_type, config.MEMORY_DEDUP_THRESHOLD)
+            if duplicates:
+                duplicate_id, score = duplicates[0]
+                if dedup == "merge":
+                    merged = merge_into_memory(duplicate_id, content, metadata)
+                    if merged is not None:
+                        logger.info(f"Merged new {entry_type} memory '{title}' into memory {duplicate_id} "
+                                    f"(similarity {score:.2f})")
+                        return merged
+                else:
+                    metadata = dict(metadata, duplicate_of=duplicate_id)
         
-        # Generate vector embedding using simple function
-        text_to_embed = f"{title} {content}"
-        embedding = simple_embedding(text_to_embed)
-        embedding_json = json.dumps(embedding)
+        # Generate vector embedding
+        embedding = embed_text(memory_text(title, content))
         
         # Create database entry
         memory_entry = MemoryEntry(
@@ -68,24 +766,28 @@ def add_memory(user, entry_type, title, content, metadata=None):
             title=title,
             content=content,
             meta_data=metadata,  # Updated to match the renamed field
-            vector_embedding=embedding_json,
+            packed_embedding=encode_embedding(embedding),
+            embedding_model=embedding_model(),
+            minhash_signature=pack_signature(signature),
             created_at=datetime.utcnow()
         )
         
         db.session.add(memory_entry)
+        db.session.flush()
+        if entry_type == 'contact':
+            sync_contacts([memory_entry.id])
+        record_change(user.id, memory_entry.id, 'upsert')
         db.session.commit()
         
-        # Add to simple memory store
-        memory_key = f"memory_{memory_entry.id}"
-        memory_store[memory_key] = {
-            "user_id": str(user.id),
-            "memory_id": str(memory_entry.id),
-            "entry_type": entry_type,
-            "title": title,
-            "content": content,
-            "embedding": embedding,
-            "text": text_to_embed
-        }
+        # Add to the user's embedding, text and dedup indexes
+        index.upsert(memory_entry.id, embedding)
+        index.set_attributes(memory_entry.id, memory_entry.created_at, memory_tags(entry_type, metadata),
+                             used_at=memory_entry.created_at)
+        index.text_index.add(memory_entry.id, memory_text(title, content))
+        index.dedup_index.add(memory_entry.id, signature, entry_type)
+        index.changes_since_segment += 1
+        index.bump_version()
+        update_index_tiers(index)
         
         return memory_entry
     except Exception as e:
@@ -93,59 +795,293 @@ def add_memory(user, entry_type, title, content, metadata=None):
         db.session.rollback()
         raise
 
-def search_memory(user, query, limit=5):
-    """Search memory entries for a user based on similarity."""
+def _merge_fields(existing, incoming):
+    """
+    Two dicts of fields combined: incoming values win, except empty ones, and
+    two lists are joined without repeats.
+    """
+    merged = dict(existing)
+    for key, value in incoming.items():
+        current = merged.get(key)
+        if isinstance(current, list) and isinstance(value, list):
+            merged[key] = current + [item for item in value if item not in current]
+        elif value not in (None, "", [], {}) or key not in merged:
+            merged[key] = value
+    return merged
+
+def _json_object(text):
+    """The dict stored as JSON in ``text``, or None if it is not a JSON object."""
     try:
-        # Get vector embedding for query
-        query_embedding = simple_embedding(query)
-        
-        # Very basic similarity function
-        def similarity(emb1, emb2):
-            if len(emb1) != len(emb2):
-                # Handle different lengths (should be same in our implementation)
-                min_len = min(len(emb1), len(emb2))
-                emb1 = emb1[:min_len]
-                emb2 = emb2[:min_len]
-            
-            # Calculate dot product (very simple similarity)
-            dot_product = sum(a * b for a, b in zip(emb1, emb2))
-            # Normalize
-            similarity_score = max(0.0, min(1.0, dot_product / len(emb1)))
-            return similarity_score
-        
-        # Search memory store
-        memory_items = []
-        for key, memory_item in memory_store.items():
-            if str(memory_item["user_id"]) == str(user.id):
-                sim_score = similarity(query_embedding, memory_item["embedding"])
-                memory_items.append((memory_item, sim_score))
-        
-        # Sort by similarity score
-        memory_items.sort(key=lambda x: x[1], reverse=True)
-        
-        # Limit results
-        memory_items = memory_items[:limit]
-        
-        # Format results
-        memory_results = []
-        for memory_item, score in memory_items:
-            memory_id = memory_item["memory_id"]
-            memory_entry = MemoryEntry.query.get(int(memory_id))
-            if memory_entry:
-                memory_results.append({
-                    "id": memory_entry.id,
-                    "type": memory_entry.entry_type,
-                    "title": memory_entry.title,
-                    "content": memory_entry.content,
-                    "created_at": memory_entry.created_at.isoformat(),
-                    "relevance": score
-                })
-        
-        return memory_results
+        value = json.loads(text or "")
+    except (TypeError, ValueError):
+        return None
+    return value if isinstance(value, dict) else None
+
+def merge_contents(existing, incoming):
+    """
+    The content of a memory merged with a near-duplicate's. Structured
+    contents (JSON objects, such as a contact's card) have their fields
+    combined by _merge_fields, so neither side's fields are lost; for plain
+    text the longer of the two is kept.
+    """
+    existing_fields, incoming_fields = _json_object(existing), _json_object(incoming)
+    if existing_fields is not None and incoming_fields is not None:
+        merged = _merge_fields(existing_fields, incoming_fields)
+        return existing if merged == existing_fields else json.dumps(merged)
+    return incoming if len(incoming or "") > len(existing or "") else existing
+
+def merge_into_memory(memory_id, content, metadata=None):
+    """
+    Fold a near-duplicate into an existing memory: contents are combined by
+    merge_contents, metadata fields by _merge_fields (new values win, lists
+    are joined) and ``duplicates_merged`` counts how many duplicates were
+    folded in. Returns the updated entry, or None if it no longer exists.
+    """
+    existing = MemoryEntry.query.get(memory_id)
+    if existing is None:
+        return None
+    
+    existing_metadata = existing.meta_data or {}
+    merged_metadata = _merge_fields(existing_metadata, metadata or {})
+    merged_metadata["duplicates_merged"] = existing_metadata.get("duplicates_merged", 0) + 1
+    merged_content = merge_contents(existing.content, content)
+    return update_memory(memory_id, content=merged_content if merged_content != existing.content else None,
+                         metadata=merged_metadata)
+
+def search_memory(user, query, limit=5, entry_type=None, start=None, end=None, metadata=None, related_hops=None):
+    """
+    Search memory entries for a user, fusing embedding similarity with BM25
+    keyword matching by reciprocal rank fusion.
+    
+    ``entry_type``, a ``start``/``end`` created_at window (end exclusive) and
+    ``metadata`` values for keys in MEMORY_FILTER_METADATA_KEYS narrow the
+    search before scoring: only memories that pass every filter are scored.
+    
+    The vector pass blends similarity with how recently and how often each
+    memory was used (MEMORY_RECENCY_WEIGHT, MEMORY_ACCESS_WEIGHT); every
+    memory returned counts as one use.
+    
+    Each result's ``relevance`` is its fused score; ``vector_score`` and
+    ``bm25_score`` are the per-retriever scores (None when that retriever did
+    not return the memory).
+    
+    Each result's ``related`` lists the memories linked to it within
+    ``related_hops`` links (default MEMORY_GRAPH_HOPS, at most 2) in the
+    user's memory graph, such as a contact's company, with the ``relation``
+    and number of ``hops`` that reached them; MEMORY_GRAPH_MAX_RELATED bounds
+    them across all results. They are read with the results themselves.
+    
+    Results are cached until the user's memories next change, so a repeated
+    question (up to case and whitespace) is answered without scoring again.
+    """
+    try:
+        tags = filter_tags(entry_type, metadata)
+        index = get_user_index(user.id)
+        related_hops = config.MEMORY_GRAPH_HOPS if related_hops is None else related_hops
+        
+        # Read the version first so a write during the search leaves the entry stale
+        cache_key = _search_cache_key(user.id, query, tags, start, end, limit, related_hops)
+        version = index.version
+        cached = _cached_search(cache_key, version)
+        if cached is not None:
+            record_accesses(index, [result["id"] for result in cached])
+            return cached
+        
+        candidates = max(limit, limit * config.MEMORY_HYBRID_CANDIDATES)
+        
+        # Score only this user's (filtered) memories with a single vectorized pass
+        started = time.perf_counter()
+        query_embedding = get_embedder().embed_query(query)
+        with index.lock:
+            rows = index.filter_rows(tags, start, end)
+            allowed = None if rows is None else index.ids[rows]
+            if rows is not None and index.text_only:
+                # Memories with no vector row are filtered on the attributes kept beside the rows; BM25 still scores them
+                allowed = np.concatenate([allowed, index.filter_text_only(tags, start, end)])
+            vector_ranked = index.search(query_embedding, candidates, rows=rows)
+        vector_ms = _record_latency("vector", started)
+        
+        started = time.perf_counter()
+        bm25_ranked = index.text_index.search(query, candidates, allowed=allowed)
+        bm25_ms = _record_latency("bm25", started)
+        
+        started = time.perf_counter()
+        ranked = reciprocal_rank_fusion([vector_ranked, bm25_ranked], k=config.MEMORY_RRF_K, limit=limit)
+        fusion_ms = _record_latency("fusion", started)
+        
+        logger.debug(f"Memory search for user {user.id}: vector {vector_ms:.2f} ms "
+                     f"({len(vector_ranked)} hits), bm25 {bm25_ms:.2f} ms ({len(bm25_ranked)} hits), "
+                     f"fusion {fusion_ms:.2f} ms")
+        
+        # Expand the hits through the memory graph and read everything in one query
+        related = index.graph.expand([memory_id for memory_id, _ in ranked], related_hops,
+                                     limit=config.MEMORY_GRAPH_MAX_RELATED)
+        results = hydrate_results(ranked, related)
+        vector_scores = dict(vector_ranked)
+        bm25_scores = dict(bm25_ranked)
+        for result in results:
+            result["vector_score"] = vector_scores.get(result["id"])
+            result["bm25_score"] = bm25_scores.get(result["id"])
+        _cache_search(cache_key, version, results)
+        record_accesses(index, [result["id"] for result in results])
+        return results
     except Exception as e:
         logger.error(f"Error searching memory: {e}")
         return []
 
+def record_accesses(index, memory_ids):
+    """
+    Count a use of each memory: immediately in the user's index, and in the
+    database at the next flush_memory_accesses().
+    """
+    if not memory_ids:
+        return
+    index.record_access(memory_ids, datetime.utcnow())
+    with _pending_accesses_lock:
+        _pending_accesses.update(memory_ids)
+
+def flush_memory_accesses():
+    """
+    Write buffered access counts to the database: one UPDATE per distinct
+    increment rather than one per search hit. Returns the memories updated.
+    """
+    global _pending_accesses
+    with _pending_accesses_lock:
+        pending, _pending_accesses = _pending_accesses, Counter()
+    if not pending:
+        return 0
+    
+    by_increment = {}
+    for memory_id, count in pending.items():
+        by_increment.setdefault(count, []).append(memory_id)
+    now = datetime.utcnow()
+    try:
+        for count, memory_ids in by_increment.items():
+            MemoryEntry.query.filter(MemoryEntry.id.in_(memory_ids)).update({
+                MemoryEntry.access_count: func.coalesce(MemoryEntry.access_count, 0) + count,
+                MemoryEntry.last_accessed_at: now,
+                # Being read is not an edit; keep updated_at as it was
+                MemoryEntry.updated_at: MemoryEntry.updated_at
+            }, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Put the counts back for the next flush
+        with _pending_accesses_lock:
+            _pending_accesses.update(pending)
+        raise
+    
+    access_flush_status["flushes"] += 1
+    access_flush_status["memories_updated"] += len(pending)
+    access_flush_status["last_flush_at"] = now.isoformat()
+    return len(pending)
+
+def _flush_memory_accesses_in_background():
+    """Flush buffered access counts every MEMORY_ACCESS_FLUSH_INTERVAL seconds in a daemon thread."""
+    def run():
+        from app import app
+        while True:
+            time.sleep(config.MEMORY_ACCESS_FLUSH_INTERVAL)
+            try:
+                with app.app_context():
+                    flush_memory_accesses()
+            except Exception as e:
+                logger.error(f"Error flushing memory access counts: {e}")
+    
+    thread = threading.Thread(target=run, name="memory-access-flush", daemon=True)
+    thread.start()
+    return thread
+
+def _search_cache_key(user_id, query, tags, start, end, limit, related_hops=0):
+    """Cache key of a search; case and runs of whitespace in the query do not matter."""
+    return (str(user_id), " ".join(query.lower().split()), tuple(sorted(tags)),
+            to_timestamp(start), to_timestamp(end), limit, related_hops)
+
+def _cached_search(key, version):
+    """Copies of the cached results for a search if computed against ``version``, else None."""
+    if config.MEMORY_SEARCH_CACHE_SIZE <= 0:
+        return None
+    with _search_cache_lock:
+        entry = _search_cache.get(key)
+        if entry is not None and entry[0] == version:
+            _search_cache.move_to_end(key)
+            search_cache_stats["hits"] += 1
+            return [dict(result, related=list(result["related"])) for result in entry[1]]
+        if entry is not None:
+            del _search_cache[key]
+            search_cache_stats["stale"] += 1
+        search_cache_stats["misses"] += 1
+    return None
+
+def _cache_search(key, version, results):
+    """Store a search's results, evicting the least recently used entries past MEMORY_SEARCH_CACHE_SIZE."""
+    if config.MEMORY_SEARCH_CACHE_SIZE <= 0:
+        return
+    with _search_cache_lock:
+        _search_cache[key] = (version, [dict(result) for result in results])
+        _search_cache.move_to_end(key)
+        while len(_search_cache) > config.MEMORY_SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+            search_cache_stats["evictions"] += 1
+
+def _record_latency(retriever, started):
+    """Add one search's elapsed time to a retriever's latency stats; returns it in ms."""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats = search_latency[retriever]
+    stats["searches"] += 1
+    stats["total_ms"] += elapsed_ms
+    stats["last_ms"] = round(elapsed_ms, 3)
+    return elapsed_ms
+
+def hydrate_results(ranked, related=()):
+    """
+    Turn ranked (memory_id, score) pairs into result dicts with a single
+    IN (...) query, keeping the ranking order.
+    
+    ``related`` holds (memory_id, seed_id, relation, hops) tuples from
+    UserGraph.expand(); they are read in the same query and listed under
+    their seed's ``related``.
+    """
+    if not ranked:
+        return []
+    
+    memory_ids = [memory_id for memory_id, _ in ranked] + [memory_id for memory_id, _, _, _ in related]
+    entries = MemoryEntry.query.options(
+        load_only(MemoryEntry.id, MemoryEntry.entry_type, MemoryEntry.title,
+                  MemoryEntry.content, MemoryEntry.created_at)
+    ).filter(MemoryEntry.id.in_(memory_ids)).all()
+    entries_by_id = {entry.id: entry for entry in entries}
+    
+    # Format results
+    memory_results = []
+    for memory_id, score in ranked:
+        memory_entry = entries_by_id.get(memory_id)
+        if memory_entry:
+            memory_results.append({
+                "id": memory_entry.id,
+                "type": memory_entry.entry_type,
+                "title": memory_entry.title,
+                "content": memory_entry.content,
+                "created_at": memory_entry.created_at.isoformat(),
+                "relevance": score,
+                "related": []
+            })
+    
+    results_by_id = {result["id"]: result for result in memory_results}
+    for memory_id, seed_id, relation, hops in related:
+        memory_entry = entries_by_id.get(memory_id)
+        if memory_entry and seed_id in results_by_id:
+            results_by_id[seed_id]["related"].append({
+                "id": memory_entry.id,
+                "type": memory_entry.entry_type,
+                "title": memory_entry.title,
+                "content": memory_entry.content,
+                "relation": relation,
+                "hops": hops
+            })
+    
+    return memory_results
+
 def get_memory_by_type(user, entry_type, limit=10):
     """Get memory entries of a specific type for a user."""
     try:
@@ -177,45 +1113,55 @@ def update_memory(memory_id, title=None, content=None, metadata=None):
         if not memory_entry:
             return None
         
+        previous_text = memory_text(memory_entry.title, memory_entry.content)
+        
         # Update fields if provided
         if title:
             memory_entry.title = title
         if content:
             memory_entry.content = content
         if metadata:
-            # Merge new metadata with existing
-            current_metadata = memory_entry.meta_data or {}
+            # Merge new metadata with existing (a new dict, so the JSON column is flagged as changed)
+            current_metadata = dict(memory_entry.meta_data or {})
             current_metadata.update(metadata)
             memory_entry.meta_data = current_metadata
         
         memory_entry.updated_at = datetime.utcnow()
         
-        # Update vector embedding
-        text_to_embed = f"{memory_entry.title} {memory_entry.content}"
-        embedding = simple_embedding(text_to_embed)
-        memory_entry.vector_embedding = json.dumps(embedding)
+        # Re-embed and re-sign only when the embedded text changed (or was never packed by this model)
+        text_to_embed = memory_text(memory_entry.title, memory_entry.content)
+        embedding = None
+        signature = None
+        if (text_to_embed != previous_text or memory_entry.packed_embedding is None
+                or memory_entry.embedding_model != embedding_model()):
+            embedding = embed_text(text_to_embed)
+            memory_entry.packed_embedding = encode_embedding(embedding)
+            memory_entry.vector_embedding = None
+            memory_entry.embedding_model = embedding_model()
+            signature = minhash_signature(text_to_embed)
+            memory_entry.minhash_signature = pack_signature(signature)
+        
+        index_changed = embedding is not None or bool(metadata)
+        if index_changed:
+            record_change(memory_entry.user_id, memory_entry.id, 'upsert')
+        if memory_entry.entry_type == 'contact' and (title or content):
+            sync_contacts([memory_entry.id])
         
         db.session.commit()
         
-        # Update in memory store
-        memory_key = f"memory_{memory_id}"
-        if memory_key in memory_store:
-            memory_store[memory_key].update({
-                "title": memory_entry.title,
-                "content": memory_entry.content,
-                "embedding": embedding,
-                "text": text_to_embed
-            })
-        else:
-            memory_store[memory_key] = {
-                "user_id": str(memory_entry.user_id),
-                "memory_id": str(memory_entry.id),
-                "entry_type": memory_entry.entry_type,
-                "title": memory_entry.title,
-                "content": memory_entry.content,
-                "embedding": embedding,
-                "text": text_to_embed
-            }
+        # Overwrite the memory's row, postings and filter tags in the user's indexes
+        if index_changed:
+            index = get_user_index(memory_entry.user_id)
+            if embedding is not None:
+                index.upsert(memory_entry.id, embedding)
+                index.text_index.add(memory_entry.id, text_to_embed)
+                index.dedup_index.add(memory_entry.id, signature, memory_entry.entry_type)
+            index.set_attributes(memory_entry.id, memory_entry.created_at,
+                                 memory_tags(memory_entry.entry_type, memory_entry.meta_data),
+                                 used_at=memory_entry.updated_at)
+            index.changes_since_segment += 1
+            index.bump_version()
+            update_index_tiers(index)
         
         return memory_entry
     except Exception as e:
@@ -230,41 +1176,684 @@ def delete_memory(memory_id):
         if not memory_entry:
             return False
         
-        # Delete from memory store
-        memory_key = f"memory_{memory_id}"
-        if memory_key in memory_store:
-            del memory_store[memory_key]
+        user_id, memory_id = memory_entry.user_id, memory_entry.id
         
-        # Delete from SQL database
+        # Delete from SQL database, links first; the linked memories change too
+        linked = _delete_links([memory_id])
+        for linked_id in linked:
+            record_change(user_id, linked_id, 'upsert')
+        delete_contacts([memory_id])
+        record_change(user_id, memory_id, 'delete')
         db.session.delete(memory_entry)
         db.session.commit()
         
+        # Delete from the user's indexes, only once the delete is committed
+        index = get_user_index(user_id)
+        index.remove(memory_id)
+        index.text_index.remove(memory_id)
+        index.dedup_index.remove(memory_id)
+        index.graph.remove_nodes([memory_id])
+        index.changes_since_segment += 1
+        index.bump_version()
+        update_index_tiers(index)
+        
         return True
     except Exception as e:
         logger.error(f"Error deleting memory: {e}")
         db.session.rollback()
         return False
 
-def extract_memories_from_conversation(user, conversation_id):
-    """Extract potential memory entries from a conversation."""
+def link_memories(user_id, source_id, target_id, relation):
+    """
+    Store a typed link between two of a user's memories (e.g. a contact
+    "works_at" a company) and add it to their memory graph. Linking a memory
+    to itself, or storing a link twice, does nothing. Returns True if the
+    link is new.
+    """
     try:
-        from app import db
-        from models import Message
+        if source_id == target_id or not _insert_link(user_id, source_id, target_id, relation):
+            return False
+        record_change(user_id, source_id, 'upsert')
+        record_change(user_id, target_id, 'upsert')
+        db.session.commit()
         
-        # Get all messages from the conversation
-        messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.timestamp).all()
+        index = get_user_index(user_id)
+        index.graph.add(source_id, target_id, relation)
+        index.bump_version()
+        return True
+    except Exception as e:
+        logger.error(f"Error linking memories: {e}")
+        db.session.rollback()
+        return False
+
+def link_entity(user, memory_entry, entity_type, entity_title, relation):
+    """
+    Link a memory to an entity it names, such as the company on a contact's
+    card: the user's memory of ``entity_type`` with that title (ignoring
+    case) if there is one, otherwise a new one. Returns the entity's entry.
+    """
+    entity_title = (entity_title or "").strip()
+    if not entity_title:
+        return None
+    entity = MemoryEntry.query.filter(
+        MemoryEntry.user_id == user.id,
+        MemoryEntry.entry_type == entity_type,
+        func.lower(MemoryEntry.title) == entity_title.lower()
+    ).order_by(MemoryEntry.id).first()
+    if entity is None:
+        entity = add_memory(user, entity_type, entity_title, entity_title)
+    link_memories(user.id, memory_entry.id, entity.id, relation)
+    return entity
+
+def _insert_link(user_id, source_id, target_id, relation):
+    """Add a MemoryLink row (in the current transaction) unless it exists. Returns True if added."""
+    exists = db.session.query(MemoryLink.id).filter_by(
+        source_id=source_id, target_id=target_id, relation=relation
+    ).first()
+    if exists or source_id == target_id:
+        return False
+    db.session.add(MemoryLink(user_id=user_id, source_id=source_id, target_id=target_id, relation=relation))
+    db.session.flush()
+    return True
+
+def _delete_links(memory_ids):
+    """Delete the links touching the given memories (in the current transaction); returns the memories they linked."""
+    touching = or_(MemoryLink.source_id.in_(memory_ids), MemoryLink.target_id.in_(memory_ids))
+    linked = set()
+    for source_id, target_id in db.session.query(MemoryLink.source_id, MemoryLink.target_id).filter(touching):
+        linked.update((source_id, target_id))
+    MemoryLink.query.filter(touching).delete(synchronize_session=False)
+    return linked - set(memory_ids)
+
+def export_memories(user_id, batch_size=None):
+    """
+    Yield a user's memories as plain dicts, oldest first, streaming rows from
+    the database in batches so memory use stays flat however many there are.
+    Embeddings are not exported; import_memories recomputes them.
+    """
+    batch_size = batch_size or config.MEMORY_LOAD_BATCH_SIZE
+    rows = db.session.query(
+        MemoryEntry.id, MemoryEntry.entry_type, MemoryEntry.title, MemoryEntry.content,
+        MemoryEntry.meta_data, MemoryEntry.created_at, MemoryEntry.updated_at
+    ).filter(MemoryEntry.user_id == str(user_id)).order_by(MemoryEntry.id).yield_per(batch_size)
+    for row in rows:
+        yield {
+            "id": row.id,
+            "type": row.entry_type,
+            "title": row.title,
+            "content": row.content,
+            "metadata": row.meta_data or {},
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "updated_at": row.updated_at.isoformat() if row.updated_at else None
+        }
+
+def iter_ndjson(lines):
+    """
+    Parse NDJSON lines (str or bytes) into ``(line number, record)`` pairs,
+    skipping blank lines; unparsable lines give a record of None.
+    """
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+# Invalid import records listed individually in an import report
+IMPORT_ERRORS_REPORTED = 100
+
+def _import_record_error(record):
+    """Why an import record cannot be stored, or None if it can."""
+    if record is None:
+        return "not valid JSON"
+    if not isinstance(record, dict):
+        return "not a JSON object"
+    if not record.get("title"):
+        return "missing title"
+    for key in ("type", "content", "created_at", "updated_at"):
+        if record.get(key) is not None and not isinstance(record[key], str):
+            return f"{key} must be a string"
+    if record.get("metadata") is not None and not isinstance(record["metadata"], dict):
+        return "metadata must be an object"
+    return None
+
+def import_memories(user, records, chunk_size=None, dedup=None):
+    """
+    Bulk-add memories from an iterable of dicts (as written by export_memories),
+    or of ``(line number, dict)`` pairs as yielded by iter_ndjson, without
+    holding more than one chunk in memory.
+    
+    Each chunk of MEMORY_IMPORT_CHUNK_SIZE records is embedded in one batch,
+    inserted with bulk_insert_mappings and committed once, then applied to
+    the user's indexes in one step. With ``dedup`` "merge" (the default mode)
+    near-duplicates of existing memories, or of earlier records in the same
+    chunk, are skipped, so importing the same file twice adds nothing the
+    second time; "flag" stores near-duplicates of existing memories with
+    ``duplicate_of`` set and "off" stores everything.
+    Records that cannot be stored (no title, a field of the wrong type) are
+    skipped before they reach a chunk; the first IMPORT_ERRORS_REPORTED are
+    listed under ``errors`` with their line (or position) and the reason.
+    
+    Returns counts of imported, duplicate and invalid records.
+    """
+    chunk_size = chunk_size or config.MEMORY_IMPORT_CHUNK_SIZE
+    dedup = (dedup or config.MEMORY_DEDUP_MODE).lower()
+    report = {"imported": 0, "duplicates": 0, "invalid": 0, "chunks": 0, "errors": []}
+    index = get_user_index(user.id)
+    
+    chunk = []
+    for position, record in enumerate(records, start=1):
+        if isinstance(record, tuple):
+            position, record = record
+        error = _import_record_error(record)
+        if error:
+            report["invalid"] += 1
+            if len(report["errors"]) < IMPORT_ERRORS_REPORTED:
+                report["errors"].append({"line": position, "error": error})
+            continue
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            _import_chunk(user, index, chunk, dedup, report)
+            chunk = []
+    if chunk:
+        _import_chunk(user, index, chunk, dedup, report)
+    
+    logger.info(f"Imported {report['imported']} memories for user {user.id} in {report['chunks']} chunks "
+                f"({report['duplicates']} duplicates, {report['invalid']} invalid records)")
+    return report
+
+def _parse_timestamp(value):
+    """A datetime from an exported ISO timestamp, or None."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        return None
+
+def _import_chunk(user, index, records, dedup, report):
+    """Embed, insert, commit and index one chunk of import records."""
+    now = datetime.utcnow()
+    chunk_dedup = UserDedupIndex(user.id)
+    entries = []
+    for position, record in enumerate(records):
+        entry_type = record.get("type") or "note"
+        title = str(record["title"])[:256]
+        content = record.get("content") or ""
+        metadata = dict(record.get("metadata") or {})
+        signature = memory_signature(title, content)
         
-        if not messages:
-            return []
+        if dedup == "merge":
+            if (index.dedup_index.duplicates(signature, entry_type, config.MEMORY_DEDUP_THRESHOLD)
+                    or chunk_dedup.duplicates(signature, entry_type, config.MEMORY_DEDUP_THRESHOLD)):
+                report["duplicates"] += 1
+                continue
+            chunk_dedup.add(position, signature, entry_type)
+        elif dedup == "flag":
+            duplicates = index.dedup_index.duplicates(signature, entry_type, config.MEMORY_DEDUP_THRESHOLD)
+            if duplicates:
+                report["duplicates"] += 1
+                metadata["duplicate_of"] = duplicates[0][0]
         
-        # Concatenate all messages into a single text
-        conversation_text = "\n".join([f"{'User' if msg.is_user else 'Assistant'}: {msg.content}" for msg in messages])
+        created_at = _parse_timestamp(record.get("created_at")) or now
+        entries.append({
+            "user_id": user.id,
+            "entry_type": entry_type,
+            "title": title,
+            "content": content,
+            "meta_data": metadata,
+            "minhash_signature": pack_signature(signature),
+            "created_at": created_at,
+            "updated_at": _parse_timestamp(record.get("updated_at")) or created_at,
+            "_signature": signature
+        })
+    if not entries:
+        return
+    
+    embeddings = get_embedder().embed_many([memory_text(entry["title"], entry["content"]) for entry in entries])
+    signatures = [entry.pop("_signature") for entry in entries]
+    for entry, embedding in zip(entries, embeddings):
+        entry["packed_embedding"] = encode_embedding(embedding)
+        entry["embedding_model"] = embedding_model()
+    
+    try:
+        # return_defaults fills in each mapping's new id
+        db.session.bulk_insert_mappings(MemoryEntry, entries, return_defaults=True)
+        sync_contacts([entry["id"] for entry in entries if entry["entry_type"] == 'contact'])
+        for entry in entries:
+            record_change(user.id, entry["id"], 'upsert')
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Error importing memories: {e}")
+        db.session.rollback()
+        raise
+    
+    with index.lock:
+        index.upsert_many([entry["id"] for entry in entries], embeddings)
+        for entry, signature in zip(entries, signatures):
+            index.set_attributes(entry["id"], entry["created_at"], memory_tags(entry["entry_type"], entry["meta_data"]),
+                                 used_at=entry["updated_at"])
+            index.text_index.add(entry["id"], memory_text(entry["title"], entry["content"]))
+            index.dedup_index.add(entry["id"], signature, entry["entry_type"])
+        index.changes_since_segment += len(entries)
+        index.bump_version()
+    update_index_tiers(index)
+    
+    report["imported"] += len(entries)
+    report["chunks"] += 1
+
+# Approximate stored size of a memory: its text plus every embedding and signature column
+_STORED_BYTES = sum(func.coalesce(func.length(column), 0) for column in (
+    MemoryEntry.title, MemoryEntry.content, MemoryEntry.vector_embedding,
+    MemoryEntry.packed_embedding, MemoryEntry.minhash_signature
+))
+
+def compact_user_memories(user_id, threshold=None, dry_run=False, batch_size=None):
+    """
+    Merge a user's near-duplicate memories, e.g. those stored before
+    duplicates were caught on insert.
+    
+    Memories are clustered through an LSH index over their signatures: each
+    memory joins the cluster of the oldest earlier memory it is a
+    near-duplicate of, and only clusters' first memories are indexed, so
+    every member is similar to its survivor itself rather than through a
+    chain of members. Each cluster is folded into its survivor with
+    merge_contents and _merge_fields. Documents and face images
+    of the removed memories are moved to the survivor. Signatures missing
+    from older rows are backfilled on the way.
+    
+    Returns a report with memory counts and stored bytes before and after
+    (projected from the clusters when ``dry_run`` is set).
+    """
+    user_key = str(user_id)
+    threshold = threshold if threshold is not None else config.MEMORY_DEDUP_THRESHOLD
+    batch_size = batch_size or config.MEMORY_LOAD_BATCH_SIZE
+    
+    lsh = UserDedupIndex(user_key)
+    clusters = {}
+    stored_bytes = {}
+    backfill = []
+    
+    rows = db.session.query(
+        MemoryEntry.id, MemoryEntry.entry_type, MemoryEntry.title, MemoryEntry.content,
+        MemoryEntry.minhash_signature, _STORED_BYTES.label("stored_bytes")
+    ).filter(MemoryEntry.user_id == user_key).order_by(MemoryEntry.id).yield_per(batch_size)
+    
+    # Oldest first, so every cluster is rooted at its oldest memory; only
+    # survivors are indexed, so clusters never grow through their members
+    for row in rows:
+        stored_bytes[row.id] = row.stored_bytes
+        signature = _row_signature(row)
+        if row.minhash_signature is None:
+            backfill.append({"id": row.id, "minhash_signature": pack_signature(signature)})
         
-        # Use OpenManus framework to extract important information
+        duplicates = lsh.duplicates(signature, row.entry_type, threshold)
+        if duplicates:
+            clusters.setdefault(duplicates[0][0], []).append(row.id)
+        else:
+            lsh.add(row.id, signature, row.entry_type)
+    
+    removed_ids = [memory_id for members in clusters.values() for memory_id in members]
+    report = {
+        "user_id": user_key,
+        "memories_before": len(stored_bytes),
+        "memories_after": len(stored_bytes) - len(removed_ids),
+        "clusters": len(clusters),
+        "duplicates_removed": len(removed_ids),
+        "bytes_before": sum(stored_bytes.values()),
+        "bytes_after": sum(stored_bytes.values()) - sum(stored_bytes[memory_id] for memory_id in removed_ids)
+    }
+    if dry_run:
+        return report
+    
+    try:
+        for start in range(0, len(backfill), batch_size):
+            db.session.bulk_update_mappings(MemoryEntry, backfill[start:start + batch_size])
+            db.session.commit()
+        
+        changed = set()
+        for survivor_id, member_ids in clusters.items():
+            _merge_cluster(user_key, survivor_id, member_ids)
+            db.session.commit()
+            changed.add(survivor_id)
+            changed.update(member_ids)
+    except Exception as e:
+        logger.error(f"Error compacting memories for user {user_key}: {e}")
+        db.session.rollback()
+        raise
+    
+    # Bring this process's copy of the index in line; other workers follow the change log
+    index = memory_indexes.get(user_key)
+    if index is not None and changed:
+        _apply_memory_changes(index, changed)
+        update_index_tiers(index)
+    
+    report["bytes_after"] = db.session.query(func.sum(_STORED_BYTES)).filter(
+        MemoryEntry.user_id == user_key
+    ).scalar() or 0
+    return report
+
+def _merge_cluster(user_id, survivor_id, member_ids):
+    """Fold near-duplicate memories into their survivor (in the current transaction)."""
+    entries = MemoryEntry.query.filter(
+        MemoryEntry.id.in_([survivor_id] + list(member_ids))
+    ).order_by(MemoryEntry.id).all()
+    survivor = next(entry for entry in entries if entry.id == survivor_id)
+    
+    # Oldest first, so newer members' values win
+    metadata = {}
+    merged_count = 0
+    content = survivor.content
+    for entry in entries:
+        entry_metadata = dict(entry.meta_data or {})
+        merged_count += entry_metadata.pop("duplicates_merged", 0)
+        entry_metadata.pop("duplicate_of", None)
+        metadata = _merge_fields(metadata, entry_metadata)
+        if entry is not survivor:
+            content = merge_contents(content, entry.content)
+    metadata["duplicates_merged"] = merged_count + len(member_ids)
+    survivor.meta_data = metadata
+    
+    if content != survivor.content:
+        survivor.content = content
+        text = memory_text(survivor.title, survivor.content)
+        survivor.packed_embedding = encode_embedding(embed_text(text))
+        survivor.vector_embedding = None
+        survivor.embedding_model = embedding_model()
+        survivor.minhash_signature = pack_signature(minhash_signature(text))
+    survivor.updated_at = datetime.utcnow()
+    record_change(user_id, survivor_id, 'upsert')
+    
+    Document.query.filter(Document.memory_id.in_(member_ids)).update(
+        {Document.memory_id: survivor_id}, synchronize_session=False)
+    FaceImage.query.filter(FaceImage.memory_entry_id.in_(member_ids)).update(
+        {FaceImage.memory_entry_id: survivor_id}, synchronize_session=False)
+    
+    # The survivor takes over the members' links
+    links = db.session.query(MemoryLink.source_id, MemoryLink.target_id, MemoryLink.relation).filter(
+        or_(MemoryLink.source_id.in_(member_ids), MemoryLink.target_id.in_(member_ids))
+    ).all()
+    repointed = [
+        (survivor_id if source_id in member_ids else source_id,
+         survivor_id if target_id in member_ids else target_id,
+         relation)
+        for source_id, target_id, relation in links
+    ]
+    linked = _delete_links(member_ids)
+    for source_id, target_id, relation in repointed:
+        _insert_link(user_id, source_id, target_id, relation)
+    for linked_id in linked:
+        record_change(user_id, linked_id, 'upsert')
+    
+    delete_contacts(member_ids)
+    if survivor.entry_type == 'contact':
+        sync_contacts([survivor_id])
+    MemoryEntry.query.filter(MemoryEntry.id.in_(member_ids)).delete(synchronize_session=False)
+    for memory_id in member_ids:
+        record_change(user_id, memory_id, 'delete')
+
+def reembed_stale_memories(batch_size=None, interval=None, max_batches=None):
+    """
+    Re-embed memories whose embedding came from another model (or is untagged)
+    with the configured embedder, in batches of ``batch_size`` (default
+    MEMORY_REEMBED_BATCH_SIZE) with a pause of ``interval`` seconds (default
+    MEMORY_REEMBED_INTERVAL) between them.
+    
+    Progress is checkpointed per model version in EmbeddingMigration: each
+    batch is claimed by advancing the checkpoint past it before it is
+    embedded, so an interrupted job resumes where it stopped and workers
+    running the job at once split the rows between them. A memory edited
+    while its batch was embedding keeps the embedding update_memory gave it.
+    Once a pass reaches the end, the next run starts another over any rows
+    that are still stale. Until a memory is re-embedded it is left out of
+    vector scoring and found by BM25 alone.
+    
+    Returns the number of memories re-embedded.
+    """
+    batch_size = batch_size or config.MEMORY_REEMBED_BATCH_SIZE
+    interval = config.MEMORY_REEMBED_INTERVAL if interval is None else interval
+    model = embedding_model()
+    
+    stale_rows = db.session.query(func.count(MemoryEntry.id)).filter(_stale_embedding(model)).scalar() or 0
+    reembed_status.update(state="running", model=model, stale_rows=stale_rows, rows_reembedded=0,
+                          started_at=datetime.utcnow().isoformat(), finished_at=None)
+    checkpoint = _reembed_checkpoint(model, restart=stale_rows > 0)
+    reembed_status["last_memory_id"] = checkpoint.last_memory_id or 0
+    
+    reembedded = 0
+    batches = 0
+    while stale_rows and (max_batches is None or batches < max_batches):
+        last_id = checkpoint.last_memory_id or 0
+        rows = db.session.query(
+            MemoryEntry.id, MemoryEntry.user_id, MemoryEntry.title, MemoryEntry.content, MemoryEntry.updated_at
+        ).filter(
+            MemoryEntry.id > last_id,
+            _stale_embedding(model)
+        ).order_by(MemoryEntry.id).limit(batch_size).all()
+        if not rows:
+            checkpoint.finished_at = datetime.utcnow()
+            db.session.commit()
+            break
+        
+        # Claim the batch; if another worker moved the checkpoint first, pick up from its position
+        claimed = EmbeddingMigration.query.filter(
+            EmbeddingMigration.id == checkpoint.id,
+            func.coalesce(EmbeddingMigration.last_memory_id, 0) == last_id
+        ).update({
+            EmbeddingMigration.last_memory_id: rows[-1].id,
+            EmbeddingMigration.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        db.session.refresh(checkpoint)
+        if not claimed:
+            continue
+        
+        embeddings = get_embedder().embed_many([memory_text(row.title, row.content) for row in rows])
+        updated = {}
+        for row, embedding in zip(rows, embeddings):
+            changed = MemoryEntry.query.filter(
+                MemoryEntry.id == row.id,
+                MemoryEntry.updated_at == row.updated_at,
+                _stale_embedding(model)
+            ).update({
+                MemoryEntry.packed_embedding: encode_embedding(embedding),
+                MemoryEntry.vector_embedding: None,
+                MemoryEntry.embedding_model: model,
+                # A new embedding is not an edit; keep updated_at as it was
+                MemoryEntry.updated_at: MemoryEntry.updated_at
+            }, synchronize_session=False)
+            if changed:
+                record_change(row.user_id, row.id, 'upsert')
+                updated.setdefault(str(row.user_id), []).append(row.id)
+        count = sum(len(memory_ids) for memory_ids in updated.values())
+        checkpoint.rows_reembedded = (checkpoint.rows_reembedded or 0) + count
+        db.session.commit()
+        
+        # Bring this process's resident indexes in line; other workers follow the change log
+        for user_id, memory_ids in updated.items():
+            index = memory_indexes.get(user_id)
+            if index is not None:
+                _apply_memory_changes(index, memory_ids)
+                update_index_tiers(index)
+        
+        reembedded += count
+        batches += 1
+        reembed_status.update(rows_reembedded=reembedded, last_memory_id=rows[-1].id)
+        logger.debug(f"Re-embedded {reembedded}/{stale_rows} memories for {model} (last id {rows[-1].id})")
+        if interval:
+            time.sleep(interval)
+    
+    reembed_status.update(state="finished", finished_at=datetime.utcnow().isoformat())
+    if reembedded:
+        logger.info(f"Re-embedded {reembedded} memories with {model}")
+    return reembedded
+
+def _reembed_checkpoint(model, restart=False):
+    """
+    The EmbeddingMigration row for ``model``, created if missing. With
+    ``restart``, a checkpoint whose pass already finished starts a new one.
+    """
+    checkpoint = EmbeddingMigration.query.filter_by(model_version=model).first()
+    if checkpoint is None:
+        try:
+            db.session.add(EmbeddingMigration(model_version=model, last_memory_id=0, rows_reembedded=0))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # Another worker created it first
+        checkpoint = EmbeddingMigration.query.filter_by(model_version=model).first()
+    elif restart and checkpoint.finished_at is not None:
+        checkpoint.last_memory_id = 0
+        checkpoint.finished_at = None
+        checkpoint.started_at = datetime.utcnow()
+    db.session.commit()
+    return checkpoint
+
+def _reembed_stale_memories_in_background():
+    """Run the re-embedding job in a daemon thread so it never blocks application boot."""
+    def run():
+        from app import app
+        try:
+            with app.app_context():
+                reembed_stale_memories()
+        except Exception as e:
+            reembed_status["state"] = "failed"
+            logger.error(f"Error re-embedding memories: {e}")
+    
+    thread = threading.Thread(target=run, name="memory-reembed", daemon=True)
+    thread.start()
+    return thread
+
+def _message_line(message):
+    return f"{'User' if message.is_user else 'Assistant'}: {message.content}"
+
+def _conversation_windows(messages, max_tokens):
+    """
+    Split messages into consecutive windows of at most ``max_tokens`` tokens.
+    A message longer than that forms a window on its own.
+    """
+    window = []
+    window_tokens = 0
+    for message in messages:
+        tokens = len(tokenize(message.content))
+        if window and window_tokens + tokens > max_tokens:
+            yield window
+            window = []
+            window_tokens = 0
+        window.append(message)
+        window_tokens += tokens
+    if window:
+        yield window
+
+def extract_memories_from_conversation(user, conversation_id, min_messages=1):
+    """
+    Extract and store memories from the messages of a conversation that have
+    not been processed yet.
+    
+    Only messages after the conversation's watermark (the last processed
+    message id) are read, and they are sent for extraction in windows of at
+    most MEMORY_EXTRACTION_WINDOW_TOKENS tokens, so each turn is extracted
+    once however long the conversation grows. The watermark advances after
+    each window; if another worker advanced it first, that window's results
+    are dropped. Nothing happens until ``min_messages`` new messages are
+    waiting. Memories of different types extracted from the same window are
+    linked as "mentioned_with" in the user's memory graph. Returns the stored
+    memory entries.
+    """
+    try:
         from manus_integration import extract_memories
         
-        memory_entries = extract_memories(user, conversation_text)
-        return memory_entries
+        watermark = db.session.query(func.coalesce(Conversation.extracted_message_id, 0)).filter(
+            Conversation.id == conversation_id
+        ).scalar()
+        if watermark is None:
+            return []
+        
+        messages = db.session.query(Message.id, Message.content, Message.is_user).filter(
+            Message.conversation_id == conversation_id,
+            Message.id > watermark
+        ).order_by(Message.id).all()
+        if not messages or len(messages) < min_messages:
+            return []
+        
+        stored = []
+        for window in _conversation_windows(messages, config.MEMORY_EXTRACTION_WINDOW_TOKENS):
+            candidates = extract_memories(user, "\n".join(_message_line(message) for message in window))
+            
+            # Advance the watermark only from the value this run started at
+            claimed = Conversation.query.filter(
+                Conversation.id == conversation_id,
+                func.coalesce(Conversation.extracted_message_id, 0) == watermark
+            ).update({Conversation.extracted_message_id: window[-1].id}, synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                logger.info(f"Conversation {conversation_id} was extracted by another worker")
+                break
+            watermark = window[-1].id
+            
+            window_entries = []
+            for candidate in candidates or []:
+                if not isinstance(candidate, dict) or not candidate.get("title"):
+                    continue
+                try:
+                    window_entries.append(add_memory(
+                        user,
+                        candidate.get("type") or "note",
+                        candidate["title"],
+                        candidate.get("content", ""),
+                        metadata={"source": "conversation", "conversation_id": conversation_id}
+                    ))
+                except Exception:
+                    continue  # add_memory logged it; keep the rest of the window
+            
+            # Entities extracted from the same stretch of conversation are related
+            for position, entry in enumerate(window_entries):
+                for other in window_entries[position + 1:]:
+                    if entry.entry_type != other.entry_type:
+                        link_memories(user.id, entry.id, other.id, "mentioned_with")
+            stored.extend(window_entries)
+        
+        logger.debug(f"Extracted {len(stored)} memories from {len(messages)} new messages "
+                     f"in conversation {conversation_id}")
+        return stored
     except Exception as e:
         logger.error(f"Error extracting memories from conversation: {e}")
+        db.session.rollback()
         return []
+
+def extract_memories_in_background(user_id, conversation_id, min_messages=None):
+    """
+    Run extract_memories_from_conversation in a daemon thread so replies never
+    wait for it. A conversation already being extracted in this process is
+    skipped; its new messages are picked up by the next run.
+    """
+    min_messages = min_messages if min_messages is not None else config.MEMORY_EXTRACTION_MIN_MESSAGES
+    with _extractions_lock:
+        if conversation_id in _extractions_running:
+            return None
+        _extractions_running.add(conversation_id)
+    
+    def run():
+        from app import app
+        # The OpenManus client drives its agent with the thread's event loop
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            with app.app_context():
+                user = User.query.get(user_id)
+                if user is not None:
+                    extract_memories_from_conversation(user, conversation_id, min_messages)
+        except Exception as e:
+            logger.error(f"Error extracting memories in background: {e}")
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            with _extractions_lock:
+                _extractions_running.discard(conversation_id)
+    
+    thread = threading.Thread(target=run, name=f"memory-extract-{conversation_id}", daemon=True)
+    thread.start()
+    return thread
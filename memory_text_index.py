@@ -0,0 +1,320 @@
+"""
+Per-user inverted index with BM25 scoring over memory titles and content.
+
+Vector similarity is weak at exact-token lookups such as a person's name or a
+project code. This index answers those directly and is fused with the vector
+ranking in memory_system.search_memory.
+"""
+
+import math
+import threading
+from collections import Counter
+import numpy as np
+from embeddings import TOKEN_PATTERN
+
+# Standard BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Term frequencies are stored as uint16 and capped at this
+MAX_TERM_FREQUENCY = np.iinfo(np.uint16).max
+
+# Postings added since the last merge are scanned linearly until there are this many
+# (or an eighth of the merged ones), then everything is merged and sorted by term again
+TAIL_POSTINGS = 4096
+
+# Dead slots are dropped at the next merge once they make up this share of all slots
+COMPACT_DEAD_SHARE = 0.5
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+def _grow(array, size):
+    """``array``, reallocated with room for at least ``size`` elements if it has less."""
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array), 16), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class UserTextIndex:
+    """
+    Incrementally maintained inverted index for a single user, in numpy arrays.
+
+    Each indexed memory gets a slot: ``slot_ids[slot]`` is its memory id,
+    ``lengths[slot]`` its length in tokens and ``alive[slot]`` whether it is
+    still indexed; ``slot_of`` maps memory ids to their live slots and
+    ``term_ids`` numbers the terms.
+
+    Postings (a slot containing a term, and the term frequency there) are
+    kept in two parts. The base is sorted by term: a term's postings are
+    ``base_slots`` and ``base_frequencies`` from ``base_offsets[term]`` to
+    ``base_offsets[term + 1]``. The tail holds postings added since, in
+    arrival order (``tail_terms``, ``tail_slots``, ``tail_frequencies``).
+    Once the tail outgrows a fraction of the base the two are merged into a
+    new base. ``forward`` lists each slot's terms, so removing a memory can
+    update ``document_frequency`` without rescanning the postings; removing
+    or replacing a memory only clears its slot, its postings are masked at
+    search time and dropped by the next merge.
+
+    Scoring a query adds each query term's postings into a score array with
+    vectorized numpy operations. Being plain arrays, the index can also be
+    written to a segment file and mapped back (to_arrays, adopt).
+    """
+
+    # The arrays written by to_arrays, besides the terms
+    _ARRAYS = ("document_frequency", "base_offsets", "base_slots", "base_frequencies", "tail_terms",
+               "tail_slots", "tail_frequencies", "slot_ids", "lengths", "alive", "forward", "forward_start")
+
+    def __init__(self, user_id):
+        self.user_id = str(user_id)
+        self.lock = threading.RLock()
+        self.term_ids = {}
+        self.document_frequency = np.zeros(0, dtype=np.int32)
+        self.base_offsets = np.zeros(1, dtype=np.int64)
+        self.base_slots = np.zeros(0, dtype=np.int32)
+        self.base_frequencies = np.zeros(0, dtype=np.uint16)
+        self.tail_terms = np.zeros(0, dtype=np.int32)
+        self.tail_slots = np.zeros(0, dtype=np.int32)
+        self.tail_frequencies = np.zeros(0, dtype=np.uint16)
+        self.tail_size = 0
+        self.slot_of = {}
+        self.slot_ids = np.zeros(0, dtype=np.int64)
+        self.lengths = np.zeros(0, dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.forward = np.zeros(0, dtype=np.int32)
+        self.forward_start = np.zeros(1, dtype=np.int64)
+        self.forward_size = 0
+        self.slot_count = 0
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the index, for status reporting."""
+        arrays = (self.document_frequency, self.base_offsets, self.base_slots, self.base_frequencies,
+                  self.tail_terms, self.tail_slots, self.tail_frequencies, self.slot_ids, self.lengths,
+                  self.alive, self.forward, self.forward_start)
+        # Dict entries and term strings are estimated at 100 bytes each
+        return sum(array.nbytes for array in arrays) + 100 * (len(self.term_ids) + len(self.slot_of))
+
+    def to_arrays(self):
+        """Snapshot the index as named arrays, for a segment file (see adopt)."""
+        with self.lock:
+            sizes = {"document_frequency": len(self.term_ids), "tail_terms": self.tail_size,
+                     "tail_slots": self.tail_size, "tail_frequencies": self.tail_size,
+                     "slot_ids": self.slot_count, "lengths": self.slot_count, "alive": self.slot_count,
+                     "forward": self.forward_size, "forward_start": self.slot_count + 1}
+            arrays = {f"text_{name}": getattr(self, name)[:sizes.get(name)].copy() for name in self._ARRAYS}
+            terms = "\n".join(self.term_ids).encode("utf-8")
+            arrays["text_terms"] = np.frombuffer(terms, dtype=np.uint8).copy()
+            return arrays
+
+    def adopt(self, arrays):
+        """
+        Use arrays written by to_arrays as the backing store, e.g. mapped from
+        a segment file; changes copy the arrays they touch into private memory.
+        """
+        with self.lock:
+            for name in self._ARRAYS:
+                setattr(self, name, arrays[f"text_{name}"])
+            terms = arrays["text_terms"].tobytes().decode("utf-8")
+            self.term_ids = {term: term_id for term_id, term in enumerate(terms.split("\n"))} if terms else {}
+            self.tail_size = len(self.tail_terms)
+            self.forward_size = len(self.forward)
+            self.slot_count = len(self.slot_ids)
+            live = np.flatnonzero(self.alive)
+            self.slot_of = dict(zip(self.slot_ids[live].tolist(), live.tolist()))
+            self.total_length = int(self.lengths.sum())
+
+    def ids(self):
+        """Memory ids currently indexed, as an int64 array."""
+        with self.lock:
+            return self.slot_ids[:self.slot_count][self.alive[:self.slot_count]].copy()
+
+    def add(self, memory_id, text):
+        """Index a memory's text, replacing whatever was indexed for it before."""
+        self.add_many([(memory_id, text)])
+
+    def add_many(self, items):
+        """Index ``(memory_id, text)`` pairs, replacing whatever was indexed for them before."""
+        # A memory listed twice is indexed with its last text
+        documents = {}
+        for memory_id, text in items:
+            documents[int(memory_id)] = Counter(tokenize(text))
+        if not documents:
+            return
+        with self.lock:
+            for memory_id in documents:
+                self._remove(memory_id)
+            first = self.slot_count
+            end = first + len(documents)
+            self.slot_ids = _grow(self.slot_ids, end)
+            self.lengths = _grow(self.lengths, end)
+            self.alive = _grow(self.alive, end)
+            self.forward_start = _grow(self.forward_start, end + 1)
+
+            term_ids = self.term_ids
+            forward = []
+            frequencies = []
+            terms_per_slot = []
+            self.slot_of.update(zip(documents, range(first, end)))
+            self.slot_ids[first:end] = list(documents)
+            self.alive[first:end] = True
+            lengths = [sum(terms.values()) for terms in documents.values()]
+            self.lengths[first:end] = lengths
+            self.total_length += sum(lengths)
+            for terms in documents.values():
+                words = list(terms)
+                ids = list(map(term_ids.get, words))
+                if None in ids:
+                    # New terms get the next id
+                    for position, term_id in enumerate(ids):
+                        if term_id is None:
+                            ids[position] = term_ids.setdefault(words[position], len(term_ids))
+                forward.extend(ids)
+                frequencies.extend(terms.values())
+                terms_per_slot.append(len(words))
+            self.slot_count = end
+
+            forward = np.array(forward, dtype=np.int32)
+            self.forward_start[first] = self.forward_size
+            self.forward_start[first + 1:end + 1] = self.forward_size + np.cumsum(terms_per_slot, dtype=np.int64)
+            self._append("forward", self.forward_size, forward)
+            self.forward_size += len(forward)
+
+            self.document_frequency = _grow(self.document_frequency, len(term_ids))
+            np.add.at(self.document_frequency, forward, 1)
+            self._append("tail_terms", self.tail_size, forward)
+            self._append("tail_slots", self.tail_size, np.repeat(np.arange(first, end, dtype=np.int32), terms_per_slot))
+            self._append("tail_frequencies", self.tail_size, np.minimum(frequencies, MAX_TERM_FREQUENCY))
+            self.tail_size += len(forward)
+            if self.tail_size > max(TAIL_POSTINGS, len(self.base_slots) // 8):
+                self._merge()
+
+    def _append(self, name, size, values):
+        array = _grow(getattr(self, name), size + len(values))
+        array[size:size + len(values)] = values
+        setattr(self, name, array)
+
+    def remove(self, memory_id):
+        with self.lock:
+            removed = self._remove(int(memory_id))
+            dead = self.slot_count - len(self.slot_of)
+            if removed and dead >= 1024 and dead >= COMPACT_DEAD_SHARE * self.slot_count:
+                self._merge()
+            return removed
+
+    def _remove(self, memory_id):
+        slot = self.slot_of.pop(memory_id, None)
+        if slot is None:
+            return False
+        self.alive[slot] = False
+        terms = self.forward[self.forward_start[slot]:self.forward_start[slot + 1]]
+        self.document_frequency[terms] -= 1
+        self.total_length -= int(self.lengths[slot])
+        self.lengths[slot] = 0
+        return True
+
+    def _merge(self):
+        """
+        Merge the tail into a new base sorted by term, dropping the postings
+        of dead slots; once there are enough dead slots, renumber the live
+        ones densely too.
+        """
+        count = self.slot_count
+        alive = self.alive[:count]
+        base_terms = np.repeat(np.arange(len(self.base_offsets) - 1, dtype=np.int32), np.diff(self.base_offsets))
+        terms = np.concatenate((base_terms, self.tail_terms[:self.tail_size]))
+        slots = np.concatenate((self.base_slots, self.tail_slots[:self.tail_size]))
+        frequencies = np.concatenate((self.base_frequencies, self.tail_frequencies[:self.tail_size]))
+        keep = alive[slots]
+        terms, slots, frequencies = terms[keep], slots[keep], frequencies[keep]
+
+        dead = count - len(self.slot_of)
+        if dead >= 1024 and dead >= COMPACT_DEAD_SHARE * count:
+            renumber = np.full(count, -1, dtype=np.int32)
+            renumber[alive] = np.arange(len(self.slot_of), dtype=np.int32)
+            slots = renumber[slots]
+            terms_per_slot = np.diff(self.forward_start[:count + 1])
+            self.forward = self.forward[:self.forward_size][np.repeat(alive, terms_per_slot)]
+            self.forward_size = len(self.forward)
+            self.forward_start = np.concatenate(([0], np.cumsum(terms_per_slot[alive]))).astype(np.int64)
+            self.slot_ids = self.slot_ids[:count][alive]
+            self.lengths = self.lengths[:count][alive]
+            self.slot_count = len(self.slot_ids)
+            self.alive = np.ones(self.slot_count, dtype=bool)
+            self.slot_of = dict(zip(self.slot_ids.tolist(), range(self.slot_count)))
+
+        order = np.argsort(terms, kind="stable")
+        self.base_slots = slots[order]
+        self.base_frequencies = frequencies[order]
+        self.base_offsets = np.concatenate(([0], np.cumsum(np.bincount(terms, minlength=len(self.term_ids))))).astype(np.int64)
+        self.tail_terms = np.zeros(0, dtype=np.int32)
+        self.tail_slots = np.zeros(0, dtype=np.int32)
+        self.tail_frequencies = np.zeros(0, dtype=np.uint16)
+        self.tail_size = 0
+
+    def search(self, query, limit=5, allowed=None):
+        """
+        Return up to ``limit`` ``(memory_id, bm25_score)`` pairs, best first.
+        ``allowed``, a set or array of memory ids, restricts which memories are scored.
+        """
+        query_terms = set(tokenize(query))
+        with self.lock:
+            doc_count = len(self.slot_of)
+            if not doc_count or not query_terms:
+                return []
+            average_length = self.total_length / doc_count or 1.0
+            base_terms = len(self.base_offsets) - 1
+            tail_terms = self.tail_terms[:self.tail_size]
+
+            scores = np.zeros(self.slot_count, dtype=np.float32)
+            matched = np.zeros(self.slot_count, dtype=bool)
+            for term in query_terms:
+                term_id = self.term_ids.get(term)
+                if term_id is None or not self.document_frequency[term_id]:
+                    continue
+                frequency = int(self.document_frequency[term_id])
+                idf = math.log(1 + (doc_count - frequency + 0.5) / (frequency + 0.5))
+                parts = []
+                if term_id < base_terms:
+                    start, end = self.base_offsets[term_id], self.base_offsets[term_id + 1]
+                    parts.append((self.base_slots[start:end], self.base_frequencies[start:end]))
+                if len(tail_terms):
+                    in_tail = np.flatnonzero(tail_terms == term_id)
+                    parts.append((self.tail_slots[in_tail], self.tail_frequencies[in_tail]))
+                for slots, tf in parts:
+                    tf = tf.astype(np.float32)
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[slots] / average_length)
+                    # A slot holds a term once, so plain fancy-index addition is exact
+                    scores[slots] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    matched[slots] = True
+
+            candidates = np.flatnonzero(matched & self.alive[:self.slot_count])
+            if allowed is not None and len(candidates):
+                allowed = np.fromiter(allowed, dtype=np.int64, count=len(allowed)) \
+                    if isinstance(allowed, (set, frozenset)) else np.asarray(allowed, dtype=np.int64)
+                candidates = candidates[np.isin(self.slot_ids[candidates], allowed)]
+            if len(candidates) > limit:
+                candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return [(int(self.slot_ids[slot]), float(scores[slot])) for slot in candidates[:limit]]
+
+
+def reciprocal_rank_fusion(rankings, k=60, limit=5):
+    """
+    Fuse several ranked lists of ``(memory_id, score)`` with RRF:
+    each list contributes ``1 / (k + rank)`` for every memory it contains.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (memory_id, _) in enumerate(ranking, start=1):
+            fused[memory_id] = fused.get(memory_id, 0.0) + 1.0 / (k + rank)
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return ranked[:limit]
@@ -0,0 +1,158 @@
+"""
+Full-text search over chat history.
+
+Answers "when did we last discuss X?" without scanning every message a user
+ever sent. The index lives in the database and is maintained by it on every
+insert, update and delete of a Message:
+
+- SQLite: an external-content FTS5 table (``message_fts``) kept in step by
+  triggers on the message table;
+- PostgreSQL: a generated ``content_tsv`` tsvector column with a GIN index.
+
+Other databases fall back to a LIKE scan. Matches are joined to their
+conversation to restrict them to one user and returned most recent first.
+"""
+
+import re
+import logging
+from sqlalchemy import func, text
+from app import db
+from models import Message, Conversation
+from memory_index import to_timestamp
+from memory_text_index import tokenize
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "message_fts"
+
+# Words dropped from search queries; they say nothing about the topic
+STOP_WORDS = {"a", "an", "the", "our", "my", "your", "about", "of", "on", "and", "we", "did", "last"}
+
+# "when did we last discuss/talk about/mention X", capturing X
+LAST_DISCUSSED_PATTERN = re.compile(
+    r"\bwhen\s+did\s+(?:we|i|you)\s+last\s+(?:discuss|talk\s+about|mention|speak\s+about|chat\s+about)\s+(.+?)[\s?.!]*$",
+    re.IGNORECASE
+)
+
+_SQLITE_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        content, content='message', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON message BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF content ON message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+_POSTGRES_STATEMENTS = [
+    "ALTER TABLE message ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_message_content_tsv ON message USING GIN (content_tsv)",
+]
+
+# Which kind of index ensure_message_index() set up: 'fts5', 'tsvector' or 'scan'
+_index_kind = None
+
+
+def ensure_message_index():
+    """
+    Create the full-text index for the current database if it is missing,
+    indexing existing messages. Safe to call at every startup. Returns the
+    kind of index in use.
+    """
+    global _index_kind
+    dialect = db.engine.dialect.name
+
+    # Lookups go through conversation.user_id and message.conversation_id either way
+    for index in (*Conversation.__table__.indexes, *Message.__table__.indexes):
+        index.create(db.engine, checkfirst=True)
+
+    try:
+        if dialect == "sqlite":
+            with db.engine.begin() as connection:
+                existed = connection.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ), {"name": FTS_TABLE}).first() is not None
+                for statement in _SQLITE_STATEMENTS:
+                    connection.execute(text(statement))
+                if not existed:
+                    # Index the messages stored before the table existed
+                    connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                    logger.info("Built FTS5 index over chat history")
+            _index_kind = "fts5"
+        elif dialect == "postgresql":
+            with db.engine.begin() as connection:
+                for statement in _POSTGRES_STATEMENTS:
+                    connection.execute(text(statement))
+            _index_kind = "tsvector"
+        else:
+            _index_kind = "scan"
+    except Exception as e:
+        # e.g. SQLite built without FTS5; searches still work by scanning
+        logger.warning(f"Full-text index over messages unavailable, falling back to scans: {e}")
+        _index_kind = "scan"
+    return _index_kind
+
+
+def query_terms(query):
+    """The words of a search query that carry its topic."""
+    terms = [term for term in tokenize(query) if term not in STOP_WORDS]
+    return terms or tokenize(query)
+
+
+def last_discussed_topic(message):
+    """The topic of a "when did we last discuss X?" question, or None if ``message`` is not one."""
+    match = LAST_DISCUSSED_PATTERN.search(message or "")
+    return match.group(1).strip() if match else None
+
+
+def search_messages(user_id, query, limit=5, before_id=None):
+    """
+    A user's messages containing every topic word of ``query``, most recent
+    first. ``before_id`` skips messages from that id on (e.g. the question
+    being answered). Each result has ``message_id``, ``conversation_id``,
+    ``content``, ``is_user`` and ``timestamp_ms`` (milliseconds since the
+    epoch, UTC).
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    kind = _index_kind or ensure_message_index()
+
+    matches = db.session.query(
+        Message.id, Message.conversation_id, Message.content, Message.is_user, Message.timestamp
+    ).join(Conversation, Conversation.id == Message.conversation_id).filter(
+        Conversation.user_id == str(user_id)
+    )
+    if before_id is not None:
+        matches = matches.filter(Message.id < before_id)
+
+    if kind == "fts5":
+        # Quoted terms, so words like AND/NEAR or stray punctuation are never read as FTS5 syntax
+        matches = matches.filter(Message.id.in_(
+            text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match")
+        )).params(match=" ".join(f'"{term}"' for term in terms))
+    elif kind == "tsvector":
+        matches = matches.filter(
+            text("message.content_tsv @@ plainto_tsquery('english', :match)")
+        ).params(match=" ".join(terms))
+    else:
+        for term in terms:
+            matches = matches.filter(func.lower(Message.content).like(f"%{term}%"))
+
+    rows = matches.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit).all()
+    return [{
+        "message_id": row.id,
+        "conversation_id": row.conversation_id,
+        "content": row.content,
+        "is_user": bool(row.is_user),
+        "timestamp_ms": None if row.timestamp is None else int(round(to_timestamp(row.timestamp) * 1000))
+    } for row in rows]
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Embedding Storage Migration
+
+Converts MemoryEntry.vector_embedding JSON text into the packed binary
+MemoryEntry.packed_embedding column, in batches.
+
+The migration is resumable: each batch is committed on its own and only rows
+that still lack a packed embedding are selected, so an interrupted run simply
+continues where it stopped when started again.
+
+Usage:
+    python migrate_embeddings.py [--batch-size N] [--dtype float32|float16] [--keep-json] [--dry-run]
+"""
+
+import argparse
+import json
+import logging
+import time
+from app import app, db
+from models import MemoryEntry
+from db_upgrade import upgrade_schema
+from embedding_codec import pack_embedding
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Convert JSON memory embeddings to packed binary.')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Rows converted and committed per batch')
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32',
+                        help='Precision of the packed embeddings')
+    parser.add_argument('--keep-json', action='store_true',
+                        help='Keep the legacy JSON text after converting a row')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report how many rows still need converting')
+    return parser.parse_args()
+
+def pending_rows_query():
+    """Rows that still only have a JSON embedding."""
+    return MemoryEntry.query.filter(
+        MemoryEntry.packed_embedding.is_(None),
+        MemoryEntry.vector_embedding.isnot(None)
+    )
+
+def migrate_embeddings(batch_size=1000, dtype='float32', keep_json=False, dry_run=False):
+    """Convert pending rows batch by batch. Returns (converted, skipped)."""
+    with app.app_context():
+        upgrade_schema()
+
+        pending = pending_rows_query().count()
+        print(f"Rows to convert: {pending}")
+        if dry_run or not pending:
+            return 0, 0
+
+        converted = 0
+        skipped = 0
+        bytes_before = 0
+        bytes_after = 0
+        last_id = 0
+        started = time.perf_counter()
+
+        while True:
+            # Keyset pagination on id; rows that fail to parse stay pending
+            # but are never revisited within this run
+            rows = db.session.query(MemoryEntry.id, MemoryEntry.vector_embedding).filter(
+                MemoryEntry.packed_embedding.is_(None),
+                MemoryEntry.vector_embedding.isnot(None),
+                MemoryEntry.id > last_id
+            ).order_by(MemoryEntry.id).limit(batch_size).all()
+            if not rows:
+                break
+
+            updates = []
+            for memory_id, vector_embedding in rows:
+                try:
+                    packed = pack_embedding(json.loads(vector_embedding), dtype=dtype)
+                except (TypeError, ValueError) as e:
+                    logger.warning(f"Skipping memory {memory_id}: {e}")
+                    skipped += 1
+                    continue
+
+                update = {'id': memory_id, 'packed_embedding': packed}
+                if not keep_json:
+                    update['vector_embedding'] = None
+                updates.append(update)
+                bytes_before += len(vector_embedding)
+                bytes_after += len(packed)
+
+            if updates:
+                db.session.bulk_update_mappings(MemoryEntry, updates)
+            db.session.commit()
+
+            converted += len(updates)
+            last_id = rows[-1][0]
+            elapsed = time.perf_counter() - started
+            print(f"Converted {converted}/{pending} rows "
+                  f"({converted / elapsed if elapsed else 0:.0f} rows/s, last id {last_id})")
+
+        if bytes_after:
+            print(f"Embedding storage: {bytes_before} -> {bytes_after} bytes "
+                  f"({bytes_before / bytes_after:.1f}x smaller)")
+        print(f"Done: {converted} converted, {skipped} skipped")
+        return converted, skipped
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    migrate_embeddings(
+        batch_size=args.batch_size,
+        dtype=args.dtype,
+        keep_json=args.keep_json,
+        dry_run=args.dry_run
+    )
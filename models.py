@@ -43,9 +43,10 @@ User.__repr__ = lambda self: f'<User {self.username}>'
 
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
     start_time = db.Column(db.DateTime, default=datetime.utcnow)
     end_time = db.Column(db.DateTime)
+    extracted_message_id = db.Column(db.Integer)  # Last message memories were extracted from
     
     # Relationships
     messages = db.relationship('Message', backref='conversation', lazy='dynamic')
@@ -55,7 +56,7 @@ class Conversation(db.Model):
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False, index=True)
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     is_user = db.Column(db.Boolean, default=True)  # True if from user, False if from bot
@@ -70,7 +71,12 @@ class MemoryEntry(db.Model):
     title = db.Column(db.String(256), nullable=False)
     content = db.Column(db.Text)
     meta_data = db.Column(JSON)  # Renamed from metadata as it's a reserved name
-    vector_embedding = db.Column(db.Text)  # For vector-based search
+    vector_embedding = db.Column(db.Text)  # Legacy JSON embedding, superseded by packed_embedding
+    packed_embedding = db.Column(db.LargeBinary)  # Header + packed float vector, see embedding_codec
+    embedding_model = db.Column(db.String(128))  # Embedder model_version of packed_embedding
+    minhash_signature = db.Column(db.LargeBinary)  # Near-duplicate signature, see memory_dedup
+    access_count = db.Column(db.Integer, default=0)  # Times returned by a memory search
+    last_accessed_at = db.Column(db.DateTime)  # Last time returned by a memory search
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -109,3 +115,96 @@ class Document(db.Model):
     
     def __repr__(self):
         return f'<Document {self.id}: {self.title}>'
+
+class DocumentChunk(db.Model):
+    """An overlapping passage of a document's content_text and its embedding, see document_chunks."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)  # Order of the chunk within its document
+    start_offset = db.Column(db.Integer, nullable=False)  # Character offsets into content_text
+    end_offset = db.Column(db.Integer, nullable=False)
+    token_count = db.Column(db.Integer)
+    packed_embedding = db.Column(db.LargeBinary)  # Header + packed float vector, see embedding_codec
+    embedding_model = db.Column(db.String(128))  # Embedder model_version of packed_embedding
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_document_chunk_user_model', 'user_id', 'embedding_model'),)
+
+    def __repr__(self):
+        return f'<DocumentChunk {self.document_id}:{self.position}>'
+
+class MemoryLink(db.Model):
+    """Typed link between two of a user's memories, see memory_graph."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
+    source_id = db.Column(db.Integer, db.ForeignKey('memory_entry.id'), nullable=False, index=True)
+    target_id = db.Column(db.Integer, db.ForeignKey('memory_entry.id'), nullable=False, index=True)
+    relation = db.Column(db.String(64), nullable=False)  # 'works_at', 'mentioned_with', etc.
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (UniqueConstraint('source_id', 'target_id', 'relation', name='uq_memory_link'),)
+    
+    def __repr__(self):
+        return f'<MemoryLink {self.source_id} {self.relation} {self.target_id}>'
+
+class Contact(db.Model):
+    """Business card fields of a 'contact' memory, normalized for indexed lookup (see contact_store)."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    memory_id = db.Column(db.Integer, db.ForeignKey('memory_entry.id'), nullable=False, unique=True)
+    name = db.Column(db.String(256))
+    name_key = db.Column(db.String(256))  # Lower-cased, whitespace collapsed
+    email = db.Column(db.String(256))  # Lower-cased
+    phone = db.Column(db.String(32))  # Digits only
+    company = db.Column(db.String(256))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    memory = db.relationship('MemoryEntry', backref=db.backref('contact', uselist=False))
+    
+    __table_args__ = (
+        db.Index('ix_contact_user_name', 'user_id', 'name_key'),
+        db.Index('ix_contact_user_email', 'user_id', 'email'),
+        db.Index('ix_contact_user_phone', 'user_id', 'phone'),
+    )
+    
+    def __repr__(self):
+        return f'<Contact {self.id}: {self.name}>'
+
+class ContactTrigram(db.Model):
+    """One three-character substring of a contact's name_key, for substring name lookup."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String, nullable=False)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=False, index=True)
+    trigram = db.Column(db.String(3), nullable=False)
+    
+    __table_args__ = (db.Index('ix_contact_trigram_user_trigram', 'user_id', 'trigram'),)
+    
+    def __repr__(self):
+        return f'<ContactTrigram {self.contact_id}: {self.trigram}>'
+
+class EmbeddingMigration(db.Model):
+    """Checkpoint of the background job re-embedding memories for one embedder model version."""
+    id = db.Column(db.Integer, primary_key=True)
+    model_version = db.Column(db.String(128), unique=True, nullable=False)
+    last_memory_id = db.Column(db.Integer, default=0)  # Memories up to this id have been claimed
+    rows_reembedded = db.Column(db.Integer, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<EmbeddingMigration {self.model_version}: {self.last_memory_id}>'
+
+class MemoryChangeLog(db.Model):
+    """Append-only record of memory writes, tailed by every worker to keep its indexes in sync."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String, nullable=False, index=True)
+    memory_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(16), nullable=False)  # 'upsert' or 'delete'
+    origin = db.Column(db.String(128))  # Process that made the change; it skips its own entries
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<MemoryChangeLog {self.id}: {self.operation} {self.memory_id}>'
@@ -0,0 +1,361 @@
+"""
+Parallel text extraction from PDFs.
+
+Extracting a long PDF page by page with PyPDF2 is CPU-bound and holds the
+GIL, so a few 300-page contracts used to block a worker for minutes. Here a
+PDF's pages are split into one range per worker (at least
+DOCUMENT_PDF_PAGES_PER_TASK pages each) and fanned out to a process pool of
+DOCUMENT_PDF_WORKERS processes, shared by every extraction in this process;
+page texts come back in order and are joined once. The PDF (bytes, or a
+file object such as a spooled download, copied a block at a time) is
+written to a temporary file once and workers are sent its path, so each
+task parses the file itself instead of receiving a copy of its bytes. The
+file is removed when the extraction ends; remove_stale_files() clears those
+left by processes that died mid-extraction, and runs at startup.
+
+Each page gets DOCUMENT_PDF_PAGE_TIMEOUT seconds. A page that takes longer
+(e.g. a pathological content stream) is interrupted by an alarm in the
+worker and left empty, and the rest of the document is still extracted.
+Workers report when they start a task; if one runs past its pages' timeouts
+(the alarm could not stop it), that worker alone is killed and the pool
+starts a replacement, so other documents' tasks on the shared pool carry on.
+The hung range is retried in pieces of DOCUMENT_PDF_PAGES_PER_TASK pages;
+the piece that hangs again is given up on.
+
+Workers are started by a fork server (spawned where there is none), never
+forked from the app itself: forking a multithreaded process can copy a lock
+some other thread holds and deadlock the child. The fork server preloads only
+this module and PyPDF2. Spawned and fork-server children import the parent's
+``__main__`` again as ``__mp_main__``, so entry points that start the app
+(main.py) skip that under that name. Where SIGALRM is not available, pages
+are extracted without the per-page timeout.
+"""
+
+import io
+import os
+import glob
+import math
+import shutil
+import time
+import signal
+import logging
+import tempfile
+import itertools
+import threading
+import multiprocessing
+import PyPDF2
+import config
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Seconds added to a task's page timeouts before its worker is killed
+TASK_TIMEOUT_SLACK = 5.0
+
+# Seconds between checks on a running task while waiting for its result
+TASK_POLL_INTERVAL = 0.25
+
+# Temporary PDF files are named TEMP_PREFIX + the writing process's id + "_"
+TEMP_PREFIX = "pdf_extraction_"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Task token -> (monotonic start time, worker pid) as reported by the workers, or None until it starts
+_task_starts = {}
+_task_starts_lock = threading.Lock()
+_task_tokens = itertools.count()
+
+# Set in each pool worker by _init_worker: where it reports the tasks it starts
+_started_queue = None
+
+
+class PageTimeout(Exception):
+    """A PDF page took longer than its timeout to extract."""
+
+
+class PdfExtraction:
+    """The text of each page of a PDF, and the pages that could not be extracted."""
+
+    def __init__(self, pages, timed_out=(), failed=()):
+        self.pages = pages
+        self.timed_out = sorted(timed_out)
+        self.failed = sorted(failed)
+
+    @property
+    def text(self):
+        """Every page's text, one page per line, in page order."""
+        return "\n".join(self.pages) + "\n" if self.pages else ""
+
+
+def _raise_page_timeout(signum, frame):
+    raise PageTimeout()
+
+
+def _extract_page(page, timeout):
+    """Extract one page, raising PageTimeout after ``timeout`` seconds where SIGALRM is available."""
+    if not timeout or not hasattr(signal, "setitimer"):
+        return page.extract_text() or ""
+    previous = signal.signal(signal.SIGALRM, _raise_page_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return page.extract_text() or ""
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _reader(source):
+    """A PdfReader over ``source``: PDF bytes or a binary file object."""
+    return PyPDF2.PdfReader(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+
+
+def extract_page_range(source, start, end, page_timeout=None):
+    """
+    Extract pages ``start`` to ``end`` (exclusive) of the PDF in ``source``:
+    its bytes, a binary file object or the path of a file holding it.
+    Returns ``(texts, timed_out, failed)``; pages that timed out or raised
+    are empty in ``texts`` and listed by number. Runs in pool workers.
+    """
+    if isinstance(source, str):
+        # Read from the open file as pages need it, not loaded whole
+        with open(source, 'rb') as f:
+            return extract_page_range(f, start, end, page_timeout)
+    reader = _reader(source)
+    texts, timed_out, failed = [], [], []
+    for number in range(start, end):
+        try:
+            texts.append(_extract_page(reader.pages[number], page_timeout))
+        except PageTimeout:
+            texts.append("")
+            timed_out.append(number)
+        except Exception as e:
+            logger.debug(f"Could not extract PDF page {number}: {e}")
+            texts.append("")
+            failed.append(number)
+    return texts, timed_out, failed
+
+
+def _pool_context():
+    """A fork-server context preloading this module, or a spawn context where there is no fork server."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def _init_worker(started_queue):
+    global _started_queue
+    _started_queue = started_queue
+
+
+def _run_task(token, path, start, end, page_timeout):
+    """Pool task: report the start of task ``token``, then extract its pages."""
+    _started_queue.put((token, os.getpid()))
+    return extract_page_range(path, start, end, page_timeout)
+
+
+def _track_task_starts(started_queue):
+    """Record the task starts workers report, until None arrives."""
+    while True:
+        report = started_queue.get()
+        if report is None:
+            return
+        token, pid = report
+        with _task_starts_lock:
+            # Tasks already collected (or abandoned) are not tracked any more
+            if token in _task_starts:
+                _task_starts[token] = (time.monotonic(), pid)
+
+
+def _get_pool(workers):
+    """The shared extraction pool, created on first use; None when ``workers`` is 0 or it cannot start."""
+    global _pool
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            context = _pool_context()
+            try:
+                started_queue = context.SimpleQueue()
+                pool = context.Pool(workers, initializer=_init_worker, initargs=(started_queue,))
+            except OSError as e:
+                logger.warning(f"Could not start the PDF extraction pool, extracting inline: {e}")
+                return None
+            threading.Thread(target=_track_task_starts, args=(started_queue,),
+                             name="pdf-task-starts", daemon=True).start()
+            _pool = (pool, started_queue)
+        return _pool[0]
+
+
+def _kill_worker(pid):
+    """Kill one hung pool worker; the pool replaces it."""
+    try:
+        os.kill(pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+    except OSError:
+        pass
+
+
+def shutdown_pool():
+    """Stop the shared extraction pool's workers (e.g. at exit or in benchmarks)."""
+    global _pool
+    with _pool_lock:
+        shared, _pool = _pool, None
+    if shared is not None:
+        pool, started_queue = shared
+        # Not close(): its join() would wait forever on the results of tasks whose worker was killed
+        pool.terminate()
+        pool.join()
+        started_queue.put(None)
+
+
+def _write_temp_file(source):
+    """Copy PDF bytes or a binary file object, a block at a time, to a new temporary file; returns its path."""
+    fd, path = tempfile.mkstemp(prefix=f"{TEMP_PREFIX}{os.getpid()}_", suffix=".pdf")
+    with os.fdopen(fd, 'wb') as f:
+        if isinstance(source, (bytes, bytearray)):
+            f.write(source)
+        else:
+            shutil.copyfileobj(source, f)
+    return path
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # Exists but belongs to someone else
+    return True
+
+
+def remove_stale_files():
+    """
+    Remove temporary PDF files whose writing process is gone (killed or
+    crashed mid-extraction). Files of live processes are left alone, so this
+    is safe while other workers extract. Returns how many were removed.
+    """
+    removed = 0
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), f"{TEMP_PREFIX}*.pdf")):
+        pid = os.path.basename(path)[len(TEMP_PREFIX):].split("_", 1)[0]
+        if pid.isdigit() and _process_alive(int(pid)):
+            continue
+        try:
+            os.unlink(path)
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"Removed {removed} stale temporary PDF files")
+    return removed
+
+
+def extract_pdf(source, workers=None, pages_per_task=None, page_timeout=None):
+    """
+    Extract the text of every page of the PDF in ``source`` (bytes, or a
+    binary file object positioned at its start), in parallel where the pool
+    is available. Options default to
+    DOCUMENT_PDF_WORKERS, DOCUMENT_PDF_PAGES_PER_TASK (the fewest pages per
+    task) and DOCUMENT_PDF_PAGE_TIMEOUT. Returns a PdfExtraction.
+    """
+    workers = config.DOCUMENT_PDF_WORKERS if workers is None else workers
+    pages_per_task = max(1, pages_per_task or config.DOCUMENT_PDF_PAGES_PER_TASK)
+    page_timeout = config.DOCUMENT_PDF_PAGE_TIMEOUT if page_timeout is None else page_timeout
+
+    path = None
+    try:
+        if workers > 0:
+            path = _write_temp_file(source)
+            source = path
+        page_count = _page_count(source)
+        # One range per worker, so each parses the file about once
+        range_pages = max(pages_per_task, math.ceil(page_count / workers)) if workers > 0 else pages_per_task
+        ranges = [(start, min(start + range_pages, page_count)) for start in range(0, page_count, range_pages)]
+        # The alarm interrupts the thread it is set from, which has to be the main thread
+        inline_timeout = page_timeout if threading.current_thread() is threading.main_thread() else None
+
+        results = {}
+        pool = _get_pool(workers)
+        if pool is None:
+            for start, end in ranges:
+                results[start] = extract_page_range(source, start, end, inline_timeout)
+        pending = ranges if pool is not None else []
+        while pending:
+            pending = _extract_in_pool(pool, path, pending, page_timeout, pages_per_task, results)
+    finally:
+        if path is not None:
+            os.unlink(path)
+
+    pages, timed_out, failed = [], [], []
+    for start in sorted(results):
+        texts, range_timed_out, range_failed = results[start]
+        pages.extend(texts)
+        timed_out.extend(range_timed_out)
+        failed.extend(range_failed)
+    if timed_out:
+        logger.warning(f"Skipped {len(timed_out)} PDF pages that took over {page_timeout}s to extract: {timed_out[:10]}")
+    return PdfExtraction(pages, timed_out, failed)
+
+
+def _page_count(source):
+    """Pages in the PDF at ``source`` (a path, bytes or a file object, rewound afterwards)."""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return len(_reader(f).pages)
+    position = None if isinstance(source, (bytes, bytearray)) else source.tell()
+    count = len(_reader(source).pages)
+    if position is not None:
+        source.seek(position)
+    return count
+
+
+def _extract_in_pool(pool, path, ranges, page_timeout, min_pages, results):
+    """
+    Extract ``ranges`` of the PDF file at ``path`` in ``pool``, into
+    ``results`` by range start. A task still running TASK_TIMEOUT_SLACK
+    seconds past its pages' timeouts (or whose worker died) has its worker
+    killed; a hung range longer than ``min_pages`` is returned cut into
+    ranges of that many pages to retry, so only the piece holding the bad
+    page is given up on.
+    """
+    tasks = []
+    for start, end in ranges:
+        token = next(_task_tokens)
+        with _task_starts_lock:
+            _task_starts[token] = None
+        tasks.append((start, end, token, pool.apply_async(_run_task, (token, path, start, end, page_timeout))))
+
+    pending = []
+    try:
+        for start, end, token, task in tasks:
+            budget = page_timeout * (end - start) + TASK_TIMEOUT_SLACK if page_timeout else None
+            while True:
+                try:
+                    results[start] = task.get(timeout=TASK_POLL_INTERVAL)
+                    break
+                except multiprocessing.TimeoutError:
+                    pass
+                with _task_starts_lock:
+                    started = _task_starts.get(token)
+                if started is None:
+                    continue  # Still queued behind other tasks
+                started_at, pid = started
+                overdue = budget is not None and time.monotonic() - started_at > budget
+                if not overdue and _process_alive(pid):
+                    continue
+                logger.warning(f"PDF pages {start}-{end - 1} were not extracted in time, "
+                               f"killing worker {pid}")
+                _kill_worker(pid)
+                if end - start > min_pages:
+                    pending.extend((piece, min(piece + min_pages, end)) for piece in range(start, end, min_pages))
+                else:
+                    results[start] = ([""] * (end - start), list(range(start, end)), [])
+                break
+    finally:
+        with _task_starts_lock:
+            for _, _, token, _ in tasks:
+                _task_starts.pop(token, None)
+    return pending
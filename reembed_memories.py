@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Memory Re-embedding
+
+Re-embeds memories whose embedding was produced by a different model than the
+configured embedder (MEMORY_EMBEDDER / MEMORY_EMBEDDING_MODEL), or predates
+embeddings being tagged with their model.
+
+The app runs the same job in the background at startup unless
+MEMORY_REEMBED_ON_START is off; this script runs it in the foreground, for
+example right after switching models. Progress is checkpointed in the
+database, so an interrupted run continues where it stopped, and running it
+alongside the app's job splits the work rather than repeating it.
+
+Usage:
+    python reembed_memories.py [--batch-size N] [--interval SECONDS] [--max-batches N] [--dry-run]
+"""
+
+import argparse
+import logging
+import time
+from app import app, db
+from models import MemoryEntry, EmbeddingMigration
+from db_upgrade import upgrade_schema
+from sqlalchemy import func
+import memory_system
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Re-embed memories stored by a different embedding model.')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Memories re-embedded and committed per batch (default MEMORY_REEMBED_BATCH_SIZE)')
+    parser.add_argument('--interval', type=float, default=0.0,
+                        help='Seconds to pause between batches')
+    parser.add_argument('--max-batches', type=int, default=None,
+                        help='Stop after this many batches (run again to continue)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report how many memories are stale, by model')
+    return parser.parse_args()
+
+def reembed_memories(batch_size=None, interval=0.0, max_batches=None, dry_run=False):
+    """Re-embed stale memories. Returns the number re-embedded."""
+    with app.app_context():
+        upgrade_schema()
+
+        model = memory_system.embedding_model()
+        stale = db.session.query(MemoryEntry.embedding_model, func.count(MemoryEntry.id)).filter(
+            memory_system._stale_embedding(model)
+        ).group_by(MemoryEntry.embedding_model).all()
+        print(f"Current model: {model}")
+        for stale_model, count in stale:
+            print(f"  {count} memories from {stale_model or 'an untagged model'}")
+        checkpoint = EmbeddingMigration.query.filter_by(model_version=model).first()
+        if checkpoint is not None:
+            print(f"Checkpoint: memory id {checkpoint.last_memory_id}, "
+                  f"{checkpoint.rows_reembedded} re-embedded so far"
+                  f"{', pass finished' if checkpoint.finished_at else ''}")
+        if dry_run or not stale:
+            return 0
+
+        started = time.perf_counter()
+        reembedded = memory_system.reembed_stale_memories(
+            batch_size=batch_size, interval=interval, max_batches=max_batches
+        )
+        elapsed = time.perf_counter() - started
+        print(f"Re-embedded {reembedded} memories ({reembedded / elapsed if elapsed else 0:.0f} memories/s)")
+        return reembedded
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    reembed_memories(
+        batch_size=args.batch_size,
+        interval=args.interval,
+        max_batches=args.max_batches,
+        dry_run=args.dry_run
+    )
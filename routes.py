@@ -1,7 +1,7 @@
 import os
 import json
 from datetime import datetime
-from flask import session, redirect, url_for, render_template, flash, request, jsonify
+from flask import session, redirect, url_for, render_template, flash, request, jsonify, Response, stream_with_context
 from app import app, db
 from replit_auth import require_login, make_replit_blueprint
 from flask_login import current_user, login_required
@@ -296,8 +296,47 @@ def process_chat():
     db.session.add(bot_message)
     db.session.commit()
     
+    # Extract memories from the new turns without holding up the reply
+    from memory_system import extract_memories_in_background
+    extract_memories_in_background(current_user.id, conversation.id)
+    
     # Return the response
     return jsonify({
         'response': bot_response,
         'timestamp': datetime.utcnow().isoformat()
-    })
\ No newline at end of file
+    })
+
+@app.route('/api/memory_index_status')
+@require_login
+def memory_index_status():
+    """Report progress of the memory index warm load"""
+    from memory_system import get_memory_index_status
+    return jsonify(get_memory_index_status())
+
+@app.route('/api/memories/export')
+@require_login
+def export_memories():
+    """Stream the current user's memories as NDJSON, one memory per line"""
+    from memory_system import export_memories as iter_memories
+    
+    def generate():
+        for memory in iter_memories(current_user.id):
+            yield json.dumps(memory) + "\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename=memories.ndjson'}
+    )
+
+@app.route('/api/memories/import', methods=['POST'])
+@require_login
+def import_memories():
+    """Bulk-add memories from an NDJSON request body, read a line at a time"""
+    from memory_system import import_memories as add_memories, iter_ndjson
+    try:
+        report = add_memories(current_user, iter_ndjson(request.stream),
+                              dedup=request.args.get('dedup'))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(report)
@@ -39,6 +39,8 @@ def send_telegram_message(chat_id, text, token=None):
         return False
 from models import User, Conversation, Message, MemoryEntry, FaceImage
 import memory_system
+import contact_store
+import message_search
 from config import ACTIVE_BOT_TOKEN, ENVIRONMENT
 import manus_integration
 import face_profile_finder
@@ -72,6 +74,7 @@ class EventLoopManager:
 # Keep these next imports to maintain compatibility with the import error checking
 import google_services
 import document_processor
+import document_chunks
 
 # Try to import Telegram packages, but provide fallbacks if not available
 # This allows development and testing without the telegram package
@@ -337,6 +340,34 @@ async def handle_help(update: Update, context: CallbackContext) -> int:
 
     return MAIN_MENU
 
+def last_discussed_response(user, topic, before_id=None):
+    """Reply to "when did we last discuss <topic>?" from the user's most recent matching message."""
+    # Skip earlier rounds of this same question and its answers
+    matches = [
+        match for match in message_search.search_messages(user.id, topic, limit=10, before_id=before_id)
+        if not message_search.last_discussed_topic(match["content"])
+        and not match["content"].startswith(("We last discussed", "I couldn't find any earlier conversation"))
+    ]
+    if not matches:
+        return f"I couldn't find any earlier conversation about {topic}."
+    match = matches[0]
+    when = datetime.utcfromtimestamp(match["timestamp_ms"] / 1000).strftime("%B %d, %Y at %H:%M UTC")
+    speaker = "You" if match["is_user"] else "I"
+    excerpt = match["content"] if len(match["content"]) <= 200 else match["content"][:200] + "..."
+    return f"We last discussed {topic} on {when}. {speaker} said:\n\n\"{excerpt}\""
+
+def related_documents_response(user, topic):
+    """Reply to "find documents related to <topic>" with the best matching passage of each document."""
+    passages = document_chunks.search_passages(user.id, topic, limit=3, max_per_document=1)
+    if not passages:
+        return f"I couldn't find any documents related to {topic}."
+    lines = [f"Documents related to {topic}:"]
+    for passage in passages:
+        excerpt = " ".join(passage["text"].split())
+        excerpt = excerpt if len(excerpt) <= 300 else excerpt[:300] + "..."
+        lines.append(f"\n{passage['title'] or 'Untitled Document'}:\n\"{excerpt}\"")
+    return "\n".join(lines)
+
 async def process_message(update: Update, context: CallbackContext) -> int:
     """Process user messages using OpenManus framework."""
     user = update.effective_user
@@ -442,6 +473,7 @@ async def process_message(update: Update, context: CallbackContext) -> int:
         return ConversationHandler.END
 
     # Save user message to database
+    message = None
     if 'conversation_id' in context.user_data:
         message = Message(
             conversation_id=context.user_data['conversation_id'],
@@ -452,8 +484,17 @@ async def process_message(update: Update, context: CallbackContext) -> int:
         db.session.commit()
 
     try:
-        # Process message with OpenManus framework
-        response = manus_integration.process_message(db_user, user_message, context.user_data.get('current_state', MAIN_MENU))
+        topic = message_search.last_discussed_topic(user_message)
+        document_topic = document_chunks.related_documents_topic(user_message)
+        if topic:
+            # Answered from the chat history index, without a model call
+            response = last_discussed_response(db_user, topic, before_id=message.id if message else None)
+        elif document_topic:
+            # Answered from the document passage index, without a model call
+            response = related_documents_response(db_user, document_topic)
+        else:
+            # Process message with OpenManus framework
+            response = manus_integration.process_message(db_user, user_message, context.user_data.get('current_state', MAIN_MENU))
 
         # Save bot response to database
         if 'conversation_id' in context.user_data:
@@ -467,6 +508,10 @@ async def process_message(update: Update, context: CallbackContext) -> int:
 
         await update.message.reply_text(response)
 
+        # Extract memories from the new turns without holding up the reply
+        if 'conversation_id' in context.user_data:
+            memory_system.extract_memories_in_background(db_user.id, context.user_data['conversation_id'])
+
         # Return to main menu for simplicity
         # In a more complex implementation, we would determine the next state based on the message content
         return context.user_data.get('current_state', MAIN_MENU)
@@ -662,8 +707,23 @@ async def process_photo(bot, user, file_path, chat_id):
             
             # Save to memory system if clearly a business card
             memory_title = card_data.get('name', 'Unknown Contact')
-            memory_content = json.dumps(card_data)
-            memory_entry = memory_system.add_memory(user, 'contact', memory_title, memory_content)
+            existing_contact = contact_store.find_duplicate_contact(user.id, card_data)
+            if existing_contact:
+                # Same person as a saved contact: fill in their card, keeping stored fields the new scan left empty
+                merged_card = memory_system._merge_fields(contact_store.parse_card(existing_contact.memory.content), card_data)
+                memory_entry = memory_system.update_memory(existing_contact.memory_id, content=json.dumps(merged_card))
+            else:
+                memory_content = json.dumps(card_data)
+                # A saved contact with the same name but nothing else in common may be someone else: flag, don't merge
+                namesakes = contact_store.find_contacts_named(user.id, card_data.get('name'))
+                if namesakes:
+                    memory_entry = memory_system.add_memory(user, 'contact', memory_title, memory_content,
+                                                            metadata={'duplicate_of': namesakes[0].memory_id},
+                                                            dedup='flag')
+                else:
+                    memory_entry = memory_system.add_memory(user, 'contact', memory_title, memory_content)
+            if memory_entry is not None and card_data.get('company'):
+                memory_system.link_entity(user, memory_entry, 'company', card_data['company'], 'works_at')
             
             # Send response
             await bot.send_message(
@@ -725,6 +785,9 @@ async def cancel(update: Update, context: CallbackContext) -> int:
             conversation.end_time = datetime.utcnow()
             db.session.commit()
 
+            # Extract whatever the conversation left unprocessed
+            memory_system.extract_memories_in_background(conversation.user_id, conversation.id, min_messages=1)
+
     await update.message.reply_text(
         "Conversation ended. Type /start to begin a new conversation.",
         reply_markup=ReplyKeyboardRemove()